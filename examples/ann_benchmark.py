@@ -0,0 +1,72 @@
+﻿"""Отчет recall/задержка для вариантов ANN-индекса
+
+Примеры:
+    python -m examples.ann_benchmark --index-dir faiss_index
+    python -m examples.ann_benchmark --synthetic 200000 --queries 500
+"""
+
+import argparse
+import json
+
+import faiss
+import numpy as np
+
+from src.core.storage.ann_index import format_report, recall_latency_report
+
+CONFIGS = {
+    "flat": ("flat", {}),
+    "hnsw ef=32": ("hnsw", {"efSearch": 32}),
+    "hnsw ef=64": ("hnsw", {"efSearch": 64}),
+    "hnsw ef=128": ("hnsw", {"efSearch": 128}),
+    "ivf_flat nprobe=8": ("ivf_flat", {"nprobe": 8}),
+    "ivf_flat nprobe=32": ("ivf_flat", {"nprobe": 32}),
+    "ivf_pq nprobe=16": ("ivf_pq", {"nprobe": 16}),
+    "ivf_pq nprobe=64": ("ivf_pq", {"nprobe": 64}),
+}
+
+
+def load_vectors(index_dir: str) -> np.ndarray:
+    """Векторы из сохраненного индекса (нужен индекс с хранением векторов)"""
+    index = faiss.read_index(f"{index_dir}/faiss.index")
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def synthetic_vectors(n: int, dim=384, clusters=1000, seed=0) -> np.ndarray:
+    """Нормированные векторы, сгруппированные вокруг случайных центров"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)]
+    vectors += 1.5 * rng.normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--index-dir", help="каталог с faiss.index")
+    source.add_argument("--synthetic", type=int, help="число синтетических векторов")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--json", help="сохранить отчет в JSON")
+    args = parser.parse_args()
+
+    vectors = (
+        load_vectors(args.index_dir)
+        if args.index_dir
+        else synthetic_vectors(args.synthetic)
+    )
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + 0.05 * rng.normal(size=queries.shape).astype(np.float32)
+
+    print(f"📊 Векторов: {len(vectors)}, запросов: {len(queries)}, k={args.k}\n")
+    report = recall_latency_report(vectors, queries, CONFIGS, k=args.k)
+    print(format_report(report))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+﻿"""Перенос каталога индекса llama_index (docstore.json) в формат SegmentStore
+
+Эмбеддинги не пересчитываются: векторы берутся из faiss.index, текст и
+метаданные чанков - из docstore.json, и записываются в chunks.sqlite.
+
+Пример:
+    python -m examples.migrate_index --index-dir faiss_index
+"""
+
+import argparse
+from pathlib import Path
+
+from src.core.storage.index_migration import (
+    LLAMA_INDEX_FILES,
+    has_llama_index_layout,
+    migrate_index_dir,
+)
+
+
+def dir_size(path: Path, names=None) -> int:
+    return sum(
+        file.stat().st_size
+        for file in path.rglob("*")
+        if file.is_file() and (names is None or file.name in names)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--index-dir", default="faiss_index")
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--metric", default="ip", choices=("ip", "l2"))
+    args = parser.parse_args()
+
+    index_dir = Path(args.index_dir)
+    if not has_llama_index_layout(index_dir):
+        print(f"🟡 В {index_dir} нет индекса llama_index")
+        return
+
+    before = dir_size(index_dir, LLAMA_INDEX_FILES)
+    index = migrate_index_dir(index_dir, args.index_type, metric=args.metric)
+    after = dir_size(index_dir)
+    print(
+        f"✅ Перенесено чанков: {len(index)}, "
+        f"размер на диске: {before / 2**20:.1f} -> {after / 2**20:.1f} МБ"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
-﻿import os
+﻿import json
+import os
 from dotenv import load_dotenv
 from .core.rag_system import RAGSystem
 from .interface.chat_interface import ChatInterface
@@ -16,7 +17,25 @@ def main():
             "Инструкция: https://github.com/yourname/mchs-ai-assistant#setup"
         )
 
-    rag_system = RAGSystem(mistral_api_key)
+    # Необязательный список OpenAI-совместимых эндпоинтов в JSON:
+    # [{"base_url": "...", "api_key": "...", "model": "..."}, ...]
+    llm_endpoints = os.getenv("LLM_ENDPOINTS")
+    llm_endpoints = json.loads(llm_endpoints) if llm_endpoints else None
+
+    # Быстрый старт: индекс открывается через mmap, чанки читаются по требованию
+    index_fast_start = os.getenv("INDEX_FAST_START", "").lower() in ("1", "true")
+
+    # Семантический кэш ответов: SEMANTIC_CACHE=0 отключает, порог близости 0-1
+    semantic_cache = os.getenv("SEMANTIC_CACHE", "1").lower() not in ("0", "false")
+    semantic_cache_threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+
+    rag_system = RAGSystem(
+        mistral_api_key,
+        llm_endpoints=llm_endpoints,
+        index_fast_start=index_fast_start,
+        semantic_cache=semantic_cache,
+        semantic_cache_threshold=semantic_cache_threshold,
+    )
     chat = ChatInterface(rag_system)
     chat.start_chat()
 
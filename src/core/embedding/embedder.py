@@ -1,16 +1,103 @@
-﻿import numpy as np
+﻿import threading
+from collections import OrderedDict
+
+import numpy as np
 from sentence_transformers import SentenceTransformer
 
+from .embedding_cache import EmbeddingCache
+
 
 class OptimizedEmbedder:
-    def __init__(self, model_name="sentence-transformers/all-MiniLM-L6-v2"):
+    def __init__(
+        self,
+        model_name="sentence-transformers/all-MiniLM-L6-v2",
+        batch_size=64,
+        cache_dir=None,
+        cache_size=100_000,
+        query_cache_size=256,
+    ):
+        self.model_name = model_name
         self.model = SentenceTransformer(model_name)
+        self.batch_size = batch_size
+        self.query_cache_size = query_cache_size
+        self._query_cache = OrderedDict()
+        self._query_lock = threading.Lock()
+        self.cache = None
+        if cache_dir:
+            self.cache = EmbeddingCache(
+                cache_dir,
+                model_name=model_name,
+                dim=self.model.get_sentence_embedding_dimension(),
+                max_entries=cache_size,
+            )
 
     def embed(self, texts: list[str]) -> np.ndarray:
+        if self.cache is None:
+            return self._encode(texts)
+
+        vectors, missing = self.cache.get_many(texts)
+        if missing:
+            missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+            new_vectors = self._encode(missing_texts)
+            positions = {text: i for i, text in enumerate(missing_texts)}
+            for i in missing:
+                vectors[i] = new_vectors[positions[texts[i]]]
+            self.cache.put_many(missing_texts, new_vectors)
+        return vectors
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """Эмбеддинг запроса с LRU-кэшем недавних запросов в памяти
+
+        Вектор общий для всех, кто спросил тот же запрос, поэтому он
+        возвращается только для чтения. Дисковый кэш чанков и его блокировка
+        не используются: запросы редко повторяют тексты документов.
+        """
+        with self._query_lock:
+            vector = self._query_cache.get(query)
+            if vector is not None:
+                self._query_cache.move_to_end(query)
+                return vector
+
+        vector = self._encode([query])[0].copy()
+        vector.setflags(write=False)
+        with self._query_lock:
+            self._query_cache[query] = vector
+            if len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+        return vector
+
+    def _encode(self, texts: list[str]) -> np.ndarray:
         return self.model.encode(
             texts,
             convert_to_numpy=True,
             normalize_embeddings=True,
             device="cpu",
             show_progress_bar=False,
+            batch_size=self.batch_size,
         )
+
+    def embed_batched(self, texts: list[str], batch_size: int = None) -> np.ndarray:
+        """Пакетное получение эмбеддингов для больших наборов текстов
+
+        Тексты сортируются по длине, чтобы в один пакет попадали строки
+        близкого размера, и каждый пакет уходит в embed одним вызовом.
+        Порядок результатов совпадает с порядком входных текстов.
+        """
+        batch_size = batch_size or self.batch_size
+        if not texts:
+            dim = self.model.get_sentence_embedding_dimension()
+            return np.zeros((0, dim), dtype=np.float32)
+
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        result = None
+        for start in range(0, len(order), batch_size):
+            batch_ids = order[start : start + batch_size]
+            vectors = self.embed([texts[i] for i in batch_ids])
+            if result is None:
+                result = np.empty((len(texts), vectors.shape[1]), dtype=vectors.dtype)
+            result[batch_ids] = vectors
+        return result
+
+    def cache_stats(self) -> dict:
+        """Статистика дискового кэша эмбеддингов"""
+        return self.cache.stats() if self.cache else {}
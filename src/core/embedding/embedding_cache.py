@@ -0,0 +1,191 @@
+﻿import hashlib
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+from filelock import FileLock
+
+
+class EmbeddingCache:
+    """Дисковый кэш эмбеддингов с адресацией по содержимому
+
+    Векторы хранятся в memory-mapped массиве float32, рядом лежат ключи
+    (sha1 от имени модели и текста) и счетчики последнего обращения.
+    При заполнении вытесняются записи, к которым дольше всего не обращались.
+
+    Кэш может использоваться несколькими процессами (например, процессом
+    пересборки индекса): обращения к файлам идут под файловой блокировкой
+    cache.lock, а счетчик поколений generation.i64 меняется при каждой
+    записи, и остальные процессы перечитывают таблицу слотов.
+    """
+
+    KEY_SIZE = 20
+
+    def __init__(self, cache_dir, model_name: str, dim: int, max_entries=100_000):
+        self.cache_dir = Path(cache_dir)
+        self.model_name = model_name
+        self.dim = dim
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._file_lock = FileLock(str(self.cache_dir / "cache.lock"))
+        with self._file_lock:
+            self._open()
+
+    def _open(self):
+        """Открытие файлов кэша, сброс при смене модели или размерности"""
+        meta_path = self.cache_dir / "meta.json"
+        meta = {
+            "model_name": self.model_name,
+            "dim": self.dim,
+            "max_entries": self.max_entries,
+        }
+
+        mode = "r+"
+        try:
+            if json.loads(meta_path.read_text(encoding="utf-8")) != meta:
+                print("🟡 Параметры кэша эмбеддингов изменились, кэш сброшен")
+                mode = "w+"
+        except (OSError, ValueError):
+            mode = "w+"
+
+        self._vectors = np.memmap(
+            self.cache_dir / "vectors.f32",
+            dtype=np.float32,
+            mode=mode,
+            shape=(self.max_entries, self.dim),
+        )
+        self._keys = np.memmap(
+            self.cache_dir / "keys.bin",
+            dtype=np.uint8,
+            mode=mode,
+            shape=(self.max_entries, self.KEY_SIZE),
+        )
+        self._ticks = np.memmap(
+            self.cache_dir / "ticks.i64",
+            dtype=np.int64,
+            mode=mode,
+            shape=(self.max_entries,),
+        )
+        generation_path = self.cache_dir / "generation.i64"
+        self._generation_map = np.memmap(
+            generation_path,
+            dtype=np.int64,
+            mode="r+" if mode == "r+" and generation_path.exists() else "w+",
+            shape=(1,),
+        )
+        if mode == "w+":
+            meta_path.write_text(json.dumps(meta), encoding="utf-8")
+        self._load_slots()
+
+    def _load_slots(self):
+        """Таблица слотов по файлам кэша"""
+        used = np.flatnonzero(self._ticks)
+        self._slots = {self._keys[slot].tobytes(): int(slot) for slot in used}
+        self._free = [int(slot) for slot in np.flatnonzero(self._ticks == 0)[::-1]]
+        self._clock = int(self._ticks.max()) if len(used) else 0
+        self._generation = int(self._generation_map[0])
+
+    def _sync(self):
+        """Перечитывание слотов, если кэш менял другой процесс"""
+        if int(self._generation_map[0]) != self._generation:
+            self._load_slots()
+
+    def _key(self, text: str) -> bytes:
+        return hashlib.sha1(f"{self.model_name}\0{text}".encode("utf-8")).digest()
+
+    def get_many(self, texts: list):
+        """Поиск эмбеддингов в кэше
+
+        Возвращает массив векторов и список позиций текстов, которых нет в кэше.
+        Строки массива для отсутствующих текстов не заполнены.
+        """
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        missing = []
+
+        with self._lock, self._file_lock:
+            self._sync()
+            for i, text in enumerate(texts):
+                slot = self._slots.get(self._key(text))
+                if slot is None:
+                    missing.append(i)
+                    continue
+                vectors[i] = self._vectors[slot]
+                self._clock += 1
+                self._ticks[slot] = self._clock
+
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        return vectors, missing
+
+    def put_many(self, texts: list, vectors: np.ndarray):
+        """Сохранение новых эмбеддингов в кэш"""
+        with self._lock, self._file_lock:
+            self._sync()
+            entries = {}
+            for text, vector in zip(texts, vectors):
+                entries[self._key(text)] = vector
+
+            new_keys = [key for key in entries if key not in self._slots]
+            new_keys = new_keys[-self.max_entries :]
+            slots = self._allocate_slots(len(new_keys))
+            for key, slot in zip(new_keys, slots):
+                self._keys[slot] = np.frombuffer(key, dtype=np.uint8)
+                self._slots[key] = slot
+
+            written = []
+            for key, vector in entries.items():
+                slot = self._slots.get(key)
+                if slot is not None:
+                    self._vectors[slot] = vector
+                    written.append(slot)
+
+            self._vectors.flush()
+            self._keys.flush()
+
+            # Счетчик пишется последним: ненулевой тик означает целую запись
+            for slot in written:
+                self._clock += 1
+                self._ticks[slot] = self._clock
+            self._ticks.flush()
+
+            self._generation += 1
+            self._generation_map[0] = self._generation
+            self._generation_map.flush()
+
+    def _allocate_slots(self, count: int) -> list:
+        """Выделение слотов, при необходимости с вытеснением по LRU"""
+        slots = [self._free.pop() for _ in range(min(count, len(self._free)))]
+        shortage = count - len(slots)
+        if shortage <= 0:
+            return slots
+
+        ticks = np.array(self._ticks)
+        ticks[slots] = np.iinfo(np.int64).max
+        victims = np.argpartition(ticks, shortage - 1)[:shortage]
+        for slot in victims:
+            slot = int(slot)
+            del self._slots[self._keys[slot].tobytes()]
+            self._ticks[slot] = 0
+            slots.append(slot)
+
+        self._ticks.flush()
+        self.evictions += shortage
+        return slots
+
+    def stats(self) -> dict:
+        """Статистика попаданий в кэш"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._slots),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
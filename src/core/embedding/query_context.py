@@ -0,0 +1,23 @@
+﻿class QueryContext:
+    """Контекст обработки одного запроса
+
+    Эмбеддинг запроса вычисляется один раз при первом обращении и
+    используется всеми этапами: выбором промпта и поиском по индексу.
+    Эмбеддинг отдается только для чтения: эмбеддер может хранить тот же
+    массив в своем кэше. В sources после поиска лежат файлы, из которых
+    взят контекст.
+    """
+
+    def __init__(self, query: str, embedder):
+        self.query = query
+        self.sources = set()
+        self._embedder = embedder
+        self._embedding = None
+
+    @property
+    def embedding(self):
+        if self._embedding is None:
+            embedding = self._embedder.embed_query(self.query).view()
+            embedding.setflags(write=False)
+            self._embedding = embedding
+        return self._embedding
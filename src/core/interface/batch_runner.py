@@ -0,0 +1,120 @@
+﻿import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+
+class BatchRunner:
+    """Параллельная пакетная обработка вопросов
+
+    Каждый результат сразу дописывается строкой в JSONL-файл, поэтому
+    прерванный пакет можно продолжить с тем же файлом: вопросы, на которые
+    уже есть ответ, пропускаются.
+    """
+
+    def __init__(self, process_fn, workers=4):
+        self.process_fn = process_fn
+        self.workers = workers
+
+    def run(self, questions: list, results_path) -> list:
+        """Обработка вопросов, возвращает результаты в порядке вопросов"""
+        results_path = Path(results_path)
+        done = self._load_done(results_path)
+        pending = [q for q in dict.fromkeys(questions) if q not in done]
+
+        if done:
+            print(f"♻️ Найдено готовых ответов: {len(done)}, продолжаю обработку")
+        if not pending:
+            return [done[q] for q in questions if q in done]
+
+        print(
+            f"⚙️ Потоков обработки: {self.workers}, осталось вопросов: {len(pending)}"
+        )
+        started = time.monotonic()
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="batch")
+
+        try:
+            with open(results_path, "a", encoding="utf-8") as out:
+                futures = [pool.submit(self._process_one, q) for q in pending]
+                for finished, future in enumerate(as_completed(futures), 1):
+                    record = future.result()
+                    self._append(out, record)
+                    if not record.get("error"):
+                        done[record["question"]] = record
+                    self._print_progress(finished, len(pending), started, record)
+
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            print(
+                f"\n⏸ Обработка прервана. Готовые ответы сохранены в {results_path}, "
+                "повторный запуск с тем же списком продолжит пакет"
+            )
+            raise
+
+        pool.shutdown()
+        return [done[q] for q in questions if q in done]
+
+    def _process_one(self, question: str) -> dict:
+        started = time.monotonic()
+        # process_fn сообщает о сбое исключением (LLMRequestError) или пустым ответом
+        try:
+            answer = self.process_fn(question)
+            error = not isinstance(answer, str) or not answer
+        except Exception as e:
+            answer = f"Ошибка: {str(e)}"
+            error = True
+
+        record = {
+            "question": question,
+            "answer": answer if isinstance(answer, str) else "",
+            "elapsed": round(time.monotonic() - started, 2),
+            "timestamp": datetime.now().isoformat(),
+        }
+        if error:
+            record["error"] = True
+        return record
+
+    def _append(self, out, record: dict):
+        """Запись результата с немедленным сбросом на диск"""
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+        os.fsync(out.fileno())
+
+    def _load_done(self, results_path: Path) -> dict:
+        """Ответы из предыдущего запуска (оборванная последняя строка игнорируется)"""
+        done = {}
+        if not results_path.exists():
+            return done
+
+        with open(results_path, "r", encoding="utf-8") as f:
+            content = f.read()
+        for line in content.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if not record.get("error"):
+                done[record["question"]] = record
+
+        if content and not content.endswith("\n"):
+            with open(results_path, "a", encoding="utf-8") as f:
+                f.write("\n")
+        return done
+
+    def _print_progress(self, finished: int, total: int, started: float, record):
+        elapsed = time.monotonic() - started
+        eta = elapsed / finished * (total - finished)
+        status = "❌" if record.get("error") else "✅"
+        print(
+            f"{status} [{finished}/{total}] {finished / total:.0%} | "
+            f"прошло {self._format_duration(elapsed)} | "
+            f"осталось ~{self._format_duration(eta)} | {record['question'][:60]}"
+        )
+
+    @staticmethod
+    def _format_duration(seconds: float) -> str:
+        minutes, seconds = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
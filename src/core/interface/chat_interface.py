@@ -1,6 +1,18 @@
-﻿class ChatInterface:
-    def __init__(self, rag_system: RAGSystem):
+﻿import hashlib
+import json
+from datetime import datetime
+from functools import partial
+
+from ..llm.mistral_client import LLMRequestError
+from ..rag_system import RAGSystem
+from .batch_runner import BatchRunner
+
+
+class ChatInterface:
+    def __init__(self, rag_system: RAGSystem, stream_mode=True, batch_workers=4):
         self.rag = rag_system
+        self.stream_mode = stream_mode
+        self.batch_workers = batch_workers
         self._print_welcome()
         self.batch_mode = False
         self.question_queue = []
@@ -18,7 +30,10 @@
             "/промпты - список всех шаблонов\n"
             "/история - последние ответы\n"
             "/сброс_промптов - сброс к начальному шаблону\n"
+            "/поток - включить/выключить потоковый вывод ответов\n"
             "/отладка - техническая информация\n"
+            "/пересборка - полная пересборка индекса в фоне\n"
+            "/откат_индекса - вернуть индекс до последней пересборки\n"
             "/выход - завершение работы\n"
             "───────────────────────────────"
         )
@@ -48,16 +63,81 @@
             self._show_history()
         elif input_text == "/сброс_промптов":
             self._reset_prompts()
+        elif input_text == "/поток":
+            self._toggle_stream_mode()
         elif input_text == "/отладка":
             self._show_debug_info()
+        elif input_text == "/пересборка":
+            self._rebuild_index()
+        elif input_text == "/откат_индекса":
+            self.rag.vector_store.rollback_index()
         else:
             self._generate_response(input_text)
 
     def _generate_response(self, query: str):
         """Генерация ответа на запрос с проверкой валидации"""
-        response = self.rag.process_query(query)
+        if self.stream_mode:
+            self._stream_response(query)
+            return
+
+        try:
+            response = self.rag.process_query(query)
+        except LLMRequestError as e:
+            print(f"\n❌ Ошибка: {str(e)}")
+            return
         print(f"\n🤖 Бот: {response}")
 
+    def _stream_response(self, query: str):
+        """Потоковый вывод ответа, результат проверки дописывается по готовности"""
+        try:
+            stream = self.rag.process_query_stream(query)
+            print("\n🤖 Бот: ", end="", flush=True)
+            try:
+                for token in stream:
+                    print(token, end="", flush=True)
+            finally:
+                print()
+
+            if stream.review is None:
+                print("Не удалось сформировать ответ")
+                return
+
+            print("⏳ Проверка ответа...", flush=True)
+            validation, recommendation = stream.review.result()
+            print(self._format_validation_verdict(validation))
+            if recommendation:
+                print(f"\n---\n🔍 Рекомендация:\n{recommendation}")
+
+        except Exception as e:
+            print(f"\n❌ Ошибка: {str(e)}")
+
+    def _format_validation_verdict(self, validation: dict) -> str:
+        """Краткий итог проверки ответа"""
+
+        def score(key):
+            return "?" if validation[key] is None else validation[key]
+
+        timed_out = validation.get("timed_out")
+        relevance = validation["relevance"]
+        if (relevance is not None and relevance < 3) or validation["accuracy"] is False:
+            mark = "⚠️ Проверка не пройдена"
+        elif timed_out:
+            mark = f"⏳ Проверка не завершена (не проверено: {', '.join(timed_out)})"
+        else:
+            mark = "✅ Проверка пройдена"
+        sources = {True: "да", False: "нет", None: "?"}[validation["sources"]]
+        return (
+            f"{mark}: релевантность {score('relevance')}/5, "
+            f"полнота {score('completeness')}/5, "
+            f"ссылки на нормативы: {sources}"
+        )
+
+    def _toggle_stream_mode(self):
+        """Переключение потокового вывода"""
+        self.stream_mode = not self.stream_mode
+        state = "включен" if self.stream_mode else "выключен"
+        print(f"✅ Потоковый вывод {state}")
+
     def _start_batch_mode(self):
         """Активация пакетного режима"""
         self.batch_mode = True
@@ -81,18 +161,29 @@
             return
 
         print(f"\n🔍 Начинаю обработку {len(self.question_queue)} вопросов...")
-        results = []
-
-        for idx, question in enumerate(self.question_queue, 1):
-            print(f"\n📋 Вопрос {idx}/{len(self.question_queue)}: {question}")
-            response = self.rag.process_query(question)
-            results.append({"question": question, "answer": response})
-            print(f"🤖 Ответ: {response[:150]}...")
+        results_path = self._batch_journal_path(self.question_queue)
+        batch_id = results_path.rsplit(".", 1)[0]
+        runner = BatchRunner(
+            partial(self.rag.process_batch_query, batch_id=batch_id),
+            workers=self.batch_workers,
+        )
+        try:
+            results = runner.run(self.question_queue, results_path)
+        except KeyboardInterrupt:
+            self.rag.cancel_batch(batch_id)
+            return
 
-        self._save_batch_results(results)
+        self._save_batch_results(
+            [{"question": r["question"], "answer": r["answer"]} for r in results]
+        )
         self.question_queue = []
         print("\n✅ Пакетная обработка завершена!")
 
+    def _batch_journal_path(self, questions: list) -> str:
+        """Журнал пакета: один и тот же список вопросов пишет в один файл"""
+        digest = hashlib.sha1("\n".join(questions).encode("utf-8")).hexdigest()
+        return f"batch_journal_{digest[:12]}.jsonl"
+
     def _save_batch_results(self, results: list):
         """Сохранение результатов в JSON"""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M")
@@ -167,9 +258,20 @@
         self.rag.prompt_selector.prompts = [self.rag._default_prompt_template()]
         print("\n✅ Все шаблоны сброшены до начального состояния")
 
+    def _rebuild_index(self):
+        """Запуск полной пересборки индекса; ответы идут по текущей версии"""
+        try:
+            self.rag.vector_store.rebuild_index()
+            print("🔧 Пересборка индекса запущена в фоне")
+        except ValueError as e:
+            print(f"⚠️ {str(e)}")
+
     def _show_debug_info(self):
         """Техническая информация"""
         print("\nТехническая информация:")
-        print(f"▪ Размер индекса: {len(self.rag.vector_store.documents)} чанков")
+        print(f"▪ Размер индекса: {len(self.rag.vector_store.index or [])} чанков")
+        print(f"▪ Очередь обновлений: {self.rag.vector_store.ingestion_stats()}")
+        print(f"▪ Хранилище индекса: {self.rag.vector_store.store.stats()}")
+        print(f"▪ Версии индекса: {self.rag.vector_store.snapshot_stats()}")
         print(f"▪ Примеров обратной связи: {len(self.rag.feedback_examples)}")
         print(f"▪ Последний промпт: {self.rag.prompt_selector.prompts[-1][:200]}...")
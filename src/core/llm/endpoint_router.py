@@ -0,0 +1,125 @@
+﻿import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class Endpoint:
+    """OpenAI-совместимый эндпоинт с окном последних задержек и состоянием здоровья"""
+
+    def __init__(
+        self, base_url: str, api_key: str = None, model: str = None, name=None
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.model = model
+        self.name = name or self.base_url
+        self.latencies = deque(maxlen=200)
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.successes = 0
+        self.failures = 0
+
+    def is_healthy(self, now: float) -> bool:
+        return self.cooldown_until <= now
+
+    def typical_latency(self) -> float:
+        """Медиана задержки; эндпоинт без замеров считается быстрым"""
+        return float(np.median(self.latencies)) if self.latencies else 0.0
+
+
+class EndpointRouter:
+    """Выбор эндпоинта по здоровью и задержке
+
+    После failure_threshold ошибок подряд эндпоинт выводится из ротации
+    на cooldown секунд. Из здоровых выбирается эндпоинт с меньшим числом
+    ошибок подряд, затем с меньшей медианной задержкой и числом запросов
+    в работе. Общее окно задержек
+    используется для порога хеджирования.
+    """
+
+    def __init__(self, endpoints: list, failure_threshold=3, cooldown=30, window=500):
+        if not endpoints:
+            raise ValueError("Не задан ни один эндпоинт LLM")
+        self.endpoints = [
+            e if isinstance(e, Endpoint) else Endpoint(**e) for e in endpoints
+        ]
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def choose(self, exclude=()) -> Endpoint:
+        """Лучший здоровый эндпоинт вне exclude
+
+        Если таких нет, используется здоровый из исключенных (дубль уходит на
+        тот же эндпоинт), а если здоровых нет вовсе - тот, что раньше выйдет
+        из паузы.
+        """
+        now = time.monotonic()
+        with self._lock:
+            healthy = [
+                e for e in self.endpoints if e not in exclude and e.is_healthy(now)
+            ] or [e for e in self.endpoints if e.is_healthy(now)]
+            if healthy:
+                endpoint = min(
+                    healthy,
+                    key=lambda e: (
+                        e.consecutive_failures,
+                        e.typical_latency(),
+                        e.in_flight,
+                    ),
+                )
+            else:
+                endpoint = min(self.endpoints, key=lambda e: e.cooldown_until)
+            endpoint.in_flight += 1
+            return endpoint
+
+    def record_success(self, endpoint: Endpoint, latency: float = None):
+        with self._lock:
+            endpoint.in_flight -= 1
+            endpoint.successes += 1
+            endpoint.consecutive_failures = 0
+            endpoint.cooldown_until = 0.0
+            if latency is not None:
+                endpoint.latencies.append(latency)
+                self.latencies.append(latency)
+
+    def record_failure(self, endpoint: Endpoint):
+        with self._lock:
+            endpoint.in_flight -= 1
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= self.failure_threshold:
+                endpoint.cooldown_until = time.monotonic() + self.cooldown
+                print(
+                    f"⚠️ Эндпоинт {endpoint.name} выведен из ротации на {self.cooldown} с"
+                )
+
+    def release(self, endpoint: Endpoint):
+        """Завершение запроса без влияния на статистику (например, 429)"""
+        with self._lock:
+            endpoint.in_flight -= 1
+
+    def latency_percentile(self, percentile: float, min_samples=20):
+        """Перцентиль задержки по всем эндпоинтам; None, пока замеров мало"""
+        with self._lock:
+            if len(self.latencies) < min_samples:
+                return None
+            return float(np.percentile(self.latencies, percentile))
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                e.name: {
+                    "healthy": e.is_healthy(now),
+                    "in_flight": e.in_flight,
+                    "successes": e.successes,
+                    "failures": e.failures,
+                    "median_latency": round(e.typical_latency(), 3),
+                }
+                for e in self.endpoints
+            }
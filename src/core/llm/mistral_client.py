@@ -1,21 +1,90 @@
-﻿import requests
+﻿import asyncio
+import json
+import random
+import requests
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+from typing import Iterator
+
+from requests.adapters import HTTPAdapter
+
+from .endpoint_router import Endpoint, EndpointRouter
+from .rate_limiter import RateLimiter
+from .response_cache import ResponseCache
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+MISTRAL_API_URL = "https://api.mistral.ai/v1"
+
+
+class LLMRequestError(RuntimeError):
+    """Ответ модели не получен: тайм-аут, ошибка соединения или API"""
 
 
 class MistralAPIClient:
-    def __init__(self, api_key: str, model="mistral-medium", max_retries=3):
+    """Клиент chat/completions для Mistral и других OpenAI-совместимых API
+
+    Запрос уходит на лучший по здоровью и задержке эндпоинт из endpoints.
+    Если ответ задерживается дольше hedge_percentile-перцентиля последних
+    задержек, отправляется дубль (на другой эндпоинт, если он есть) и
+    используется первый успешный ответ. Доля дублей ограничена hedge_budget.
+
+    Authorization отправляется только эндпоинтам со своим api_key; эндпоинты
+    Mistral без ключа получают api_key клиента.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        model="mistral-medium",
+        max_retries=3,
+        pool_size=16,
+        cache: ResponseCache = None,
+        rate_limiter: RateLimiter = None,
+        endpoints: list = None,
+        hedge_percentile=95,
+        hedge_budget=0.1,
+    ):
         self.api_key = api_key
-        self.base_url = "https://api.mistral.ai/v1"
+        self.router = EndpointRouter(
+            endpoints or [Endpoint(MISTRAL_API_URL, api_key=api_key, name="mistral")]
+        )
+        for endpoint in self.router.endpoints:
+            if not endpoint.api_key and endpoint.base_url.startswith(MISTRAL_API_URL):
+                endpoint.api_key = api_key
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        self.sent = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._stats_lock = threading.Lock()
+        self._hedge_pool = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix="llm-http"
+        )
         self.model = model
         self.max_retries = max_retries
         self.timeout = 60
+        self.cache = cache
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.max_backoff = 30
 
-    def generate(self, prompt: str) -> str:
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @property
+    def base_url(self) -> str:
+        """Адрес основного эндпоинта"""
+        return self.router.endpoints[0].base_url
 
+    @base_url.setter
+    def base_url(self, value: str):
+        self.router.endpoints[0].base_url = value.rstrip("/")
+
+    def _build_payload(self, prompt: str, stream=False) -> dict:
         data = {
             "model": self.model,
             "messages": [{"role": "user", "content": prompt}],
@@ -24,32 +93,323 @@ class MistralAPIClient:
             "top_p": 0.9,
             "stop": ["\n##", "```"],
         }
+        if stream:
+            data["stream"] = True
+        return data
+
+    def _cache_key(self, data: dict, endpoint: Endpoint = None) -> str:
+        """Ключ кэша по модели эндпоинта, который отвечает на запрос"""
+        if endpoint is not None:
+            data = self._endpoint_payload(endpoint, data)
+        params = {
+            k: v for k, v in data.items() if k not in ("model", "messages", "stream")
+        }
+        return ResponseCache.make_key(
+            data["model"], params, data["messages"][-1]["content"]
+        )
+
+    def _cached(self, data: dict):
+        """Ответ из кэша от модели любого из эндпоинтов"""
+        if not self.cache:
+            return None
+        for key in dict.fromkeys(
+            self._cache_key(data, endpoint) for endpoint in self.router.endpoints
+        ):
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        return None
+
+    def generate(self, prompt: str) -> str:
+        """Ответ модели; если его получить не удалось - LLMRequestError"""
+        data = self._build_payload(prompt)
+        cached = self._cached(data)
+        if cached is not None:
+            return cached
 
+        tokens_reserved = self._estimate_tokens(prompt)
         for attempt in range(self.max_retries):
             try:
-                response = requests.post(
-                    f"{self.base_url}/chat/completions",
-                    headers=headers,
-                    json=data,
+                response, endpoint = self._post_hedged(data, tokens_reserved)
+
+                if response.status_code == 200:
+                    body = response.json()
+                    self.rate_limiter.record_success(
+                        body.get("usage", {}).get("total_tokens"), tokens_reserved
+                    )
+                    content = body["choices"][0]["message"]["content"].strip()
+                    if self.cache:
+                        self.cache.set(self._cache_key(data, endpoint), content)
+                    return content
+
+                print(
+                    f"API Error (attempt {attempt+1}): {response.status_code} - {response.text}"
+                )
+                if not self._handle_retryable_status(response, attempt):
+                    break
+
+            except requests.exceptions.Timeout:
+                print(f"⚠️ Тайм-аут запроса (попытка {attempt+1}/{self.max_retries})")
+                if attempt == self.max_retries - 1:
+                    raise LLMRequestError("превышено время ожидания ответа от сервера")
+
+                time.sleep(self._backoff_delay(attempt))
+
+            except Exception as e:
+                print(f"🚨 Критическая ошибка: {str(e)}")
+                raise LLMRequestError("нет соединения с сервером") from e
+
+        raise LLMRequestError("не удалось получить ответ после нескольких попыток")
+
+    def _post_hedged(self, data: dict, tokens_reserved: int):
+        """Запрос с дублем после порога задержки
+
+        Возвращает (ответ, эндпоинт) для первого ответа 200. Порог отсчитывается
+        с момента отправки основного запроса, то есть после ожидания в
+        ограничителе. Если успешного ответа нет, возвращается последний
+        полученный ответ либо пробрасывается последнее исключение.
+        """
+        primary = self.router.choose()
+        started = threading.Event()
+        future = self._hedge_pool.submit(
+            self._send, primary, data, tokens_reserved, started
+        )
+        future.add_done_callback(lambda _: started.set())
+        futures = {future: primary}
+        with self._stats_lock:
+            self.sent += 1
+
+        hedge_delay = self.router.latency_percentile(self.hedge_percentile)
+        if hedge_delay is not None:
+            started.wait()
+            done, _ = wait(futures, timeout=hedge_delay)
+            if not done and self._reserve_hedge():
+                backup = self.router.choose(exclude=(primary,))
+                print(
+                    f"⏱ Ответ дольше {hedge_delay:.1f} с, дублирую запрос на {backup.name}"
+                )
+                future = self._hedge_pool.submit(
+                    self._send, backup, data, tokens_reserved
+                )
+                futures[future] = backup
+
+        response, error = None, None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if result.status_code == 200:
+                    if len(futures) > 1 and futures[future] is not primary:
+                        with self._stats_lock:
+                            self.hedge_wins += 1
+                    return result, futures[future]
+                response = result, futures[future]
+
+        if response is not None:
+            return response
+        raise error
+
+    def _reserve_hedge(self) -> bool:
+        """Учет дубля, если он укладывается в hedge_budget"""
+        with self._stats_lock:
+            if self.hedged >= self.hedge_budget * self.sent + 1:
+                return False
+            self.hedged += 1
+            return True
+
+    def _send(
+        self,
+        endpoint: Endpoint,
+        data: dict,
+        tokens_reserved: int,
+        sending: threading.Event = None,
+    ):
+        """Один HTTP-запрос к эндпоинту с учетом лимитов и его статистики
+
+        sending устанавливается, когда ограничитель пропустил запрос.
+        """
+        try:
+            with self.rate_limiter.acquire(tokens_reserved):
+                if sending is not None:
+                    sending.set()
+                started = time.monotonic()
+                response = self.session.post(
+                    f"{endpoint.base_url}/chat/completions",
+                    json=self._endpoint_payload(endpoint, data),
+                    headers=self._endpoint_headers(endpoint),
                     timeout=self.timeout,
                 )
+        except Exception:
+            self.router.record_failure(endpoint)
+            raise
 
-                if response.status_code == 200:
-                    return response.json()["choices"][0]["message"]["content"].strip()
-                else:
-                    print(
-                        f"API Error (attempt {attempt+1}): {response.status_code} - {response.text}"
+        self._record_status(endpoint, response.status_code, started)
+        return response
+
+    def _record_status(self, endpoint: Endpoint, status_code: int, started):
+        if status_code == 200:
+            latency = time.monotonic() - started if started is not None else None
+            self.router.record_success(endpoint, latency)
+        elif status_code in RETRYABLE_STATUSES and status_code != 429:
+            self.router.record_failure(endpoint)
+        else:
+            self.router.release(endpoint)
+
+    @staticmethod
+    def _endpoint_payload(endpoint: Endpoint, data: dict) -> dict:
+        return {**data, "model": endpoint.model} if endpoint.model else data
+
+    @staticmethod
+    def _endpoint_headers(endpoint: Endpoint) -> dict:
+        if endpoint.api_key:
+            return {"Authorization": f"Bearer {endpoint.api_key}"}
+        return {}
+
+    def _estimate_tokens(self, prompt: str) -> int:
+        """Грубая оценка расхода токенов: промпт плюс типичная длина ответа"""
+        return len(prompt) // 3 + 512
+
+    def _handle_retryable_status(self, response, attempt: int) -> bool:
+        """Пауза перед повтором для 429/5xx; False - повтор бессмыслен"""
+        if response.status_code not in RETRYABLE_STATUSES:
+            return False
+
+        retry_after = self._retry_after(response)
+        if response.status_code == 429:
+            self.rate_limiter.record_throttle(retry_after)
+        if attempt < self.max_retries - 1:
+            time.sleep(retry_after or self._backoff_delay(attempt))
+        return True
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """Экспоненциальная задержка со случайным разбросом"""
+        return min(self.max_backoff, 2**attempt) * random.uniform(0.5, 1.0)
+
+    @staticmethod
+    def _retry_after(response):
+        """Значение Retry-After в секундах (число или HTTP-дата)"""
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    async def agenerate(self, prompt: str) -> str:
+        """Асинхронная генерация через общий пул соединений"""
+        return await asyncio.to_thread(self.generate, prompt)
+
+    def generate_stream(self, prompt: str) -> Iterator[str]:
+        """Потоковая генерация: токены отдаются по мере прихода из SSE-потока
+
+        Повторные попытки выполняются только до получения первого токена.
+        Если ответ не получен или оборвался на середине, итератор
+        завершается исключением LLMRequestError.
+        """
+        data = self._build_payload(prompt, stream=True)
+        cached = self._cached(data)
+        if cached is not None:
+            yield cached
+            return
+
+        received = False
+        parts = []
+        tokens_reserved = self._estimate_tokens(prompt)
+
+        for attempt in range(self.max_retries):
+            endpoint = None
+            try:
+                endpoint = self.router.choose()
+                with self.rate_limiter.acquire(tokens_reserved), self.session.post(
+                    f"{endpoint.base_url}/chat/completions",
+                    json=self._endpoint_payload(endpoint, data),
+                    headers=self._endpoint_headers(endpoint),
+                    timeout=self.timeout,
+                    stream=True,
+                ) as response:
+                    # длительность потока не входит в окно задержек для хеджирования
+                    self._record_status(endpoint, response.status_code, None)
+                    served, endpoint = endpoint, None
+                    if response.status_code != 200:
+                        print(
+                            f"API Error (attempt {attempt+1}): {response.status_code} - {response.text}"
+                        )
+                    else:
+                        for token in self._iter_sse_tokens(response):
+                            received = True
+                            parts.append(token)
+                            yield token
+
+                if response.status_code != 200:
+                    if not self._handle_retryable_status(response, attempt):
+                        break
+                    continue
+
+                self.rate_limiter.record_success()
+                if self.cache and parts:
+                    self.cache.set(
+                        self._cache_key(data, served), "".join(parts).strip()
                     )
+                return
 
             except requests.exceptions.Timeout:
+                if endpoint is not None:
+                    self.router.record_failure(endpoint)
                 print(f"⚠️ Тайм-аут запроса (попытка {attempt+1}/{self.max_retries})")
+                if received:
+                    raise LLMRequestError("ответ оборван: превышено время ожидания")
                 if attempt == self.max_retries - 1:
-                    return "Ошибка: превышено время ожидания ответа от сервера"
+                    raise LLMRequestError("превышено время ожидания ответа от сервера")
 
-                time.sleep(2**attempt)
+                time.sleep(self._backoff_delay(attempt))
 
             except Exception as e:
+                if endpoint is not None:
+                    self.router.record_failure(endpoint)
                 print(f"🚨 Критическая ошибка: {str(e)}")
-                return "Ошибка соединения с сервером"
+                if received:
+                    raise LLMRequestError("ответ оборван: потеряно соединение") from e
+                raise LLMRequestError("нет соединения с сервером") from e
+
+        raise LLMRequestError("не удалось получить ответ после нескольких попыток")
+
+    def _iter_sse_tokens(self, response) -> Iterator[str]:
+        """Разбор событий text/event-stream в фрагменты текста"""
+        response.encoding = "utf-8"
+        for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+
+            payload = line[len("data:") :].strip()
+            if payload == "[DONE]":
+                break
+
+            choices = json.loads(payload).get("choices") or [{}]
+            token = choices[0].get("delta", {}).get("content")
+            if token:
+                yield token
+
+    def close(self):
+        """Закрытие пула соединений"""
+        self._hedge_pool.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
 
-        return "Не удалось получить ответ после нескольких попыток"
+    def stats(self) -> dict:
+        """Статистика хеджирования и состояние эндпоинтов"""
+        with self._stats_lock:
+            stats = {
+                "sent": self.sent,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+            }
+        return {**stats, "endpoints": self.router.stats()}
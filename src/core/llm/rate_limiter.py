@@ -0,0 +1,129 @@
+﻿import threading
+import time
+from contextlib import contextmanager
+
+
+class TokenBucket:
+    """Ведро токенов с пополнением с постоянной скоростью"""
+
+    def __init__(self, per_minute: float, capacity: float = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float, now: float) -> float:
+        """Сколько секунд ждать, пока в ведре накопится amount"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, amount: float):
+        """Поправка после запроса: отрицательное значение списывает токены"""
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """Общий бюджет обращений к LLM API для всех вызывающих
+
+    - token bucket по числу запросов и по числу токенов в минуту;
+    - предел одновременных запросов, который вдвое уменьшается при
+      ответах 429 и плавно растет при успешных (AIMD);
+    - общая пауза по заголовку Retry-After.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute=60,
+        tokens_per_minute=500_000,
+        max_concurrency=8,
+        min_concurrency=1,
+    ):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency_limit = float(max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._cond = threading.Condition()
+
+        self.requests = 0
+        self.throttled = 0
+        self.waited_seconds = 0.0
+
+    @contextmanager
+    def acquire(self, tokens: int = 0):
+        """Ожидание разрешения на запрос с оценкой расхода токенов"""
+        self._wait_for_slot(tokens)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    def _wait_for_slot(self, tokens: int):
+        started = time.monotonic()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self.paused_until > now:
+                    wait = self.paused_until - now
+                elif self.in_flight >= int(self.concurrency_limit):
+                    wait = None
+                else:
+                    wait = max(
+                        self.request_bucket.time_until(1, now),
+                        self.token_bucket.time_until(tokens, now),
+                    )
+                    if wait == 0:
+                        self.request_bucket.consume(1)
+                        self.token_bucket.consume(tokens)
+                        self.in_flight += 1
+                        self.requests += 1
+                        self.waited_seconds += now - started
+                        return
+                self._cond.wait(timeout=wait)
+
+    def record_success(self, tokens_used: int = None, tokens_reserved: int = 0):
+        """Успешный ответ: рост предела параллельности и уточнение расхода токенов"""
+        with self._cond:
+            self.concurrency_limit = min(
+                self.max_concurrency,
+                self.concurrency_limit + 1 / self.concurrency_limit,
+            )
+            if tokens_used is not None:
+                self.token_bucket.adjust(tokens_reserved - tokens_used)
+            self._cond.notify_all()
+
+    def record_throttle(self, retry_after: float = None):
+        """Ответ 429: снижение параллельности и пауза для всех вызывающих"""
+        with self._cond:
+            self.throttled += 1
+            self.concurrency_limit = max(
+                self.min_concurrency, self.concurrency_limit / 2
+            )
+            if retry_after:
+                self.paused_until = max(
+                    self.paused_until, time.monotonic() + retry_after
+                )
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "in_flight": self.in_flight,
+                "concurrency_limit": round(self.concurrency_limit, 2),
+                "waited_seconds": round(self.waited_seconds, 2),
+            }
@@ -0,0 +1,294 @@
+﻿import contextvars
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_VALIDATION = 1
+PRIORITY_RECOMMENDATION = 2
+PRIORITY_BATCH = 3
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_VALIDATION: "validation",
+    PRIORITY_RECOMMENDATION: "recommendation",
+    PRIORITY_BATCH: "batch",
+}
+
+_priority_floor = contextvars.ContextVar("llm_priority_floor", default=None)
+_owner = contextvars.ContextVar("llm_owner", default=None)
+
+
+class ScheduledFuture(Future):
+    """Future вызова LLM с моментом начала выполнения
+
+    started устанавливается, когда вызов начал выполняться или завершился
+    без выполнения (отмена, истекший срок).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.started_at = None
+        self.add_done_callback(lambda _: self.started.set())
+
+    def run(self, fn, *args) -> bool:
+        """Выполнение fn в текущем потоке; False - вызов уже отменен"""
+        if not self.set_running_or_notify_cancel():
+            return False
+        self.started_at = time.monotonic()
+        self.started.set()
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            self.set_exception(e)
+        else:
+            self.set_result(result)
+        return True
+
+    def result_after_start(self, timeout: float, queue_timeout: float = None):
+        """Результат не позже timeout секунд от начала выполнения
+
+        Вызов, который не начался за queue_timeout секунд, отменяется.
+        Выполняющийся вызов прервать нельзя: по тайм-ауту его результат
+        просто не используется.
+        """
+        if not self.started.wait(queue_timeout):
+            self.cancel()
+            raise FutureTimeoutError()
+        if self.started_at is None:
+            return self.result(timeout=0)
+        remaining = timeout - (time.monotonic() - self.started_at)
+        try:
+            return self.result(timeout=max(remaining, 0))
+        except FutureTimeoutError:
+            self.cancel()
+            raise
+
+
+class _Request:
+    def __init__(self, prompt: str, priority: int, owner, deadline):
+        self.prompt = prompt
+        self.priority = priority
+        self.owner = owner
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.future = ScheduledFuture()
+
+
+class LLMScheduler:
+    """Планировщик исходящих вызовов LLM с классами приоритета
+
+    Воркеры всегда берут запрос из самого приоритетного непустого класса:
+    сначала генерация для оператора, затем валидация, затем рекомендации
+    и пакетная обработка. Внутри класса очереди разных владельцев (сессий,
+    пакетов) обслуживаются по кругу. Класс, первый запрос которого ждет
+    дольше aging секунд, обслуживается раньше более приоритетных, поэтому
+    пакетная обработка не голодает под нагрузкой. Запросы, которые отменил
+    вызывающий или у которых истек срок, не отправляются.
+    """
+
+    def __init__(self, client, workers=8, aging=30):
+        self.client = client
+        self.aging = aging
+        self._cond = threading.Condition()
+        self._queues = {priority: OrderedDict() for priority in PRIORITY_NAMES}
+        self._running = True
+
+        self.submitted = Counter()
+        self.completed = Counter()
+        self.cancelled = Counter()
+        self.expired = Counter()
+        self.wait_seconds = Counter()
+
+        self._workers = [
+            threading.Thread(
+                target=self._worker_loop, name=f"llm-worker-{i}", daemon=True
+            )
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(
+        self, prompt: str, priority=PRIORITY_INTERACTIVE, owner=None, deadline=None
+    ) -> ScheduledFuture:
+        """Постановка вызова в очередь; deadline - момент time.monotonic()"""
+        request = _Request(prompt, priority, owner, deadline)
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("Планировщик LLM остановлен")
+            self._queues[priority].setdefault(owner, deque()).append(request)
+            self.submitted[priority] += 1
+            self._cond.notify()
+        return request.future
+
+    def client_for(self, priority: int, owner=None) -> "ScheduledClient":
+        """Клиент с интерфейсом MistralAPIClient для заданного класса"""
+        return ScheduledClient(self, priority, owner)
+
+    @contextmanager
+    def priority(self, priority: int, owner=None):
+        """Понижение приоритета всех вызовов внутри блока (например, для пакета)
+
+        Вызовы получают класс не выше заданного и указанного владельца.
+        Контекст наследуется пулами, которые запускают задачи через
+        contextvars.copy_context().
+        """
+        floor_token = _priority_floor.set(priority)
+        owner_token = _owner.set(owner)
+        try:
+            yield
+        finally:
+            _priority_floor.reset(floor_token)
+            _owner.reset(owner_token)
+
+    def effective(self, priority: int, owner=None):
+        """Класс и владелец вызова с учетом контекста priority()"""
+        floor = _priority_floor.get()
+        if floor is not None:
+            priority = max(priority, floor)
+        return priority, _owner.get() if _owner.get() is not None else owner
+
+    def cancel_owner(self, owner) -> int:
+        """Отмена всех ожидающих вызовов владельца"""
+        cancelled = 0
+        with self._cond:
+            for priority, queues in self._queues.items():
+                for request in queues.pop(owner, ()):
+                    if request.future.cancel():
+                        cancelled += 1
+                        self.cancelled[priority] += 1
+        return cancelled
+
+    def queue_depths(self) -> dict:
+        """Число ожидающих вызовов по классам"""
+        with self._cond:
+            return {
+                PRIORITY_NAMES[priority]: sum(
+                    1
+                    for queue in queues.values()
+                    for request in queue
+                    if not request.future.cancelled()
+                )
+                for priority, queues in self._queues.items()
+            }
+
+    def stats(self) -> dict:
+        depths = self.queue_depths()
+        with self._cond:
+            return {
+                PRIORITY_NAMES[priority]: {
+                    "queued": depths[PRIORITY_NAMES[priority]],
+                    "submitted": self.submitted[priority],
+                    "completed": self.completed[priority],
+                    "cancelled": self.cancelled[priority],
+                    "expired": self.expired[priority],
+                    "avg_wait": (
+                        round(self.wait_seconds[priority] / self.completed[priority], 3)
+                        if self.completed[priority]
+                        else 0.0
+                    ),
+                }
+                for priority in PRIORITY_NAMES
+            }
+
+    def _starved(self, priority: int, now: float) -> bool:
+        """Первый запрос класса ждет дольше aging секунд"""
+        queues = self._queues[priority]
+        if not queues or self.aging is None:
+            return False
+        head = next(iter(queues.values()))[0]
+        return now - head.enqueued_at > self.aging
+
+    def _next_request(self):
+        """Следующий вызов: самый приоритетный класс, владельцы по кругу
+
+        Заждавшиеся классы (см. aging) идут первыми.
+        """
+        now = time.monotonic()
+        order = sorted(self._queues, key=lambda p: (not self._starved(p, now), p))
+        for priority in order:
+            queues = self._queues[priority]
+            while queues:
+                owner, queue = next(iter(queues.items()))
+                request = queue.popleft()
+                if queue:
+                    queues.move_to_end(owner)
+                else:
+                    del queues[owner]
+
+                if request.future.cancelled():
+                    self.cancelled[priority] += 1
+                    continue
+                if request.deadline is not None and time.monotonic() > request.deadline:
+                    request.future.cancel()
+                    self.expired[priority] += 1
+                    continue
+                return request
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                request = self._next_request()
+                while request is None:
+                    if not self._running:
+                        return
+                    self._cond.wait()
+                    request = self._next_request()
+
+            if not request.future.run(self.client.generate, request.prompt):
+                continue
+
+            waited = request.future.started_at - request.enqueued_at
+            with self._cond:
+                self.completed[request.priority] += 1
+                self.wait_seconds[request.priority] += waited
+
+    def shutdown(self):
+        """Остановка воркеров, ожидающие вызовы отменяются"""
+        with self._cond:
+            self._running = False
+            for queues in self._queues.values():
+                for queue in queues.values():
+                    for request in queue:
+                        request.future.cancel()
+                queues.clear()
+            self._cond.notify_all()
+
+
+class ScheduledClient:
+    """Обертка с интерфейсом MistralAPIClient, отправляющая вызовы через планировщик
+
+    Если вызывающий поток прерван до получения ответа, запрос снимается
+    с очереди. submit() ставит вызов в очередь без ожидания (для
+    параллельных проверок). Потоковая генерация идет напрямую: это всегда
+    ответ оператору.
+    """
+
+    def __init__(self, scheduler: LLMScheduler, priority: int, owner=None):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.owner = owner
+
+    def submit(self, prompt: str) -> ScheduledFuture:
+        """Постановка вызова в очередь класса с учетом контекста priority()"""
+        priority, owner = self.scheduler.effective(self.priority, self.owner)
+        return self.scheduler.submit(prompt, priority=priority, owner=owner)
+
+    def generate(self, prompt: str) -> str:
+        future = self.submit(prompt)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    def generate_stream(self, prompt: str):
+        return self.scheduler.client.generate_stream(prompt)
+
+    def __getattr__(self, name):
+        return getattr(self.scheduler.client, name)
@@ -1,4 +1,8 @@
-﻿import numpy as np
+﻿from typing import List
+
+import numpy as np
+
+from .prompt_storage import PromptStorage
 
 
 class PromptSelector:
@@ -37,12 +41,14 @@ class PromptSelector:
             self.embeddings = np.delete(self.embeddings, index, axis=0)
             self._save_to_storage()
 
-    def find_best_prompt(self, query: str) -> str:
+    def find_best_prompt(self, query: str, query_embedding=None) -> str:
         """Находит наиболее подходящий промпт для запроса"""
         if not self.prompts:
             return None
 
-        query_embed = self.embedder.embed([query])[0]
+        query_embed = query_embedding
+        if query_embed is None:
+            query_embed = self.embedder.embed([query])[0]
 
         similarities = np.dot(self.embeddings, query_embed)
         best_idx = np.argmax(similarities)
@@ -1,24 +1,119 @@
-﻿from .embedding.embedder import OptimizedEmbedder
-from .llm.mistral_client import MistralAPIClient
+﻿from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from typing import Dict, List
+
+from .embedding.embedder import OptimizedEmbedder
+from .embedding.query_context import QueryContext
+from .llm.mistral_client import LLMRequestError, MistralAPIClient
+from .llm.response_cache import ResponseCache
+from .llm.scheduler import (
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_RECOMMENDATION,
+    PRIORITY_VALIDATION,
+    LLMScheduler,
+)
+from .storage.semantic_cache import SemanticCache
 from .storage.vector_db import VectorStore
 from .validation.response_validator import ResponseValidator
 from .prompt_management.prompt_selector import PromptSelector
 
 
+class StreamingResponse:
+    """Ответ, который отдается по токенам
+
+    После того как поток токенов исчерпан, в text лежит полный ответ,
+    а в review - Future с результатом фоновой проверки. Если генерация
+    оборвалась, исключение передается вызывающему, в text остается
+    полученная часть, в error - исключение, а проверка не запускается.
+    """
+
+    def __init__(self, tokens, on_complete):
+        self._tokens = tokens
+        self._on_complete = on_complete
+        self.text = ""
+        self.review = None
+        self.error = None
+
+    def __iter__(self):
+        parts = []
+        try:
+            for token in self._tokens:
+                parts.append(token)
+                yield token
+        except Exception as e:
+            self.text = "".join(parts).strip()
+            self.error = e
+            raise
+
+        self.text = "".join(parts).strip()
+        if self.text:
+            self.review = self._on_complete(self.text)
+
+
 class RAGSystem:
-    def __init__(self, mistral_api_key: str):
-        self.embedder = OptimizedEmbedder()
+    def __init__(
+        self,
+        mistral_api_key: str,
+        validation_mode="parallel",
+        llm_endpoints=None,
+        index_type="flat",
+        index_params=None,
+        index_fast_start=False,
+        semantic_cache=True,
+        semantic_cache_threshold=0.9,
+    ):
+        self.embedder = OptimizedEmbedder(cache_dir="embedding_cache")
         self.vector_store = VectorStore(
-            data_dir="documents", index_dir="faiss_index", embedder=self.embedder
+            data_dir="documents",
+            index_dir="faiss_index",
+            embedder=self.embedder,
+            index_type=index_type,
+            index_params=index_params,
+            fast_start=index_fast_start,
+            # процесс пересборки пишет в тот же дисковый кэш эмбеддингов
+            embedder_factory=partial(
+                OptimizedEmbedder,
+                model_name=self.embedder.model_name,
+                cache_dir="embedding_cache",
+            ),
+        )
+        self.response_cache = ResponseCache(
+            max_entries=2000, ttl=7 * 24 * 3600, db_path="llm_cache.sqlite"
+        )
+        self.llm_client = MistralAPIClient(
+            mistral_api_key,
+            max_retries=5,
+            cache=self.response_cache,
+            endpoints=llm_endpoints,
         )
-        self.generator = MistralAPIClient(mistral_api_key, max_retries=5)
+        self.scheduler = LLMScheduler(self.llm_client, workers=8)
+        self.generator = self.scheduler.client_for(PRIORITY_INTERACTIVE)
         self.dialog_history: List[Dict] = []
         self.feedback_examples: List[Dict] = []
-        self.validator = ResponseValidator(self.generator)
+        self.validator = ResponseValidator(
+            self.scheduler.client_for(PRIORITY_VALIDATION),
+            mode=validation_mode,
+            recommendation_generator=self.scheduler.client_for(PRIORITY_RECOMMENDATION),
+        )
         self.validation_history = []
+        self._review_executor = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="review"
+        )
         if not self.vector_store.embedder:
             raise ValueError("Embedder not initialized in VectorStore")
 
+        # semantic_cache=False: каждый вопрос проходит поиск, генерацию и проверку
+        self.semantic_cache = (
+            SemanticCache(threshold=semantic_cache_threshold)
+            if semantic_cache
+            else None
+        )
+        self.vector_store.add_update_listener(self._on_document_update)
+
         self.prompt_selector = PromptSelector(self.embedder, "mchs_prompts.json")
         if not self.prompt_selector.prompts:
             default_prompt = self._default_prompt_template()
@@ -50,33 +145,130 @@ class RAGSystem:
         )
 
     def process_query(self, query: str) -> str:
+        """Ответ на запрос с проверкой; без ответа модели - LLMRequestError"""
         try:
-            context = self._retrieve_context(query)
-            selected_prompt = self.prompt_selector.find_best_prompt(query)
-            full_prompt = selected_prompt.format(context=context, query=query)
+            query_ctx = QueryContext(query, self.embedder)
+            selected_prompt = self._select_prompt(query_ctx)
+            cached = self._cached_answer(query_ctx, selected_prompt)
+            if cached:
+                return cached["response"]
+
+            context, full_prompt = self._prepare_query(query_ctx, selected_prompt)
 
             response = self.generator.generate(full_prompt)
-            validation = self.validator.validate_response(
-                query, context, response, selected_prompt
+            validation, recommendation = self._review_response(
+                query_ctx, context, response, selected_prompt
             )
 
-            recommendation = None
-            if validation["relevance"] < 3 or not validation["accuracy"]:
-                recommendation = self.validator.generate_recommendation(
-                    query, context, validation
-                )
-
-            self._save_validation_result(query, response, validation, recommendation)
-
             final_response = response
             if recommendation:
                 final_response += f"\n\n---\n🔍 Рекомендация:\n{recommendation}"
 
             return final_response if final_response else "Не удалось сформировать ответ"
+        except LLMRequestError:
+            raise
         except Exception as e:
             print(f"Ошибка поиска: {str(e)}")
             return []
 
+    def process_query_stream(self, query: str) -> "StreamingResponse":
+        """Потоковая обработка запроса
+
+        Токены ответа отдаются по мере генерации, проверка ответа
+        запускается в фоне сразу после ее завершения.
+        """
+        query_ctx = QueryContext(query, self.embedder)
+        selected_prompt = self._select_prompt(query_ctx)
+        cached = self._cached_answer(query_ctx, selected_prompt)
+        if cached:
+            review = Future()
+            review.set_result((cached["validation"], None))
+            return StreamingResponse(
+                iter([cached["response"]]), on_complete=lambda response: review
+            )
+
+        context, full_prompt = self._prepare_query(query_ctx, selected_prompt)
+
+        def start_review(response: str):
+            return self._review_executor.submit(
+                self._review_response, query_ctx, context, response, selected_prompt
+            )
+
+        return StreamingResponse(
+            self.generator.generate_stream(full_prompt), on_complete=start_review
+        )
+
+    def process_batch_query(self, query: str, batch_id: str) -> str:
+        """Обработка вопроса из пакета с низшим приоритетом вызовов LLM"""
+        with self.scheduler.priority(PRIORITY_BATCH, owner=batch_id):
+            return self.process_query(query)
+
+    def cancel_batch(self, batch_id: str) -> int:
+        """Снятие с очереди еще не отправленных вызовов пакета"""
+        return self.scheduler.cancel_owner(batch_id)
+
+    def _select_prompt(self, query_ctx: QueryContext) -> str:
+        """Промпт для запроса; входит в ключ семантического кэша"""
+        return self.prompt_selector.find_best_prompt(
+            query_ctx.query, query_embedding=query_ctx.embedding
+        )
+
+    def _cached_answer(self, query_ctx: QueryContext, selected_prompt: str):
+        if self.semantic_cache is None:
+            return None
+        return self.semantic_cache.lookup(query_ctx.embedding, selected_prompt)
+
+    def _prepare_query(self, query_ctx: QueryContext, selected_prompt: str):
+        """Поиск контекста и полный текст промпта для запроса"""
+        query = query_ctx.query
+        results = self._retrieve(query, query_embedding=query_ctx.embedding)
+        query_ctx.sources = {res["source"] for res in results if res.get("source")}
+        context = "\n".join([res["text"] for res in results]) if results else ""
+
+        full_prompt = selected_prompt.format(context=context, query=query)
+        return context, full_prompt
+
+    def _review_response(self, query_ctx, context, response, selected_prompt):
+        """Валидация ответа и, при необходимости, рекомендация по исправлению
+
+        Ответы, прошедшие проверку и построенные по найденным документам,
+        попадают в семантический кэш. Ответ с
+        непроверенными критериями (timed_out) не считается проверенным: он
+        не кэшируется, а рекомендация строится только по известным оценкам.
+        """
+        query = query_ctx.query
+        validation = self.validator.validate_response(
+            query, context, response, selected_prompt
+        )
+        if validation["timed_out"]:
+            print(f"⚠️ Не проверены критерии: {', '.join(validation['timed_out'])}")
+
+        recommendation = None
+        relevance = validation["relevance"]
+        if (relevance is not None and relevance < 3) or validation["accuracy"] is False:
+            recommendation = self.validator.generate_recommendation(
+                query, context, validation
+            )
+        elif (
+            response and not validation["timed_out"] and self.semantic_cache is not None
+        ):
+            self.semantic_cache.add(
+                query,
+                query_ctx.embedding,
+                response,
+                validation,
+                query_ctx.sources,
+                prompt=selected_prompt,
+            )
+
+        self._save_validation_result(query, response, validation, recommendation)
+        return validation, recommendation
+
+    def _on_document_update(self, file_path):
+        """Сброс кэшированных ответов, построенных на измененном документе"""
+        if self.semantic_cache is not None:
+            self.semantic_cache.invalidate_source(Path(file_path).name)
+
     def _save_validation_result(self, query, response, validation, recommendation=None):
         self.validation_history.append(
             {
@@ -92,19 +284,19 @@ class RAGSystem:
         stats = defaultdict(list)
         for entry in self.validation_history:
             for k, v in entry["validation"].items():
-                stats[k].append(v)
+                if k != "timed_out" and v is not None:
+                    stats[k].append(v)
         return stats
 
-    def _retrieve_context(self, query: str, top_k=5) -> str:
+    def _retrieve(self, query: str, top_k=5, query_embedding=None) -> list:
         """Оптимизированный поиск с учетом чанков"""
-        results = self.vector_store.search(
+        return self.vector_store.search(
             query_text=query,
             top_k=top_k * 3,
             min_score=0.6,
+            query_embedding=query_embedding,
         )
 
-        return "\n".join([res["text"] for res in results]) if results else ""
-
     def _save_to_history(self, query, context, prompt, response):
         """Сохранение истории диалога"""
         self.dialog_history.append(
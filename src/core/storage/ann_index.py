@@ -0,0 +1,203 @@
+﻿import time
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+DEFAULT_PARAMS = {
+    "flat": {},
+    "hnsw": {"M": 32, "efConstruction": 200, "efSearch": 64},
+    "ivf_flat": {"nlist": None, "nprobe": 16},
+    "ivf_pq": {"nlist": None, "nprobe": 16, "m": 48, "nbits": 8},
+}
+
+SEARCH_PARAMS = ("efSearch", "nprobe")
+
+# для нормированных эмбеддингов "ip" (скалярное произведение) - это косинус
+METRICS = {"l2": faiss.METRIC_L2, "ip": faiss.METRIC_INNER_PRODUCT}
+
+# FAISS нужно не меньше ~39 векторов на центроид для обучения k-means
+# (кластеры IVF и кодовые книги PQ)
+MIN_POINTS_PER_CENTROID = 39
+
+
+def resolve_params(index_type: str, params: Optional[dict] = None) -> dict:
+    """Параметры индекса с подстановкой значений по умолчанию"""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(
+            f"Неизвестный тип индекса: {index_type}. Доступны: {', '.join(INDEX_TYPES)}"
+        )
+    return {**DEFAULT_PARAMS[index_type], **(params or {})}
+
+
+def default_nlist(n_vectors: int) -> int:
+    """Число кластеров IVF: ~4*sqrt(N), но не больше, чем позволяет обучение"""
+    nlist = int(4 * np.sqrt(max(n_vectors, 1)))
+    return max(1, min(nlist, n_vectors // MIN_POINTS_PER_CENTROID))
+
+
+def build_faiss_index(
+    dim: int,
+    index_type: str = "flat",
+    params: Optional[dict] = None,
+    training_vectors: Optional[np.ndarray] = None,
+    metric: str = "l2",
+):
+    """Создание FAISS-индекса заданного типа и метрики (l2 или ip)
+
+    IVF-индексы обучаются на training_vectors. Если векторов для обучения
+    недостаточно, строится точный IndexFlat.
+    """
+    params = resolve_params(index_type, params)
+    if metric not in METRICS:
+        raise ValueError(f"Неизвестная метрика: {metric}. Доступны: l2, ip")
+    metric_type = METRICS[metric]
+
+    if index_type == "flat":
+        return _flat_index(dim, metric)
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, params["M"], metric_type)
+        index.hnsw.efConstruction = params["efConstruction"]
+        set_search_params(index, params)
+        return index
+
+    n_train = 0 if training_vectors is None else len(training_vectors)
+    nlist = params["nlist"] or default_nlist(n_train)
+    min_train = nlist * MIN_POINTS_PER_CENTROID
+    if index_type == "ivf_pq":
+        min_train = max(min_train, 2 ** params["nbits"] * MIN_POINTS_PER_CENTROID)
+    if n_train < min_train:
+        print(
+            f"🟡 Недостаточно векторов для обучения {index_type} "
+            f"({n_train} < {min_train}), используется точный индекс"
+        )
+        return _flat_index(dim, metric)
+
+    quantizer = _flat_index(dim, metric)
+    if index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, metric_type)
+    else:
+        if dim % params["m"]:
+            raise ValueError(
+                f"Размерность {dim} не делится на число подвекторов PQ m={params['m']}"
+            )
+        index = faiss.IndexIVFPQ(
+            quantizer, dim, nlist, params["m"], params["nbits"], metric_type
+        )
+
+    started = time.monotonic()
+    index.train(np.ascontiguousarray(training_vectors, dtype=np.float32))
+    print(
+        f"🧮 Индекс {index_type} обучен: nlist={nlist}, "
+        f"{n_train} векторов за {time.monotonic() - started:.1f} с"
+    )
+    set_search_params(index, params)
+    return index
+
+
+def _flat_index(dim: int, metric: str):
+    return faiss.IndexFlatIP(dim) if metric == "ip" else faiss.IndexFlatL2(dim)
+
+
+def set_search_params(index, params: Optional[dict] = None):
+    """Параметры поиска (efSearch для HNSW, nprobe для IVF), в т.ч. после загрузки"""
+    params = params or {}
+    if isinstance(index, faiss.IndexHNSW) and params.get("efSearch"):
+        index.hnsw.efSearch = params["efSearch"]
+    elif isinstance(index, faiss.IndexIVF) and params.get("nprobe"):
+        index.nprobe = min(params["nprobe"], index.nlist)
+    return index
+
+
+def metric_of(index) -> str:
+    """Метрика индекса в терминах METRICS"""
+    return "ip" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+
+
+def index_type_of(index) -> str:
+    """Тип загруженного индекса в терминах INDEX_TYPES"""
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def recall_latency_report(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    configs: Dict[str, tuple],
+    k: int = 10,
+) -> List[dict]:
+    """Сравнение вариантов индекса с точным поиском
+
+    configs: {"название": (index_type, params)}. Для каждого варианта
+    возвращаются время построения, recall@k относительно IndexFlatL2,
+    средняя и p95 задержка одного запроса в миллисекундах.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    dim = vectors.shape[1]
+
+    exact = faiss.IndexFlatL2(dim)
+    exact.add(vectors)
+    _, ground_truth = exact.search(queries, k)
+
+    report = []
+    built = {}
+    for name, (index_type, params) in configs.items():
+        params = resolve_params(index_type, params)
+        # варианты, отличающиеся только параметрами поиска, делят один индекс
+        build_key = (
+            index_type,
+            tuple(sorted((k, v) for k, v in params.items() if k not in SEARCH_PARAMS)),
+        )
+        if build_key not in built:
+            started = time.monotonic()
+            index = build_faiss_index(dim, index_type, params, training_vectors=vectors)
+            index.add(vectors)
+            built[build_key] = (index, time.monotonic() - started)
+        index, build_seconds = built[build_key]
+        set_search_params(index, params)
+
+        latencies = []
+        found = np.empty_like(ground_truth)
+        for i in range(len(queries)):
+            started = time.perf_counter()
+            _, ids = index.search(queries[i : i + 1], k)
+            latencies.append((time.perf_counter() - started) * 1000)
+            found[i] = ids[0]
+
+        hits = sum(
+            len(set(found[i]) & set(ground_truth[i])) for i in range(len(queries))
+        )
+        report.append(
+            {
+                "name": name,
+                "index_type": index_type,
+                "params": params,
+                "build_s": round(build_seconds, 2),
+                "recall": round(hits / ground_truth.size, 4),
+                "latency_ms": round(float(np.mean(latencies)), 3),
+                "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+            }
+        )
+    return report
+
+
+def format_report(report: List[dict]) -> str:
+    """Таблица отчета recall/задержка для вывода в консоль"""
+    lines = [
+        f"{'вариант':<24}{'recall':>8}{'мс/запрос':>12}{'p95, мс':>10}{'сборка, с':>12}"
+    ]
+    for row in report:
+        lines.append(
+            f"{row['name']:<24}{row['recall']:>8.3f}{row['latency_ms']:>12.3f}"
+            f"{row['p95_ms']:>10.3f}{row['build_s']:>12.2f}"
+        )
+    return "\n".join(lines)
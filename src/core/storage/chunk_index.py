@@ -0,0 +1,368 @@
+﻿import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+
+from .ann_index import (
+    SEARCH_PARAMS,
+    build_faiss_index,
+    index_type_of,
+    metric_of,
+    resolve_params,
+    set_search_params,
+)
+from .chunk_store import STORE_FILE, ChunkStore, get_many, read_legacy_records
+
+
+class ChunkIndex:
+    """FAISS-индекс чанков с явными id и записями чанков
+
+    Векторы хранятся в IndexIDMap2, поэтому чанк можно удалить или
+    заменить по id. HNSW не поддерживает удаление: такие id помечаются
+    удаленными и отфильтровываются при поиске, а когда пометок становится
+    больше compact_ratio, индекс перестраивается из оставшихся векторов.
+
+    Основной индекс, открытый через mmap или общий с опубликованной
+    версией (frozen), только читается: новые векторы попадают в небольшой
+    точный индекс в памяти (overlay), удаленные помечаются. Когда overlay
+    или пометки разрастаются, индекс объединяется с ними в новую копию.
+
+    Опубликованная версия не меняется: обновления применяются к следующей
+    версии (next_version), которая делит с ней основной индекс.
+    """
+
+    def __init__(
+        self,
+        index,
+        index_type="flat",
+        params: Optional[dict] = None,
+        records: Optional[Dict[int, dict]] = None,
+        deleted=None,
+        compact_ratio=0.25,
+    ):
+        self.index = index
+        self.index_type = index_type
+        self.params = resolve_params(index_type, params)
+        self.records = records if records is not None else {}
+        self.deleted = set(deleted or ())
+        self.compact_ratio = compact_ratio
+        self.mapped = False
+        self.frozen = False
+        self.overlay = None
+        self.overlay_ids = set()
+        self._search_params = None
+
+    @classmethod
+    def create(
+        cls,
+        dim: int,
+        index_type="flat",
+        params=None,
+        training_vectors=None,
+        metric="l2",
+    ) -> "ChunkIndex":
+        inner = build_faiss_index(dim, index_type, params, training_vectors, metric)
+        return cls(faiss.IndexIDMap2(inner), index_type_of(inner), params)
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray, records: List[dict]):
+        if not len(ids):
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.frozen:
+            if self.overlay is None:
+                self.overlay = faiss.IndexIDMap2(
+                    faiss.IndexFlat(self.index.d, self.index.metric_type)
+                )
+            self.overlay.add_with_ids(vectors, ids)
+            self.overlay_ids.update(ids.tolist())
+        else:
+            self.index.add_with_ids(vectors, ids)
+        self.records.update(zip(map(int, ids), records))
+        if self.frozen and len(self.overlay_ids) > self.compact_ratio * max(
+            self.index.ntotal, 1
+        ):
+            self.merge()
+
+    def remove(self, ids):
+        ids = [int(i) for i in ids if int(i) in self.records]
+        if not ids:
+            return
+        for chunk_id in ids:
+            del self.records[chunk_id]
+
+        in_overlay = [chunk_id for chunk_id in ids if chunk_id in self.overlay_ids]
+        if in_overlay:
+            self.overlay.remove_ids(np.array(in_overlay, dtype=np.int64))
+            self.overlay_ids.difference_update(in_overlay)
+            ids = [chunk_id for chunk_id in ids if chunk_id not in in_overlay]
+        if not ids:
+            return
+
+        if self.index_type == "hnsw" or self.frozen:
+            self.deleted.update(ids)
+            self._search_params = None
+            if len(self.deleted) > self.compact_ratio * self.index.ntotal:
+                if self.index_type == "hnsw":
+                    self.compact()
+                else:
+                    self.merge()
+        else:
+            self.index.remove_ids(np.array(ids, dtype=np.int64))
+
+    def merge(self):
+        """Объединение основного индекса с overlay и пометками в новую копию
+
+        Копия принадлежит только этой версии и меняется на месте.
+        """
+        if not self.frozen:
+            return
+        self.index, self.deleted = self._merged_index()
+        self.mapped = False
+        self.frozen = False
+        self.overlay = None
+        self.overlay_ids = set()
+        self._search_params = None
+        print(f"🧩 Индекс объединен с изменениями: {self.index.ntotal} векторов")
+
+    def next_version(self) -> "ChunkIndex":
+        """Следующая версия для обновлений: основной индекс общий, остальное копия
+
+        Копируются overlay, пометки и записи. Записи загруженной базы лежат
+        в ChunkStore, копия которого переносит только изменения, поэтому
+        стоимость зависит от объема изменений, а не от размера индекса.
+        Записи в обычном словаре (индекс, построенный в памяти и еще не
+        перечитанный с диска) копируются целиком.
+        """
+        version = ChunkIndex(
+            self.index,
+            self.index_type,
+            self.params,
+            records=self.records.copy(),
+            deleted=self.deleted,
+            compact_ratio=self.compact_ratio,
+        )
+        version.mapped = self.mapped
+        version.frozen = True
+        if self.overlay is not None:
+            version.overlay = faiss.clone_index(self.overlay)
+            version.overlay_ids = set(self.overlay_ids)
+        return version
+
+    def _merged_index(self):
+        """Изменяемая копия индекса с векторами overlay: (индекс, пометки)"""
+        if self.mapped:
+            index = faiss.deserialize_index(faiss.serialize_index(self.index))
+        else:
+            index = faiss.clone_index(self.index)
+        if self.overlay_ids:
+            ids = np.array(sorted(self.overlay_ids), dtype=np.int64)
+            index.add_with_ids(self.overlay.reconstruct_batch(ids), ids)
+        deleted = set(self.deleted)
+        if deleted and self.index_type != "hnsw":
+            index.remove_ids(np.array(sorted(deleted), dtype=np.int64))
+            deleted = set()
+        return index, deleted
+
+    def snapshot(self) -> "ChunkIndex":
+        """Независимая копия для записи на диск, пока индекс обновляется"""
+        index, deleted = self._merged_index()
+        return ChunkIndex(
+            index,
+            self.index_type,
+            self.params,
+            records=self.records.copy(),
+            deleted=deleted,
+            compact_ratio=self.compact_ratio,
+        )
+
+    def _reconstruct(self, ids: np.ndarray) -> np.ndarray:
+        in_overlay = np.isin(ids, list(self.overlay_ids))
+        vectors = np.empty((len(ids), self.index.d), dtype=np.float32)
+        if (~in_overlay).any():
+            vectors[~in_overlay] = self.index.reconstruct_batch(ids[~in_overlay])
+        if in_overlay.any():
+            vectors[in_overlay] = self.overlay.reconstruct_batch(ids[in_overlay])
+        return vectors
+
+    def compact(self):
+        """Перестройка индекса без удаленных векторов"""
+        ids = np.array(sorted(self.records), dtype=np.int64)
+        vectors = self._reconstruct(ids) if len(ids) else None
+        inner = build_faiss_index(
+            self.index.d,
+            self.index_type,
+            self.params,
+            training_vectors=vectors,
+            metric=metric_of(self.index),
+        )
+        index = faiss.IndexIDMap2(inner)
+        if len(ids):
+            index.add_with_ids(vectors, ids)
+        print(f"🧹 Индекс перестроен: удалено помеченных векторов {len(self.deleted)}")
+        self.index = index
+        self.deleted = set()
+        self.mapped = False
+        self.frozen = False
+        self.overlay = None
+        self.overlay_ids = set()
+        self._search_params = None
+
+    def search(self, query_vector, top_k: int, min_score=None) -> list:
+        """Ближайшие чанки: список пар (запись, близость)"""
+        return self.search_batch([query_vector], top_k, min_score)[0]
+
+    def search_batch(self, query_vectors, top_k: int, min_score=None) -> List[list]:
+        """Поиск по нескольким запросам одним вызовом FAISS
+
+        Близость - скалярное произведение для метрики ip и 1 - d/2 для L2:
+        для нормированных векторов оба значения равны косинусу. Чанки с
+        близостью ниже min_score отбрасываются. Записи всех найденных
+        чанков читаются одним пакетным запросом.
+        """
+        queries = np.ascontiguousarray(
+            np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.index.d)
+        )
+        if not self.records or not len(queries):
+            return [[] for _ in range(len(queries))]
+
+        scores, ids = self._similarity(
+            self.index, queries, top_k, self._search_parameters()
+        )
+        if self.overlay_ids:
+            overlay_scores, overlay_ids = self._similarity(self.overlay, queries, top_k)
+            scores = np.hstack([scores, overlay_scores])
+            ids = np.hstack([ids, overlay_ids])
+        order = np.argsort(-scores, axis=1, kind="stable")
+        scores = np.take_along_axis(scores, order, axis=1)
+        ids = np.take_along_axis(ids, order, axis=1)
+
+        candidates = []
+        for row_ids, row_scores in zip(ids, scores):
+            keep = row_ids >= 0
+            if min_score is not None:
+                keep &= row_scores >= min_score
+            candidates.append(
+                list(zip(row_ids[keep].tolist(), row_scores[keep].tolist()))
+            )
+        unique_ids = list({chunk_id for row in candidates for chunk_id, _ in row})
+        records = dict(zip(unique_ids, get_many(self.records, unique_ids)))
+
+        results = []
+        for row in candidates:
+            found = []
+            for chunk_id, score in row:
+                if records[chunk_id] is None:
+                    continue
+                found.append((records[chunk_id], score))
+                if len(found) == top_k:
+                    break
+            results.append(found)
+        return results
+
+    def _search_parameters(self):
+        """Параметры поиска, исключающие помеченные удаленными id
+
+        Собираются один раз на версию: у опубликованной версии пометки
+        не меняются. Значения efSearch/nprobe берутся из самого индекса.
+        """
+        if not self.deleted:
+            return None
+        if self._search_params is None:
+            deleted = np.array(sorted(self.deleted), dtype=np.int64)
+            batch = faiss.IDSelectorBatch(deleted)
+            selector = faiss.IDSelectorNot(batch)
+            inner = faiss.downcast_index(self.index.index)
+            if isinstance(inner, faiss.IndexHNSW):
+                params = faiss.SearchParametersHNSW(sel=selector)
+                params.efSearch = inner.hnsw.efSearch
+            elif isinstance(inner, faiss.IndexIVF):
+                params = faiss.SearchParametersIVF(sel=selector)
+                params.nprobe = inner.nprobe
+            else:
+                params = faiss.SearchParameters(sel=selector)
+            # селекторы должны жить, пока живут параметры
+            self._search_params = (params, selector, batch)
+        return self._search_params[0]
+
+    @staticmethod
+    def _similarity(index, queries: np.ndarray, k: int, params=None):
+        """(близость, id) ближайших векторов; для L2 близость равна 1 - d/2"""
+        k = min(k, index.ntotal)
+        if not k:
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.float32), empty.astype(np.int64)
+        distances, ids = index.search(queries, k, params=params)
+        if index.metric_type == faiss.METRIC_L2:
+            distances = 1 - distances / 2
+        return distances, ids
+
+    def save(self, index_dir: Path):
+        """Сохранение через временные файлы с атомарной заменой
+
+        Записи чанков пишутся в chunks.sqlite (ChunkStore), chunks.json
+        хранит только описание индекса.
+        """
+        index_dir = Path(index_dir)
+        index, deleted = (
+            self._merged_index()
+            if self.mapped or self.overlay_ids
+            else (self.index, self.deleted)
+        )
+        faiss.write_index(index, str(index_dir / "faiss.index.tmp"))
+        ChunkStore.write(index_dir / STORE_FILE, self.records)
+        with open(index_dir / "chunks.json.tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "index_type": self.index_type,
+                    "params": self.params,
+                    "deleted": sorted(deleted),
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(index_dir / "faiss.index.tmp", index_dir / "faiss.index")
+        os.replace(index_dir / "chunks.json.tmp", index_dir / "chunks.json")
+
+    @classmethod
+    def load(
+        cls, index_dir: Path, params: Optional[dict] = None, mmap=False
+    ) -> "ChunkIndex":
+        """Загрузка индекса; mmap=True - быстрый старт без чтения в память
+
+        В режиме mmap векторы отображаются с диска (IO_FLAG_MMAP_IFC); если
+        эта версия faiss его не поддерживает, индекс читается в память.
+        Текст и метаданные чанков всегда читаются из ChunkStore по требованию.
+        """
+        index_dir = Path(index_dir)
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", 0) if mmap else 0
+        if mmap and not flags:
+            print("🟡 faiss без IO_FLAG_MMAP_IFC: индекс читается в память")
+        index = faiss.read_index(str(index_dir / "faiss.index"), flags)
+        with open(index_dir / "chunks.json", "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        if (index_dir / STORE_FILE).exists():
+            records = ChunkStore(index_dir / STORE_FILE)
+        elif "records" in data:
+            # прежние форматы переводятся в ChunkStore при записи новой базы
+            records = {int(k): v for k, v in data["records"].items()}
+        else:
+            records = read_legacy_records(index_dir)
+
+        # параметры построения берутся из файла, параметры поиска - из настроек
+        search_params = {k: v for k, v in (params or {}).items() if k in SEARCH_PARAMS}
+        params = {**data["params"], **search_params}
+        set_search_params(faiss.downcast_index(index.index), params)
+        chunk_index = cls(
+            index, data["index_type"], params, records=records, deleted=data["deleted"]
+        )
+        chunk_index.mapped = bool(flags)
+        chunk_index.frozen = mmap
+        return chunk_index
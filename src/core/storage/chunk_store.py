@@ -0,0 +1,189 @@
+﻿import json
+import os
+import sqlite3
+import threading
+import zlib
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+from .index_manifest import POSITIONAL_METADATA
+
+STORE_FILE = "chunks.sqlite"
+LOOKUP_BATCH = 500
+
+
+class ChunkStore(MutableMapping):
+    """Записи чанков (текст и метаданные) в SQLite, id совпадает с id в FAISS
+
+    Общие метаданные документа (doc_type, keywords, context, section...)
+    хранятся один раз в таблице metadata, у чанка - ссылка на них и его
+    позиционные поля, текст сжат zlib. Файл базы только читается; изменения после загрузки
+    держатся в памяти поверх него и попадают на диск при записи новой базы.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._db = sqlite3.connect(
+            f"{self.path.resolve().as_uri()}?mode=ro&immutable=1",
+            uri=True,
+            check_same_thread=False,
+        )
+        self._lock = threading.Lock()
+        self._overrides = {}
+        self._removed = set()
+        self._size = self._db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    @staticmethod
+    def write(path: Path, records):
+        """Запись всех чанков в новый файл с атомарной заменой"""
+        path = Path(path)
+        tmp_path = Path(f"{path}.tmp")
+        tmp_path.unlink(missing_ok=True)
+        db = sqlite3.connect(str(tmp_path))
+        try:
+            db.executescript(
+                "CREATE TABLE metadata (id INTEGER PRIMARY KEY, value TEXT NOT NULL);"
+                "CREATE TABLE chunks (id INTEGER PRIMARY KEY, text BLOB NOT NULL, "
+                "meta_id INTEGER NOT NULL, extra TEXT);"
+            )
+            shared = {}
+            ids = sorted(int(chunk_id) for chunk_id in records)
+            for start in range(0, len(ids), LOOKUP_BATCH):
+                batch = ids[start : start + LOOKUP_BATCH]
+                rows = []
+                for chunk_id, record in zip(batch, get_many(records, batch)):
+                    metadata, extra = _split_metadata(record["metadata"])
+                    meta_id = shared.setdefault(metadata, len(shared))
+                    text = zlib.compress(record["text"].encode("utf-8"))
+                    rows.append((chunk_id, text, meta_id, extra))
+                db.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", rows)
+            db.executemany(
+                "INSERT INTO metadata VALUES (?, ?)",
+                [(meta_id, value) for value, meta_id in shared.items()],
+            )
+            db.commit()
+        finally:
+            db.close()
+        os.replace(tmp_path, path)
+
+    def get_many(self, ids) -> List[Optional[dict]]:
+        """Записи по списку id одним запросом; None для отсутствующих"""
+        ids = [int(chunk_id) for chunk_id in ids]
+        found = {}
+        on_disk = [
+            chunk_id
+            for chunk_id in ids
+            if chunk_id not in self._overrides and chunk_id not in self._removed
+        ]
+        rows = []
+        for start in range(0, len(on_disk), LOOKUP_BATCH):
+            batch = on_disk[start : start + LOOKUP_BATCH]
+            with self._lock:
+                rows += self._db.execute(
+                    "SELECT c.id, c.text, m.value, c.extra FROM chunks c "
+                    "JOIN metadata m ON m.id = c.meta_id "
+                    f"WHERE c.id IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+        for chunk_id, text, metadata, extra in rows:
+            metadata = json.loads(metadata)
+            if extra:
+                metadata.update(json.loads(extra))
+            text = zlib.decompress(text).decode("utf-8")
+            found[chunk_id] = {"text": text, "metadata": metadata}
+        return [self._overrides.get(chunk_id, found.get(chunk_id)) for chunk_id in ids]
+
+    def _in_file(self, chunk_id: int) -> bool:
+        if chunk_id in self._removed:
+            return False
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM chunks WHERE id = ?", (chunk_id,)
+            ).fetchone()
+        return row is not None
+
+    def __getitem__(self, chunk_id):
+        record = self.get_many([chunk_id])[0]
+        if record is None:
+            raise KeyError(chunk_id)
+        return record
+
+    def __contains__(self, chunk_id):
+        chunk_id = int(chunk_id)
+        return chunk_id in self._overrides or self._in_file(chunk_id)
+
+    def __setitem__(self, chunk_id, record):
+        chunk_id = int(chunk_id)
+        if chunk_id not in self:
+            self._size += 1
+        self._overrides[chunk_id] = record
+
+    def __delitem__(self, chunk_id):
+        chunk_id = int(chunk_id)
+        if chunk_id not in self:
+            raise KeyError(chunk_id)
+        in_file = self._in_file(chunk_id)
+        self._overrides.pop(chunk_id, None)
+        if in_file:
+            self._removed.add(chunk_id)
+        self._size -= 1
+
+    def __iter__(self):
+        with self._lock:
+            ids = [row[0] for row in self._db.execute("SELECT id FROM chunks")]
+        for chunk_id in ids:
+            if chunk_id not in self._removed and chunk_id not in self._overrides:
+                yield chunk_id
+        yield from list(self._overrides)
+
+    def __len__(self):
+        return self._size
+
+    def copy(self) -> "ChunkStore":
+        """Копия с общим файлом и соединением, изменения в памяти независимы"""
+        store = ChunkStore.__new__(ChunkStore)
+        store.path = self.path
+        store._db = self._db
+        store._lock = self._lock
+        store._overrides = dict(self._overrides)
+        store._removed = set(self._removed)
+        store._size = self._size
+        return store
+
+
+def get_many(records, ids) -> List[Optional[dict]]:
+    """Пакетное чтение записей из ChunkStore или обычного словаря"""
+    if isinstance(records, ChunkStore):
+        return records.get_many(ids)
+    return [records.get(int(chunk_id)) for chunk_id in ids]
+
+
+def _split_metadata(metadata: dict):
+    """Общие метаданные документа и позиционные поля чанка (JSON-строки)"""
+    shared = {k: v for k, v in metadata.items() if k not in POSITIONAL_METADATA}
+    extra = {k: v for k, v in metadata.items() if k in POSITIONAL_METADATA}
+    return (
+        json.dumps(shared, ensure_ascii=False, sort_keys=True, default=str),
+        json.dumps(extra, ensure_ascii=False, default=str) if extra else None,
+    )
+
+
+def read_legacy_records(index_dir: Path) -> Optional[dict]:
+    """Чанки из прежних форматов: chunks.jsonl с таблицей смещений
+
+    Записи внутри chunks.json читает ChunkIndex.load. None - файлов нет.
+    """
+    index_dir = Path(index_dir)
+    offsets_path = index_dir / "chunks.offsets.npy"
+    if not offsets_path.exists():
+        return None
+    table = np.load(offsets_path)
+    with open(index_dir / "chunks.jsonl", "rb") as f:
+        data = f.read()
+    return {
+        int(chunk_id): json.loads(data[start : start + length])
+        for chunk_id, start, length in table
+    }
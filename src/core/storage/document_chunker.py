@@ -0,0 +1,143 @@
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional
+
+CHUNK_STRATEGIES = ("sentence", "sections")
+# начало нумерованного пункта инструкции: "1.", "12." в начале строки
+SECTION_START = re.compile(r"(?m)^[ \t]*\d+\.(?!\d)")
+
+
+class DocumentChunker:
+    """Разбиение документов на чанки, общее для полного построения и обновлений
+
+    strategy:
+        sentence - SentenceSplitter по предложениям с перекрытием
+                   chunk_overlap токенов;
+        sections - нумерованные пункты ("1.", "2." в начале строки) не
+                   разрываются: целые пункты собираются в чанк до chunk_size
+                   токенов, слишком длинный пункт делится по предложениям.
+
+    Число токенов фрагмента кэшируется (lru_cache на token_cache_size
+    строк): при повторной обработке измененного файла неизмененные
+    предложения и пункты не токенизируются заново. Экземпляр передается в
+    процессы пула через pickle, кэш и splitter создаются в каждом процессе.
+    """
+
+    def __init__(
+        self,
+        strategy="sections",
+        chunk_size=1024,
+        chunk_overlap=128,
+        token_cache_size=1 << 16,
+    ):
+        if strategy not in CHUNK_STRATEGIES:
+            raise ValueError(
+                f"Неизвестная стратегия чанкинга {strategy}, "
+                f"доступны: {', '.join(CHUNK_STRATEGIES)}"
+            )
+        self.strategy = strategy
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.token_cache_size = token_cache_size
+        self._init_runtime()
+
+    def _init_runtime(self):
+        self._splitter = None
+        self._tokenizer = None
+        self.count_tokens = lru_cache(maxsize=self.token_cache_size)(self._count_tokens)
+
+    def __getstate__(self):
+        return {
+            "strategy": self.strategy,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "token_cache_size": self.token_cache_size,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_runtime()
+
+    def _count_tokens(self, text: str) -> int:
+        if self._tokenizer is None:
+            from llama_index.core.utils import get_tokenizer
+
+            self._tokenizer = get_tokenizer()
+        return len(self._tokenizer(text))
+
+    def _sentence_splitter(self):
+        if self._splitter is None:
+            from llama_index.core.node_parser import SentenceSplitter
+
+            # SentenceSplitter берет от токенизатора только длину результата
+            self._splitter = SentenceSplitter(
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap,
+                tokenizer=lambda text: range(self.count_tokens(text)),
+            )
+        return self._splitter
+
+    def split_text(self, text: str) -> List[str]:
+        """Тексты чанков документа"""
+        if not text.strip():
+            return []
+        if self.strategy == "sentence":
+            return self._sentence_splitter().split_text(text)
+        return self._split_sections(text)
+
+    def _split_sections(self, text: str) -> List[str]:
+        starts = [match.start() for match in SECTION_START.finditer(text)]
+        if not starts or starts[0] != 0:
+            starts.insert(0, 0)
+        sections = [
+            text[start:end].strip()
+            for start, end in zip(starts, starts[1:] + [len(text)])
+        ]
+
+        chunks, current, tokens = [], [], 0
+        for section in filter(None, sections):
+            size = self.count_tokens(section)
+            if current and tokens + size + 1 > self.chunk_size:
+                chunks.append("\n".join(current))
+                current, tokens = [], 0
+            if size > self.chunk_size:
+                chunks.extend(self._sentence_splitter().split_text(section))
+                continue
+            current.append(section)
+            tokens += size + 1
+        if current:
+            chunks.append("\n".join(current))
+        return chunks
+
+    def chunk_document(
+        self, item: dict, path: Path, position: Optional[int] = None
+    ) -> List[dict]:
+        """Чанки элемента JSON-файла с метаданными
+
+        doc_id берется из метаданных документа, без него - имя файла и
+        номер элемента; chunk_id - "<doc_id>_part_<N>".
+        """
+        path = Path(path)
+        text = item.get("text", "")
+        metadata = item.get("metadata", {})
+        doc_id = metadata.get("doc_id") or (
+            path.stem if position is None else f"{path.stem}_{position + 1}"
+        )
+        return [
+            {
+                "text": chunk,
+                "metadata": {
+                    **metadata,
+                    "doc_id": doc_id,
+                    "chunk_id": f"{doc_id}_part_{i+1}",
+                    "file_name": path.name,
+                    "original_length": len(text),
+                },
+            }
+            for i, chunk in enumerate(self.split_text(text))
+        ]
+
+    def cache_stats(self) -> dict:
+        info = self.count_tokens.cache_info()
+        return {"hits": info.hits, "misses": info.misses, "size": info.currsize}
@@ -0,0 +1,207 @@
+﻿import json
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from .document_chunker import DocumentChunker
+
+READ_SIZE = 1 << 16
+TASK_CHARS = 1 << 20
+JSON_WHITESPACE = " \t\r\n"
+
+
+def iter_json_items(path: Path, read_size=READ_SIZE) -> Iterator[dict]:
+    """Элементы JSON-файла по одному без чтения файла целиком
+
+    Массив верхнего уровня разбирается по частям через raw_decode: в памяти
+    держится только текущий элемент и недочитанный хвост. Одиночный объект
+    возвращается как единственный элемент.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8-sig") as f:
+        buffer, pos, eof = "", 0, False
+
+        def read_more(size=read_size):
+            nonlocal buffer, pos, eof
+            data = f.read(size)
+            eof = not data
+            buffer, pos = buffer[pos:] + data, 0
+            return not eof
+
+        def skip(chars):
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in chars:
+                    pos += 1
+                if pos < len(buffer) or not read_more():
+                    return
+
+        skip(JSON_WHITESPACE)
+        if pos >= len(buffer):
+            raise ValueError(f"Пустой JSON-файл: {Path(path).name}")
+        if buffer[pos] != "[":
+            yield json.loads(buffer[pos:] + f.read())
+            return
+
+        pos += 1
+        while True:
+            skip(JSON_WHITESPACE + ",")
+            if pos >= len(buffer):
+                raise ValueError(f"Незакрытый JSON-массив: {Path(path).name}")
+            if buffer[pos] == "]":
+                return
+            while True:
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                    break
+                except json.JSONDecodeError:
+                    # элемент не дочитан: следующий блок не меньше буфера,
+                    # чтобы большой элемент разбирался за линейное время
+                    if not read_more(max(read_size, len(buffer))):
+                        raise
+            pos = end
+            yield item
+
+
+# чанкер процесса пула, задается initializer-ом один раз на процесс
+_worker_chunker = None
+
+
+def _init_worker(chunker: DocumentChunker):
+    global _worker_chunker
+    _worker_chunker = chunker
+
+
+def _chunk_items(
+    chunker: Optional[DocumentChunker], path: Path, start: int, items: List[dict]
+) -> list:
+    """Чанки пачки элементов одного файла; start - номер первого элемента"""
+    chunker = chunker or _worker_chunker
+    return [
+        chunk
+        for position, item in enumerate(items, start)
+        for chunk in chunker.chunk_document(item, path, position)
+    ]
+
+
+class DocumentPipeline:
+    """Потоковая загрузка документов: разбор JSON по элементам, чанкинг в пуле
+
+    Элементы файлов читаются по одному и уходят в пул процессов пачками
+    примерно по task_chars символов текста. Одновременно в работе не больше
+    max_pending пачек: следующая отправляется, только когда потребитель
+    забрал результаты предыдущих, поэтому память не зависит от размера
+    файлов, а скорость чтения подстраивается под расчет эмбеддингов.
+    Чанки выдаются в порядке файлов и элементов. Небольшие объемы (меньше
+    parallel_min_bytes) разбираются в текущем процессе.
+
+    skip_errors=True: ошибка в файле печатается, а его оставшиеся элементы
+    пропускаются; иначе исключение передается потребителю.
+    """
+
+    def __init__(
+        self,
+        chunker: Optional[DocumentChunker] = None,
+        workers=None,
+        max_pending=None,
+        parallel_min_bytes=1 << 20,
+        task_chars=TASK_CHARS,
+    ):
+        self.chunker = chunker or DocumentChunker()
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.workers
+        self.parallel_min_bytes = parallel_min_bytes
+        self.task_chars = task_chars
+        self._pool = None
+
+    def iter_chunks(self, paths: Iterable[Path], skip_errors=True) -> Iterator:
+        """Чанки всех файлов по порядку"""
+        paths = [Path(path) for path in paths]
+        size = sum(path.stat().st_size for path in paths if path.exists())
+        failed = set()
+        if self.workers <= 1 or size < self.parallel_min_bytes:
+            for path, start, items in self._tasks(paths, skip_errors, task_chars=0):
+                yield from self._result(
+                    path,
+                    lambda: _chunk_items(self.chunker, path, start, items),
+                    failed,
+                    skip_errors,
+                )
+            return
+
+        pool = self._get_pool()
+        pending = deque()
+        for path, start, items in self._tasks(paths, skip_errors, self.task_chars):
+            if len(pending) >= self.max_pending:
+                path_done, future = pending.popleft()
+                yield from self._result(path_done, future.result, failed, skip_errors)
+            pending.append((path, pool.submit(_chunk_items, None, path, start, items)))
+        while pending:
+            path, future = pending.popleft()
+            yield from self._result(path, future.result, failed, skip_errors)
+
+    def iter_batches(self, paths: Iterable[Path], batch_size: int) -> Iterator[list]:
+        """Чанки пачками не больше batch_size (для расчета эмбеддингов)"""
+        batch = []
+        for chunk in self.iter_chunks(paths):
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def chunk_file(self, path: Path) -> list:
+        """Все чанки одного файла"""
+        return list(self.iter_chunks([path], skip_errors=False))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def _tasks(self, paths: List[Path], skip_errors: bool, task_chars: int):
+        """Пачки элементов (path, номер первого, items) по task_chars символов"""
+        for path in paths:
+            start, items, chars = 0, [], 0
+            try:
+                for item in iter_json_items(path):
+                    items.append(item)
+                    chars += len(item.get("text", ""))
+                    if chars >= task_chars:
+                        yield path, start, items
+                        start, items, chars = start + len(items), [], 0
+            except Exception as e:
+                if not skip_errors:
+                    raise
+                print(f"Ошибка загрузки {path.name}: {str(e)}")
+            if items:
+                yield path, start, items
+
+    @staticmethod
+    def _result(path: Path, get_chunks: Callable, failed: set, skip_errors: bool):
+        """Чанки пачки; после ошибки остальные пачки файла пропускаются"""
+        if path in failed:
+            return []
+        try:
+            return get_chunks()
+        except Exception as e:
+            if not skip_errors:
+                raise
+            failed.add(path)
+            print(f"Ошибка загрузки {path.name}: {str(e)}")
+            return []
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # spawn: обслуживающий процесс многопоточный, fork в нем небезопасен
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.chunker,),
+            )
+        return self._pool
@@ -1,29 +1,58 @@
-﻿from watchdog.observers import Observer
+﻿from pathlib import Path
+
+from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
+from .ingestion_queue import IngestionQueue
+
 
 class DocumentWatcher:
-    def __init__(self, data_dir: Path, update_handler: callable):
+    """Наблюдение за каталогом документов
+
+    События файловой системы не обрабатываются в потоке наблюдателя, а
+    складываются в IngestionQueue: серия событий по одному файлу сводится
+    к одному изменению, а изменения нескольких файлов применяются пачкой.
+    """
+
+    def __init__(
+        self,
+        data_dir: Path,
+        change_handler: callable,
+        rescan_handler: callable = None,
+        debounce=1.0,
+        max_batch=200,
+        max_pending=5000,
+    ):
         self.data_dir = data_dir
-        self.update_handler = update_handler
         self.observer = Observer()
-        self.lock = threading.Lock()
+        self.queue = IngestionQueue(
+            change_handler,
+            rescan_fn=rescan_handler,
+            debounce=debounce,
+            max_batch=max_batch,
+            max_pending=max_pending,
+        )
 
         class Handler(FileSystemEventHandler):
             def __init__(self, outer):
                 self.outer = outer
 
             def on_modified(self, event):
-                self._process_event(event)
+                self._submit(event.src_path, event.is_directory, "update")
 
             def on_created(self, event):
-                self._process_event(event)
+                self._submit(event.src_path, event.is_directory, "update")
 
-            def _process_event(self, event):
-                if not event.is_directory and event.src_path.endswith(".json"):
-                    with self.outer.lock:
-                        file_path = Path(event.src_path)
-                        self.outer.update_handler(file_path)
+            def on_deleted(self, event):
+                self._submit(event.src_path, event.is_directory, "delete")
+
+            def on_moved(self, event):
+                self._submit(event.src_path, event.is_directory, "delete")
+                self._submit(event.dest_path, event.is_directory, "update")
+
+            def _submit(self, path: str, is_directory: bool, kind: str):
+                if not is_directory and path.endswith(".json"):
+                    self.outer.queue.submit(Path(path), kind)
 
         self.event_handler = Handler(self)
 
@@ -35,4 +64,8 @@ class DocumentWatcher:
     def stop(self):
         self.observer.stop()
         self.observer.join()
+        self.queue.stop()
         print("👀 Наблюдение остановлено")
+
+    def stats(self) -> dict:
+        return self.queue.stats()
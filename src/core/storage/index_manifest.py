@@ -0,0 +1,91 @@
+﻿import hashlib
+import json
+import os
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+# метаданные, зависящие только от позиции чанка, не входят в его ключ:
+# вставка абзаца в начало файла не должна менять ключи последующих чанков
+POSITIONAL_METADATA = ("chunk_id", "doc_id", "original_length")
+
+
+class IndexManifest:
+    """Хэши содержимого файлов и чанков, попавших в индекс
+
+    Для каждого файла хранится хэш содержимого и соответствие
+    "ключ чанка -> id вектора в FAISS". Ключ чанка - хэш файла-источника,
+    текста и непозиционных метаданных.
+    """
+
+    def __init__(self, files: Dict[str, dict] = None, next_id: int = 0):
+        self.files = files or {}
+        self.next_id = next_id
+
+    @staticmethod
+    def hash_file(path: Path) -> str:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    @staticmethod
+    def chunk_keys(file_name: str, chunks: List[dict]) -> List[str]:
+        """Ключи чанков; одинаковые чанки внутри файла различаются номером повтора"""
+        keys = []
+        seen = Counter()
+        for chunk in chunks:
+            metadata = {
+                k: v
+                for k, v in chunk["metadata"].items()
+                if k not in POSITIONAL_METADATA
+            }
+            raw = json.dumps(
+                [file_name, chunk["text"], metadata],
+                sort_keys=True,
+                ensure_ascii=False,
+                default=str,
+            )
+            key = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+            seen[key] += 1
+            keys.append(f"{key}:{seen[key]}" if seen[key] > 1 else key)
+        return keys
+
+    def is_current(self, file_name: str, file_hash: str) -> bool:
+        entry = self.files.get(file_name)
+        return entry is not None and entry["hash"] == file_hash
+
+    def chunk_ids(self, file_name: str) -> Dict[str, int]:
+        return dict(self.files.get(file_name, {}).get("chunks", {}))
+
+    def set_file(self, file_name: str, file_hash: str, chunks: Dict[str, int]):
+        self.files[file_name] = {"hash": file_hash, "chunks": chunks}
+
+    def remove_file(self, file_name: str) -> Dict[str, int]:
+        """Удаление файла, возвращает ключи и id его чанков"""
+        return self.files.pop(file_name, {}).get("chunks", {})
+
+    def copy(self) -> "IndexManifest":
+        """Копия для следующей версии; записи файлов заменяются, а не меняются"""
+        return IndexManifest(dict(self.files), self.next_id)
+
+    def allocate_ids(self, count: int) -> np.ndarray:
+        ids = np.arange(self.next_id, self.next_id + count, dtype=np.int64)
+        self.next_id += count
+        return ids
+
+    def save(self, path: Path):
+        tmp_path = Path(f"{path}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"next_id": self.next_id, "files": self.files},
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "IndexManifest":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(files=data["files"], next_id=data["next_id"])
@@ -0,0 +1,135 @@
+﻿import json
+import re
+from collections import defaultdict
+from pathlib import Path
+from typing import Optional
+
+import faiss
+import numpy as np
+from filelock import FileLock
+
+from .chunk_index import ChunkIndex
+from .index_manifest import IndexManifest
+from .segment_store import SegmentStore
+
+# файлы, которые сохранял StorageContext.persist вместе с FaissVectorStore
+LLAMA_INDEX_FILES = (
+    "docstore.json",
+    "index_store.json",
+    "graph_store.json",
+    "vector_store.json",
+    "default__vector_store.json",
+    "image__vector_store.json",
+    "faiss.index",
+)
+# doc_id чанков, которые создавало полное построение llama_index: "<stem>_chunk_<n>"
+LLAMA_DOC_ID = re.compile(r"^(?P<stem>.+)_chunk_\d+$")
+
+
+def has_llama_index_layout(index_dir: Path) -> bool:
+    index_dir = Path(index_dir)
+    return (index_dir / "docstore.json").exists() and (
+        (index_dir / "faiss.index").exists()
+        or (index_dir / "default__vector_store.json").exists()
+    )
+
+
+def _node_text(node: dict) -> str:
+    if "text" in node:
+        return node["text"]
+    return (node.get("text_resource") or {}).get("text") or ""
+
+
+def _source_file(metadata: dict) -> Optional[str]:
+    """Имя файла чанка: file_name или, для старых индексов, stem из doc_id"""
+    if metadata.get("file_name"):
+        return metadata["file_name"]
+    match = LLAMA_DOC_ID.match(str(metadata.get("doc_id", "")))
+    return f"{match['stem']}.json" if match else None
+
+
+def load_llama_index(
+    index_dir: Path, index_type="flat", params: Optional[dict] = None, metric="l2"
+):
+    """Чтение индекса llama_index: (ChunkIndex, IndexManifest)
+
+    Позиция вектора в FAISS становится id чанка, векторы не пересчитываются.
+    Хэши файлов в манифесте пустые: при первой сверке с каталогом документов
+    файлы будут разобраны заново, но эмбеддинги посчитаются только для
+    изменившихся чанков. Файл чанка без file_name восстанавливается по
+    doc_id "<stem>_chunk_<n>"; чанки, файл которых определить нельзя,
+    не переносятся - сверка не смогла бы их удалить или заменить.
+    """
+    index_dir = Path(index_dir)
+    with open(index_dir / "docstore.json", "r", encoding="utf-8") as f:
+        nodes = json.load(f)["docstore/data"]
+    with open(index_dir / "index_store.json", "r", encoding="utf-8") as f:
+        structs = json.load(f)["index_store/data"]
+    struct = next(iter(structs.values()))["__data__"]
+    if isinstance(struct, str):
+        struct = json.loads(struct)
+    nodes_dict = struct["nodes_dict"]
+
+    faiss_path = index_dir / "faiss.index"
+    if not faiss_path.exists():
+        faiss_path = index_dir / "default__vector_store.json"
+    vectors = faiss.read_index(str(faiss_path))
+    vectors = vectors.reconstruct_n(0, vectors.ntotal)
+
+    ids, records, dropped = [], [], 0
+    for position, node_id in sorted(nodes_dict.items(), key=lambda x: int(x[0])):
+        node = nodes.get(node_id, {}).get("__data__")
+        if node is None:
+            continue
+        metadata = node.get("metadata", {})
+        file_name = _source_file(metadata)
+        if file_name is None:
+            dropped += 1
+            continue
+        ids.append(int(position))
+        records.append(
+            {"text": _node_text(node), "metadata": {**metadata, "file_name": file_name}}
+        )
+    if dropped:
+        print(f"⚠️ Не перенесено чанков без исходного файла: {dropped}")
+    ids = np.array(ids, dtype=np.int64)
+
+    index = ChunkIndex.create(
+        vectors.shape[1],
+        index_type,
+        params,
+        training_vectors=vectors[ids],
+        metric=metric,
+    )
+    index.add(ids, vectors[ids], records)
+
+    manifest = IndexManifest(next_id=int(ids.max()) + 1 if len(ids) else 0)
+    by_file = defaultdict(list)
+    for chunk_id, record in zip(ids, records):
+        by_file[record["metadata"]["file_name"]].append((int(chunk_id), record))
+    for file_name, file_chunks in by_file.items():
+        keys = IndexManifest.chunk_keys(file_name, [chunk for _, chunk in file_chunks])
+        manifest.set_file(
+            file_name,
+            "",
+            {key: chunk_id for key, (chunk_id, _) in zip(keys, file_chunks)},
+        )
+    return index, manifest
+
+
+def migrate_index_dir(
+    index_dir: Path,
+    index_type="flat",
+    params: Optional[dict] = None,
+    lock=None,
+    metric="l2",
+) -> ChunkIndex:
+    """Перевод каталога индекса llama_index в формат SegmentStore"""
+    index_dir = Path(index_dir)
+    lock = lock or FileLock(str(index_dir / "index.lock"))
+    index, manifest = load_llama_index(index_dir, index_type, params, metric)
+    with lock:
+        SegmentStore(index_dir, lock).write_base(index, manifest)
+        for name in LLAMA_INDEX_FILES:
+            (index_dir / name).unlink(missing_ok=True)
+    return index
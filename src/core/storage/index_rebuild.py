@@ -0,0 +1,136 @@
+﻿from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+from .chunk_index import ChunkIndex
+from .chunk_store import get_many
+from .document_chunker import DocumentChunker
+from .document_pipeline import DocumentPipeline
+from .index_manifest import IndexManifest
+from .segment_store import SegmentStore
+
+VERIFY_SAMPLE = 8
+
+
+def build_index(
+    data_dir: Path,
+    batches: Iterable[list],
+    embed: Callable,
+    index_type="flat",
+    params: Optional[dict] = None,
+    metric="l2",
+):
+    """Полное построение (ChunkIndex, IndexManifest) по пачкам чанков
+
+    Эмбеддинги считаются по пачкам, пока следующие чанки готовятся
+    (см. DocumentPipeline), и собираются до создания индекса: на них
+    обучаются IVF-индексы.
+    """
+    chunks, vectors = [], []
+    for batch in batches:
+        vectors.append(embed([chunk["text"] for chunk in batch]))
+        chunks.extend(batch)
+    print(f"Загружено чанков: {len(chunks)}")
+    if not chunks:
+        raise ValueError("🚫 Нет документов для индексации")
+
+    embeddings = np.vstack(vectors)
+    vectors.clear()
+    manifest = IndexManifest()
+    index = ChunkIndex.create(
+        embeddings.shape[1],
+        index_type,
+        params,
+        training_vectors=embeddings,
+        metric=metric,
+    )
+    ids = manifest.allocate_ids(len(chunks))
+    index.add(ids, embeddings, chunks)
+
+    by_file = defaultdict(list)
+    for chunk_id, chunk in zip(ids, chunks):
+        by_file[chunk["metadata"]["file_name"]].append((int(chunk_id), chunk))
+    for file_name, file_chunks in by_file.items():
+        keys = IndexManifest.chunk_keys(file_name, [chunk for _, chunk in file_chunks])
+        manifest.set_file(
+            file_name,
+            IndexManifest.hash_file(Path(data_dir) / file_name),
+            {key: chunk_id for key, (chunk_id, _) in zip(keys, file_chunks)},
+        )
+    return index, manifest
+
+
+def rebuild_worker(
+    data_dir,
+    target_dir,
+    embedder_factory: Callable,
+    index_type="flat",
+    params: Optional[dict] = None,
+    metric="l2",
+    batch_size=64,
+    workers=None,
+    chunker: Optional[DocumentChunker] = None,
+):
+    """Точка входа процесса пересборки: чанки, эмбеддинги и запись базы
+
+    Эмбеддер создается в дочернем процессе, чтобы модель и пакетный расчет
+    не делили GIL и память с обслуживающим процессом. chunker - тот же
+    DocumentChunker, что и при обновлениях на лету.
+    """
+    embedder = embedder_factory()
+    pipeline = DocumentPipeline(chunker, workers=workers)
+    print("🔧 Пересборка индекса...")
+    try:
+        index, manifest = build_index(
+            data_dir,
+            pipeline.iter_batches(sorted(Path(data_dir).glob("*.json")), batch_size),
+            lambda texts: embedder.embed_batched(texts, batch_size=batch_size),
+            index_type,
+            params,
+            metric,
+        )
+    finally:
+        pipeline.close()
+    SegmentStore.write_base_dir(Path(target_dir), index, manifest)
+
+
+def verify_base_dir(path: Path, dim: int, params: Optional[dict] = None) -> int:
+    """Проверка собранной базы перед переключением, возвращает число чанков
+
+    Векторы, записи и манифест должны совпадать по id, размерность - с
+    эмбеддингами запросов, а выборка чанков должна находиться поиском
+    по собственным векторам.
+    """
+    path = Path(path)
+    index = ChunkIndex.load(path, params)
+    manifest = IndexManifest.load(path / "manifest.json")
+
+    if not len(index):
+        raise ValueError("Собранный индекс пуст")
+    if index.index.d != dim:
+        raise ValueError(
+            f"Размерность индекса {index.index.d} не совпадает с эмбеддингами ({dim})"
+        )
+    if index.index.ntotal != len(index.records):
+        raise ValueError(
+            f"Векторов {index.index.ntotal}, записей чанков {len(index.records)}"
+        )
+    manifest_ids = [
+        chunk_id
+        for file_name in manifest.files
+        for chunk_id in manifest.chunk_ids(file_name).values()
+    ]
+    if sorted(manifest_ids) != sorted(index.records):
+        raise ValueError("Манифест не совпадает с записями чанков")
+
+    ids = np.array(sorted(index.records), dtype=np.int64)
+    sample = ids[np.linspace(0, len(ids) - 1, min(VERIFY_SAMPLE, len(ids))).astype(int)]
+    vectors = index.index.reconstruct_batch(sample)
+    for record, found in zip(
+        get_many(index.records, sample), index.search_batch(vectors, 10)
+    ):
+        if record["text"] not in [r["text"] for r, _ in found]:
+            raise ValueError("Чанк не находится поиском по собственному вектору")
+    return len(index)
@@ -0,0 +1,186 @@
+﻿import threading
+import time
+from pathlib import Path
+
+
+class IngestionQueue:
+    """Очередь изменений документов с устранением дребезга
+
+    События по одному пути объединяются (учитывается последнее). Накопленные
+    изменения применяются, когда события не приходили debounce секунд, но не
+    позже чем через max_wait после самого старого из них. Обработчик
+    вызывается пачкой из отдельного потока: apply_fn(updated, deleted).
+    При переполнении очереди накопленные события заменяются одной полной
+    сверкой каталога через rescan_fn.
+    """
+
+    def __init__(
+        self,
+        apply_fn,
+        rescan_fn=None,
+        debounce=1.0,
+        max_wait=None,
+        max_batch=200,
+        max_pending=5000,
+    ):
+        self.apply_fn = apply_fn
+        self.rescan_fn = rescan_fn
+        self.debounce = debounce
+        self.max_wait = max_wait if max_wait is not None else 10 * debounce
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+
+        self._pending = {}  # path -> (kind, время первого события)
+        self._rescan = False
+        self._last_event = 0.0
+        self._drains = 0  # ждущие drain: изменения применяются без задержки
+        self._busy = False
+        self._running = True
+        self._cond = threading.Condition()
+
+        self.events = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.applied_files = 0
+        self.overflows = 0
+        self.last_batch_seconds = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="ingestion", daemon=True)
+        self._thread.start()
+
+    def submit(self, path: Path, kind: str):
+        """Регистрация события: kind - "update" или "delete\" """
+        with self._cond:
+            now = time.monotonic()
+            self.events += 1
+            self._last_event = now
+
+            if self._rescan:
+                # полная сверка и так учтет этот файл
+                self.coalesced += 1
+                self._cond.notify()
+                return
+
+            if path in self._pending:
+                self.coalesced += 1
+                self._pending[path] = (kind, self._pending[path][1])
+                self._cond.notify()
+                return
+
+            if len(self._pending) >= self.max_pending:
+                if self.rescan_fn is not None:
+                    self.overflows += 1
+                    self.coalesced += len(self._pending) + 1
+                    self._pending.clear()
+                    self._rescan = True
+                    print(
+                        f"🟠 Очередь обновлений переполнена ({self.max_pending}), "
+                        "будет выполнена полная сверка каталога"
+                    )
+                    self._cond.notify()
+                    return
+                while len(self._pending) >= self.max_pending and self._running:
+                    self._cond.wait()
+
+            self._pending[path] = (kind, now)
+            self._cond.notify()
+
+    def drain(self, timeout=None) -> bool:
+        """Немедленное применение всех накопленных изменений с ожиданием
+
+        Задержка debounce отключается только на время ожидания.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._drains += 1
+            self._cond.notify_all()
+            try:
+                while self._pending or self._rescan or self._busy:
+                    remaining = (
+                        None if deadline is None else deadline - time.monotonic()
+                    )
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._drains -= 1
+        return True
+
+    def stop(self):
+        """Остановка с применением оставшихся изменений"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _next_due(self):
+        """Момент применения накопленных изменений; None - применять нечего"""
+        if not self._pending and not self._rescan:
+            return None
+        if self._drains or not self._running:
+            return 0.0
+        due = self._last_event + self.debounce
+        if self._pending:
+            oldest = min(first_seen for _, first_seen in self._pending.values())
+            due = min(due, oldest + self.max_wait)
+        return due
+
+    def _take_ready(self):
+        """Самые старые изменения, не больше max_batch"""
+        ready = sorted(
+            self._pending.items(), key=lambda item: (item[1][1], str(item[0]))
+        )[: self.max_batch]
+        for path, _ in ready:
+            del self._pending[path]
+
+        rescan = self._rescan
+        self._rescan = False
+        return [(path, kind) for path, (kind, _) in ready], rescan
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    due = self._next_due()
+                    if due is None and not self._running:
+                        return
+                    now = time.monotonic()
+                    if due is not None and due <= now:
+                        break
+                    self._cond.wait(None if due is None else due - now)
+
+                batch, rescan = self._take_ready()
+                self._busy = True
+                self._cond.notify_all()
+
+            started = time.monotonic()
+            try:
+                if rescan:
+                    self.rescan_fn()
+                if batch:
+                    self.apply_fn(
+                        [path for path, kind in batch if kind == "update"],
+                        [path for path, kind in batch if kind == "delete"],
+                    )
+            except Exception as e:
+                print(f"⚠️ Ошибка применения изменений документов: {str(e)}")
+
+            with self._cond:
+                self._busy = False
+                self.batches += 1
+                self.applied_files += len(batch)
+                self.last_batch_seconds = time.monotonic() - started
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "pending": len(self._pending),
+                "events": self.events,
+                "coalesced": self.coalesced,
+                "batches": self.batches,
+                "applied_files": self.applied_files,
+                "overflows": self.overflows,
+                "last_batch_seconds": round(self.last_batch_seconds, 3),
+            }
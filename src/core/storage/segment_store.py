@@ -0,0 +1,526 @@
+﻿import copy
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from .chunk_index import ChunkIndex
+from .index_manifest import IndexManifest
+
+
+class IndexDelta:
+    """Изменения индекса и манифеста, вносимые одной пачкой обновлений"""
+
+    def __init__(self):
+        self.ids = []
+        self.vectors = []
+        self.removed = []
+        self.records = {}
+        self.files = {}  # имя файла -> запись манифеста или None (удален)
+
+    def add(self, ids, vectors, records):
+        self.ids.extend(int(i) for i in ids)
+        self.vectors.append(np.asarray(vectors, dtype=np.float32))
+        self.records.update(zip(map(int, ids), records))
+
+    def remove(self, ids):
+        self.removed.extend(int(i) for i in ids)
+
+    def __bool__(self):
+        return bool(self.ids or self.removed or self.records or self.files)
+
+
+class SegmentStore:
+    """Хранение индекса: неизменяемая база, дельта-сегменты и журнал (WAL)
+
+    Раскладка каталога:
+        CURRENT            - имя актуальной базы (заменяется атомарно);
+        PREVIOUS           - база до последней полной пересборки, к ней
+                             можно откатиться (rollback);
+        base-<N>/          - полный снимок: faiss.index, chunks.json,
+                             chunks.sqlite (ChunkStore),
+                             manifest.json и meta.json с номером
+                             последней вошедшей записи журнала;
+        segments/seg-*.npz - векторы, добавленные одной пачкой;
+        wal.jsonl          - журнал пачек: id, записи чанков, удаления
+                             и изменения манифеста;
+        quarantine/<база>/ - база, которая не загрузилась, вместе с ее
+                             журналом и сегментами (см. quarantine_current).
+
+    Пачка сначала пишет сегмент с векторами, затем запись журнала с fsync;
+    запись журнала - точка фиксации. Оборванная последняя строка журнала и
+    сегменты без записи в журнале при загрузке игнорируются. Фоновое
+    уплотнение пишет новую базу во временный каталог, переключает CURRENT
+    и удаляет вошедшие в базу сегменты, не трогая действующую базу до
+    переключения. Прежняя база, которую еще держат открытой читатели
+    старой версии (mmap, SQLite), удаляется повторно при следующих
+    публикациях, если сразу удалить ее не удалось.
+
+    Полная пересборка пишет базу в REBUILD_DIR вне хранилища, а switch_base
+    делает ее текущей; прежняя текущая база сохраняется как PREVIOUS.
+    """
+
+    REBUILD_DIR = "rebuild.tmp"
+    QUARANTINE_DIR = "quarantine"
+
+    def __init__(
+        self, index_dir: Path, lock, compact_segments=32, compact_bytes=64 << 20
+    ):
+        self.index_dir = Path(index_dir)
+        self.segments_dir = self.index_dir / "segments"
+        self.wal_path = self.index_dir / "wal.jsonl"
+        self.lock = lock
+        self.compact_segments = compact_segments
+        self.compact_bytes = compact_bytes
+
+        self.base_name = None
+        self.previous_base = None
+        self.generation = 0
+        self.epoch = 0
+        self.seq = 0
+        self.wal_entries = 0
+        self.wal_size = 0  # размер журнала после последнего чтения или записи
+        self.compactions = 0
+        self._compactor = None
+        self._retired_bases = []
+
+    def exists(self) -> bool:
+        return (self.index_dir / "CURRENT").exists() or self._has_legacy_layout()
+
+    def _has_legacy_layout(self) -> bool:
+        """Индекс в корне каталога, сохраненный до появления сегментов"""
+        return all(
+            (self.index_dir / name).exists()
+            for name in ("faiss.index", "chunks.json", "manifest.json")
+        )
+
+    def load(self, params: Optional[dict] = None, mmap=False):
+        """Загрузка базы и повтор журнала, возвращает (ChunkIndex, IndexManifest)
+
+        mmap=True открывает базу без чтения в память (см. ChunkIndex.load).
+        """
+        current = self.index_dir / "CURRENT"
+        if current.exists():
+            self.base_name = current.read_text(encoding="utf-8").strip()
+            base_dir = self.index_dir / self.base_name
+            with open(base_dir / "meta.json", "r", encoding="utf-8") as f:
+                base_seq = json.load(f)["seq"]
+        else:
+            base_dir, base_seq = self.index_dir, 0
+        previous = self.index_dir / "PREVIOUS"
+        self.previous_base = None
+        if previous.exists():
+            name = previous.read_text(encoding="utf-8").strip()
+            if name and (self.index_dir / name).exists():
+                self.previous_base = name
+        self.generation = max(
+            self._base_generation(self.base_name),
+            self._base_generation(self.previous_base),
+        )
+        self._remove_orphans()
+
+        index = ChunkIndex.load(base_dir, params, mmap=mmap)
+        manifest = IndexManifest.load(base_dir / "manifest.json")
+        self.seq = base_seq
+
+        replayed = 0
+        # размер до чтения: дописанное во время чтения подхватит catch_up
+        self.wal_size = self._wal_file_size()
+        for entry in self._read_wal():
+            if entry["seq"] <= base_seq:
+                continue
+            self._apply_entry(index, manifest, entry)
+            self.seq = entry["seq"]
+            replayed += 1
+        self.wal_entries = replayed
+        if replayed:
+            print(f"♻️ Применено записей журнала индекса: {replayed}")
+        return index, manifest
+
+    def catch_up(self, index: ChunkIndex, manifest: IndexManifest):
+        """Применение записей журнала, дописанных другим процессом
+
+        Вызывается под блокировкой индекса до выдачи id новым чанкам.
+        Возвращает имена измененных файлов или None, если другой процесс
+        опубликовал новую базу и индекс нужно загрузить заново.
+        """
+        current = self.index_dir / "CURRENT"
+        name = current.read_text(encoding="utf-8").strip() if current.exists() else None
+        if name != self.base_name:
+            return None
+        size = self._wal_file_size()
+        if size == self.wal_size:
+            return []
+        files = []
+        for entry in self._read_wal():
+            if entry["seq"] <= self.seq:
+                continue
+            self._apply_entry(index, manifest, entry)
+            self.seq = entry["seq"]
+            self.wal_entries += 1
+            files.extend(entry["files"])
+        self.wal_size = size
+        return files
+
+    def append(self, delta: IndexDelta, next_id: int):
+        """Фиксация пачки изменений: сегмент с векторами и запись журнала
+
+        Журнал, измененный другим процессом после catch_up, не дописывается:
+        номера записей и id чанков пачки выданы по устаревшему состоянию.
+        """
+        if not delta:
+            return
+        if self._wal_file_size() != self.wal_size:
+            raise RuntimeError("Журнал индекса изменен другим процессом")
+        seq = self.seq + 1
+        segment = None
+        if delta.ids:
+            self.segments_dir.mkdir(exist_ok=True)
+            segment = f"seg-{seq:08d}.npz"
+            tmp_path = self.segments_dir / f"{segment}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f,
+                    ids=np.array(delta.ids, dtype=np.int64),
+                    vectors=np.vstack(delta.vectors),
+                )
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.segments_dir / segment)
+
+        entry = {
+            "seq": seq,
+            "segment": segment,
+            "added": delta.ids,
+            "removed": delta.removed,
+            "records": delta.records,
+            "files": delta.files,
+            "next_id": next_id,
+        }
+        self._repair_wal_tail()
+        with open(self.wal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            self.wal_size = os.fstat(f.fileno()).st_size
+        self.seq = seq
+        self.wal_entries += 1
+
+    def write_base(self, index: ChunkIndex, manifest: IndexManifest):
+        """Синхронная запись полного снимка (после полного построения индекса)"""
+        self._publish_base(index, manifest, self.seq)
+
+    @classmethod
+    def write_base_dir(
+        cls, path: Path, index: ChunkIndex, manifest: IndexManifest, seq: int = 0
+    ):
+        """Запись снимка в каталог path (каталог создается заново)"""
+        path = Path(path)
+        shutil.rmtree(path, ignore_errors=True)
+        path.mkdir()
+        index.save(path)
+        manifest.save(path / "manifest.json")
+        cls._write_meta(path, seq)
+        for file in path.iterdir():
+            cls._fsync_path(file)
+
+    def rebuild_dir(self) -> Path:
+        """Каталог для базы, собираемой полной пересборкой (очищается)"""
+        path = self.index_dir / self.REBUILD_DIR
+        shutil.rmtree(path, ignore_errors=True)
+        return path
+
+    def switch_base(self, path: Path) -> str:
+        """Переключение на базу, собранную полной пересборкой в каталоге path
+
+        Текущая база становится предыдущей (для rollback), более старая
+        удаляется. Записи журнала относятся к id чанков прежней базы и
+        отбрасываются: изменения документов за время сборки подхватывает
+        последующая сверка каталога.
+        """
+        with self.lock:
+            self.generation += 1
+            name = f"base-{self.generation:06d}"
+            self._write_meta(Path(path), self.seq)
+            os.replace(path, self.index_dir / name)
+            self._activate(name)
+        return name
+
+    def rollback(self) -> str:
+        """Возврат к базе, действовавшей до последнего switch_base"""
+        with self.lock:
+            if not self.previous_base:
+                raise ValueError("Нет предыдущей версии индекса для отката")
+            name = self.previous_base
+            self._write_meta(self.index_dir / name, self.seq)
+            self._activate(name)
+        return name
+
+    def quarantine_current(self) -> Optional[str]:
+        """Перенос не загрузившейся текущей базы в QUARANTINE_DIR
+
+        Журнал и сегменты относятся к id чанков этой базы и уходят вместе с
+        ней. Текущей становится предыдущая база; возвращает ее имя или None,
+        если откатываться некуда.
+        """
+        with self.lock:
+            current = self.index_dir / "CURRENT"
+            name = (
+                current.read_text(encoding="utf-8").strip() if current.exists() else ""
+            )
+            previous = self.index_dir / "PREVIOUS"
+            fallback = (
+                previous.read_text(encoding="utf-8").strip()
+                if previous.exists()
+                else ""
+            )
+
+            target = self.index_dir / self.QUARANTINE_DIR / (name or "legacy")
+            shutil.rmtree(target, ignore_errors=True)
+            target.mkdir(parents=True)
+            if name and (self.index_dir / name).exists():
+                os.replace(self.index_dir / name, target / "base")
+            elif not name:
+                for file_name in ("faiss.index", "chunks.json", "manifest.json"):
+                    if (self.index_dir / file_name).exists():
+                        os.replace(self.index_dir / file_name, target / file_name)
+            for path in (self.wal_path, self.segments_dir):
+                if path.exists():
+                    os.replace(path, target / path.name)
+            print(f"🟠 База {name or 'индекса'} перенесена в {target}")
+
+            self.base_name = self.previous_base = None
+            self.wal_entries = self.wal_size = 0
+            if (
+                not fallback
+                or fallback == name
+                or not (self.index_dir / fallback).exists()
+            ):
+                current.unlink(missing_ok=True)
+                previous.unlink(missing_ok=True)
+                return None
+            self._write_current(fallback)
+            self._write_pointer("PREVIOUS", "")
+            self.epoch += 1
+        return fallback
+
+    def _activate(self, name: str):
+        """Переключение CURRENT на name с сохранением текущей базы в PREVIOUS"""
+        self._write_current(name)
+        retired = self.previous_base if self.previous_base != name else None
+        self.previous_base, self.base_name = self.base_name, name
+        self._write_pointer("PREVIOUS", self.previous_base or "")
+        self.epoch += 1
+        self._truncate_wal(self.seq)
+        self._remove_stale_files(self.seq, retired)
+
+    def needs_compaction(self) -> bool:
+        return (
+            self.wal_entries >= self.compact_segments
+            or self._wal_file_size() >= self.compact_bytes
+        )
+
+    def maybe_compact(self, state_fn):
+        """Запуск фонового уплотнения, если журнал разросся
+
+        state_fn возвращает текущие (ChunkIndex, IndexManifest) и вызывается
+        под блокировкой индекса.
+        """
+        if not self.needs_compaction():
+            return
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._compactor = threading.Thread(
+            target=self.compact, args=(state_fn,), name="index-compaction", daemon=True
+        )
+        self._compactor.start()
+
+    def compact(self, state_fn):
+        """Слияние базы и журнала в новую базу"""
+        try:
+            with self.lock:
+                index, manifest = state_fn()
+                snapshot = index.snapshot()
+                manifest = IndexManifest(
+                    copy.deepcopy(manifest.files), manifest.next_id
+                )
+                seq = self.seq
+                epoch = self.epoch
+
+            # запись базы идет без блокировки: обновления продолжают журнал
+            if self._publish_base(snapshot, manifest, seq, epoch):
+                self.compactions += 1
+                print(f"🗜 Индекс уплотнен: база {self.base_name}")
+        except Exception as e:
+            print(f"⚠️ Ошибка уплотнения индекса: {str(e)}")
+
+    def _publish_base(
+        self,
+        index: ChunkIndex,
+        manifest: IndexManifest,
+        seq: int,
+        epoch: Optional[int] = None,
+    ) -> bool:
+        """Запись и публикация базы; epoch - номер публикации, от которой
+        снят снимок: если с тех пор опубликована другая база, снимок
+        отбрасывается. False - база не опубликована.
+        """
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+        name = f"base-{generation:06d}"
+        tmp_dir = self.index_dir / f"{name}.tmp"
+        self.write_base_dir(tmp_dir, index, manifest, seq)
+        os.replace(tmp_dir, self.index_dir / name)
+
+        with self.lock:
+            if epoch is not None and epoch != self.epoch:
+                # пока писался снимок, опубликована другая база
+                shutil.rmtree(self.index_dir / name, ignore_errors=True)
+                return False
+            self._write_current(name)
+            old_base, self.base_name = self.base_name, name
+            self.epoch += 1
+            self._truncate_wal(seq)
+            self._remove_stale_files(seq, old_base)
+        return True
+
+    @staticmethod
+    def _base_generation(name: Optional[str]) -> int:
+        if not name:
+            return 0
+        return int(name.split("-")[1])
+
+    @staticmethod
+    def _write_meta(path: Path, seq: int):
+        """Номер последней вошедшей в базу записи журнала (атомарная замена)"""
+        tmp_path = path / "meta.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"seq": seq}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path / "meta.json")
+
+    def _remove_orphans(self):
+        """Удаление баз, оставшихся от прерванной записи снимка или пересборки"""
+        keep = {self.base_name, self.previous_base}
+        for path in self.index_dir.glob("base-*"):
+            if path.name not in keep:
+                shutil.rmtree(path, ignore_errors=True)
+        shutil.rmtree(self.index_dir / self.REBUILD_DIR, ignore_errors=True)
+
+    def _write_current(self, name: str):
+        self._write_pointer("CURRENT", name)
+
+    def _write_pointer(self, file_name: str, value: str):
+        tmp_path = self.index_dir / f"{file_name}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(value)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_dir / file_name)
+        self._fsync_path(self.index_dir)
+
+    def _truncate_wal(self, seq: int):
+        """Удаление из журнала записей, вошедших в базу"""
+        entries = [entry for entry in self._read_wal() if entry["seq"] > seq]
+        tmp_path = Path(f"{self.wal_path}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            self.wal_size = os.fstat(f.fileno()).st_size
+        os.replace(tmp_path, self.wal_path)
+        self.wal_entries = len(entries)
+
+    def _remove_stale_files(self, seq: int, old_base: Optional[str]):
+        if old_base:
+            self._retired_bases.append(old_base)
+            self._retired_bases = [
+                name for name in self._retired_bases if not self._remove_base(name)
+            ]
+        else:
+            for name in ("faiss.index", "chunks.json", "manifest.json"):
+                (self.index_dir / name).unlink(missing_ok=True)
+        if self.segments_dir.exists():
+            for segment in self.segments_dir.glob("seg-*"):
+                number = segment.name[len("seg-") :].split(".")[0]
+                if int(number) <= seq:
+                    segment.unlink(missing_ok=True)
+
+    def _remove_base(self, name: str) -> bool:
+        """Удаление прежней базы; False - файлы еще заняты читателями"""
+        shutil.rmtree(self.index_dir / name, ignore_errors=True)
+        return not (self.index_dir / name).exists()
+
+    def _wal_file_size(self) -> int:
+        return self.wal_path.stat().st_size if self.wal_path.exists() else 0
+
+    def _read_wal(self) -> list:
+        """Записи журнала; оборванная последняя строка пропускается"""
+        if not self.wal_path.exists():
+            return []
+        entries = []
+        with open(self.wal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    break
+        return entries
+
+    def _repair_wal_tail(self):
+        """Отрезание оборванной после сбоя последней строки журнала"""
+        if not self.wal_path.exists():
+            return
+        with open(self.wal_path, "rb") as f:
+            data = f.read()
+        if data and not data.endswith(b"\n"):
+            with open(self.wal_path, "r+b") as f:
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def _apply_entry(self, index: ChunkIndex, manifest: IndexManifest, entry: dict):
+        records = {int(k): v for k, v in entry["records"].items()}
+        removed = set(entry["removed"])
+        if entry["segment"]:
+            with np.load(self.segments_dir / entry["segment"]) as segment:
+                ids, vectors = segment["ids"], segment["vectors"]
+            index.add(ids, vectors, [records[int(i)] for i in ids])
+        index.remove(entry["removed"])
+        index.records.update(
+            (chunk_id, record)
+            for chunk_id, record in records.items()
+            if chunk_id not in removed
+        )
+        for file_name, file_entry in entry["files"].items():
+            if file_entry is None:
+                manifest.files.pop(file_name, None)
+            else:
+                manifest.files[file_name] = file_entry
+        manifest.next_id = max(manifest.next_id, entry["next_id"])
+
+    @staticmethod
+    def _fsync_path(path: Path):
+        """fsync файла или каталога (для каталогов только на POSIX)"""
+        if path.is_dir() and os.name == "nt":
+            return
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def stats(self) -> dict:
+        return {
+            "base": self.base_name,
+            "previous_base": self.previous_base,
+            "seq": self.seq,
+            "wal_entries": self.wal_entries,
+            "compactions": self.compactions,
+            "retired_bases": len(self._retired_bases),
+        }
@@ -0,0 +1,137 @@
+﻿import threading
+from collections import OrderedDict, defaultdict
+from typing import Optional
+
+import faiss
+import numpy as np
+
+
+class SemanticCache:
+    """Кэш проверенных ответов для близких по смыслу вопросов
+
+    Эмбеддинги прошлых запросов хранятся в небольшом FAISS-индексе
+    (скалярное произведение нормированных векторов = косинусная близость).
+    Ответ возвращается, если близость нового запроса к сохраненному не ниже
+    threshold и ответ построен по тому же промпту. Записи привязаны к
+    файлам-источникам контекста и удаляются при изменении любого из них;
+    ответы без источников не кэшируются - их нечем инвалидировать.
+    """
+
+    def __init__(self, threshold=0.9, max_entries=1000):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.index = None
+        self._entries = OrderedDict()
+        self._by_source = defaultdict(set)
+        self._by_prompt = defaultdict(set)
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def lookup(self, query_embedding, prompt: str = "") -> Optional[dict]:
+        """Поиск ответа на близкий вопрос, заданный с тем же промптом
+
+        Возвращает запись с ключами query, prompt, response, validation,
+        sources и score либо None.
+        """
+        vector = self._as_matrix(query_embedding)
+        with self._lock:
+            ids = self._by_prompt.get(prompt)
+            if not ids:
+                self.misses += 1
+                return None
+
+            selector = faiss.IDSelectorBatch(np.fromiter(ids, dtype=np.int64))
+            scores, ids = self.index.search(
+                vector, 1, params=faiss.SearchParameters(sel=selector)
+            )
+            entry_id, score = int(ids[0][0]), float(scores[0][0])
+            if entry_id < 0 or score < self.threshold:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return {**self._entries[entry_id], "score": score}
+
+    def add(
+        self,
+        query: str,
+        query_embedding,
+        response: str,
+        validation,
+        sources,
+        prompt: str = "",
+    ) -> bool:
+        """Сохранение проверенного ответа; False - ответ без источников"""
+        sources = set(sources)
+        if not sources:
+            return False
+        vector = self._as_matrix(query_embedding)
+        with self._lock:
+            if self.index is None:
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self.index.add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+            self._entries[entry_id] = {
+                "query": query,
+                "prompt": prompt,
+                "response": response,
+                "validation": validation,
+                "sources": sorted(sources),
+            }
+            for source in sources:
+                self._by_source[source].add(entry_id)
+            self._by_prompt[prompt].add(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                self._remove([next(iter(self._entries))])
+        return True
+
+    def invalidate_source(self, source: str) -> int:
+        """Удаление всех ответов, в контекст которых входил источник"""
+        with self._lock:
+            ids = list(self._by_source.pop(source, ()))
+            self._remove(ids)
+            self.invalidated += len(ids)
+        if ids:
+            print(f"🧹 Семантический кэш: удалено {len(ids)} ответов по {source}")
+        return len(ids)
+
+    def _remove(self, ids: list):
+        ids = [entry_id for entry_id in ids if entry_id in self._entries]
+        if not ids:
+            return
+
+        self.index.remove_ids(np.array(ids, dtype=np.int64))
+        for entry_id in ids:
+            entry = self._entries.pop(entry_id)
+            for source in entry["sources"]:
+                self._by_source[source].discard(entry_id)
+                if not self._by_source[source]:
+                    del self._by_source[source]
+            self._by_prompt[entry["prompt"]].discard(entry_id)
+            if not self._by_prompt[entry["prompt"]]:
+                del self._by_prompt[entry["prompt"]]
+
+    @staticmethod
+    def _as_matrix(embedding) -> np.ndarray:
+        return np.ascontiguousarray(
+            np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidated": self.invalidated,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
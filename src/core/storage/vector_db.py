@@ -1,138 +1,418 @@
-﻿from pathlib import Path
-import faiss
-from llama_index.core import VectorStoreIndex, StorageContext
-from llama_index.vector_stores.faiss import FaissVectorStore
+﻿import multiprocessing
+import shutil
+import threading
+import weakref
+from concurrent.futures import Future
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+from filelock import FileLock
+
+from .ann_index import resolve_params
+from .chunk_index import ChunkIndex
+from .document_chunker import DocumentChunker
+from .document_pipeline import DocumentPipeline
+from .document_watcher import DocumentWatcher
+from .index_manifest import IndexManifest
+from .index_migration import has_llama_index_layout, migrate_index_dir
+from .index_rebuild import build_index, rebuild_worker, verify_base_dir
+from .segment_store import IndexDelta, SegmentStore
 
 
 class VectorStore:
-    def __init__(self, data_dir="documents", index_dir="faiss_index", embedder=None):
+    """Векторное хранилище документов с обновлением индекса на лету
+
+    Поиск работает без блокировок: читатель один раз берет ссылку на
+    текущую версию индекса и манифеста, которая после публикации не
+    меняется. Обновление строит следующую версию (ChunkIndex.next_version),
+    дописывает журнал и публикует ее одним присваиванием. Старая версия
+    освобождается, когда ее отпускает последний читатель.
+
+    Полная пересборка (rebuild_index) идет в дочернем процессе и
+    переключает индекс на новую базу той же публикацией версии; прежняя
+    база остается для отката (rollback_index).
+    """
+
+    def __init__(
+        self,
+        data_dir="documents",
+        index_dir="faiss_index",
+        embedder=None,
+        embed_batch_size=64,
+        index_type="flat",
+        index_params=None,
+        watch_debounce=1.0,
+        fast_start=False,
+        metric="ip",
+        embedder_factory=None,
+        ingest_workers=None,
+        chunk_strategy="sections",
+    ):
+        """index_type - flat, hnsw, ivf_flat или ivf_pq (см. ann_index.py);
+        index_params - параметры построения и поиска (M, efSearch, nlist, nprobe...);
+        watch_debounce - сколько секунд файл должен не меняться до переиндексации;
+        fast_start - открыть FAISS-индекс через mmap, не читая его в память;
+        metric - метрика нового индекса: ip (косинус нормированных векторов) или l2;
+        embedder_factory - создание эмбеддера в процессе пересборки (должна
+        передаваться в дочерний процесс через pickle);
+        ingest_workers - число процессов для разбора и чанкинга документов
+        (по умолчанию по числу ядер);
+        chunk_strategy - sections (нумерованные пункты целиком) или sentence,
+        см. DocumentChunker; одинакова для полного построения и обновлений
+        """
         if embedder is None:
             raise ValueError("Embedder must be provided!")
 
         self.data_dir = Path(data_dir)
         self.index_dir = Path(index_dir)
-        self.documents = []
         self.index = None
-        self.vector_store = None
+        self.manifest = IndexManifest()
+        self.version = 0
+        self._retired = weakref.WeakSet()
         self.index_lock = FileLock(str(self.index_dir / "index.lock"))
+        self.store = SegmentStore(self.index_dir, self.index_lock)
         self.embedder = embedder
-        self._init_embedding_settings()
+        self.embed_batch_size = embed_batch_size
+        self.index_type = index_type
+        self.index_params = resolve_params(index_type, index_params)
+        self.fast_start = fast_start
+        self.metric = metric
+        self.embedder_factory = embedder_factory
+        self.ingest_workers = ingest_workers
+        self.chunker = DocumentChunker(strategy=chunk_strategy)
+        self.pipeline = DocumentPipeline(self.chunker, workers=ingest_workers)
+        self.update_listeners = []
+        self._rebuild = None
+        self._rebuild_guard = threading.Lock()
 
         self.data_dir.mkdir(parents=True, exist_ok=True)
         self.index_dir.mkdir(parents=True, exist_ok=True)
 
         self.watcher = DocumentWatcher(
-            data_dir=self.data_dir, update_handler=self.handle_document_update
+            data_dir=self.data_dir,
+            change_handler=self.apply_document_changes,
+            rescan_handler=self.resync_documents,
+            debounce=watch_debounce,
         )
         self.watcher.start()
 
         self.index_exists = self._check_index_exists()
-        self._load_index()
-
-    def _init_embedding_settings(self):
-        """Инициализация настроек эмбеддингов"""
-        from llama_index.core import Settings
-
-        Settings.embed_model = self._create_embedding_adapter()
+        if self._load_index():
+            # хэши файлов после переноса пустые, а прежняя база могла
+            # отстать от документов: сверка заполнит и догонит их
+            self.resync_documents()
 
     def handle_document_update(self, file_path: Path):
-        """Обработчик обновления документов"""
-        print(f"🔄 Обнаружено изменение: {file_path.name}")
-
+        """Обработчик обновления документа: в индекс попадает только разница"""
+        self.apply_document_changes([file_path], [])
+
+    def handle_document_delete(self, file_path: Path):
+        """Удаление из индекса всех чанков удаленного документа"""
+        self.apply_document_changes([], [file_path])
+
+    def apply_document_changes(self, updated: list, deleted: list):
+        """Применение пачки изменений документов с одним сохранением индекса
+
+        Эмбеддинги новых чанков всех файлов пачки считаются одним пакетным
+        вызовом. Файл, которого уже нет на диске, считается удаленным.
+        """
+        deleted = list(deleted) + [path for path in updated if not path.exists()]
+        updated = [path for path in updated if path.exists()]
+        changed = []
+
+        with self.index_lock:
+            if self.index is None:
+                if updated:
+                    try:
+                        self.create_index()
+                        changed = updated
+                    except Exception as e:
+                        print(f"⚠️ Ошибка построения индекса: {str(e)}")
+                        self._log_error(updated[0], str(e))
+            else:
+                changed = self._catch_up() + self._apply_changes(updated, deleted)
+
+        for file_path in changed:
+            self._notify_update_listeners(file_path)
+
+    def _catch_up(self) -> list:
+        """Догон изменений, которые другой процесс записал в хранилище
+
+        Вызывается под index_lock до выдачи id новым чанкам, чтобы они не
+        пересеклись с id, уже записанными в журнал. Возвращает пути
+        измененных файлов для подписчиков.
+        """
+        index = self.index.next_version()
+        manifest = self.manifest.copy()
         try:
-            new_docs = self._load_and_process_file(file_path)
-            if not new_docs:
-                return
-
-            with self.index_lock:
-                self._update_index(new_docs)
-                self._atomic_save()
-                print(f"✅ Индекс успешно обновлен из {file_path.name}")
-
+            files = self.store.catch_up(index, manifest)
+            if files is None:
+                print("🔄 База индекса сменилась в другом процессе, загрузка...")
+                self._reload_published()
+                return []
         except Exception as e:
-            print(f"⚠️ Ошибка обработки документа: {str(e)}")
-            self._log_error(file_path, str(e))
-
-    def _load_and_process_file(self, path: Path) -> list:
-        """Загрузка и обработка документа"""
-        with open(path, "r", encoding="utf-8-sig") as f:
-            data = json.load(f)
-            items = data if isinstance(data, list) else [data]
-
-            valid_docs = []
-            for item in items:
-                chunks = self._split_document(item)
-                valid_docs.extend(chunks)
-            return valid_docs
-
-    def _split_document(self, doc: dict) -> list:
-        """Разделение документа на чанки"""
-        from llama_index.core.node_parser import SentenceSplitter
-
-        splitter = SentenceSplitter(
-            chunk_size=1024, chunk_overlap=128, include_metadata=True
-        )
-
-        text = doc["text"]
-        metadata = doc["metadata"]
-
-        return [
-            {
-                "text": chunk,
-                "metadata": {
-                    **metadata,
-                    "chunk_id": f"{metadata['doc_id']}_part_{i+1}",
-                },
-            }
-            for i, chunk in enumerate(splitter.split_text(text))
-        ]
-
-    def _update_index(self, new_docs: list):
-        """Обновление индекса новыми данными"""
-        from llama_index.core import Settings
-        from llama_index.core.schema import TextNode
-
-        self._init_embedding_settings()
+            # журнал, который не удалось догнать, не дописывается (см. append)
+            print(f"⚠️ Ошибка чтения журнала индекса: {str(e)}")
+            return []
+        if files:
+            self._publish(index, manifest)
+        return [self.data_dir / file_name for file_name in files]
+
+    def _apply_changes(self, updated: list, deleted: list) -> list:
+        """Изменения вносятся в следующую версию индекса и дописываются в журнал
+
+        Версия публикуется только после записи журнала; при ошибке читатели
+        продолжают работать с прежней версией.
+        """
+        index = self.index.next_version()
+        manifest = self.manifest.copy()
+        delta = IndexDelta()
+        removed = 0
+        changed = []
+        for file_path in deleted:
+            chunk_ids = manifest.remove_file(file_path.name)
+            if chunk_ids:
+                print(f"🗑 Документ удален: {file_path.name}")
+                index.remove(chunk_ids.values())
+                delta.remove(chunk_ids.values())
+                delta.files[file_path.name] = None
+                removed += len(chunk_ids)
+                changed.append(file_path)
+
+        plans = []
+        for file_path in updated:
+            try:
+                plan = self._plan_file(file_path, manifest)
+            except Exception as e:
+                print(f"⚠️ Ошибка обработки документа {file_path.name}: {str(e)}")
+                self._log_error(file_path, str(e))
+                continue
+            if plan is not None:
+                print(f"🔄 Обнаружено изменение: {file_path.name}")
+                plans.append(plan)
+                changed.append(file_path)
 
-        nodes = [
-            TextNode(
-                text=doc["text"],
-                metadata=doc["metadata"],
-                id_=f"{doc['metadata']['doc_id']}_{i}",
-                embedding=self.embedder.embed([doc["text"]])[0].tolist(),
+        added = 0
+        try:
+            if plans:
+                added, stale = self._apply_plans(plans, delta, index, manifest)
+                removed += stale
+            if delta:
+                self.store.append(delta, manifest.next_id)
+                self._publish(index, manifest)
+                self.store.maybe_compact(lambda: (self.index, self.manifest))
+        except Exception as e:
+            print(f"⚠️ Ошибка обновления индекса: {str(e)}")
+            self._log_error(changed[0], str(e))
+            return changed
+
+        if changed:
+            print(
+                f"✅ Индекс обновлен: файлов {len(changed)}, "
+                f"+{added} / -{removed} чанков"
             )
-            for i, doc in enumerate(new_docs)
+        return changed
+
+    def resync_documents(self):
+        """Полная сверка каталога документов с манифестом"""
+        files = self._document_files()
+        names = {file.name for file in files}
+        missing = [
+            self.data_dir / name for name in self.manifest.files if name not in names
         ]
-
-        if self.index:
-            self.index.insert_nodes(nodes)
-            self.index.storage_context.persist(persist_dir=str(self.index_dir))
-        else:
-            self.create_index()
-        self.index.storage_context.persist(persist_dir=str(self.index_dir))
-        print(f"Embedder status: {'OK' if self.embedder else 'NOT INITIALIZED'}")
-        print(f"Embedding test: {self.embedder.embed(['test'])[0][:5]}...")
-
-    def _atomic_save(self):
-        """Атомарное сохранение индекса"""
-        temp_dir = self.index_dir / f"temp_{int(time.time())}"
-        temp_dir.mkdir(exist_ok=True)
-
+        self.apply_document_changes(files, missing)
+
+    def ingestion_stats(self) -> dict:
+        """Метрики очереди обновлений документов"""
+        return self.watcher.stats()
+
+    def _publish(self, index: ChunkIndex, manifest: IndexManifest):
+        """Атомарная замена текущей версии индекса и манифеста
+
+        Прежняя версия остается у читателей, которые успели ее взять, и
+        отслеживается по слабой ссылке до освобождения.
+        """
+        if self.index is not None:
+            self._retired.add(self.index)
+        self.index, self.manifest = index, manifest
+        self.version += 1
+
+    def rebuild_index(self, wait=False) -> Future:
+        """Полная пересборка индекса в отдельном процессе (blue/green)
+
+        Дочерний процесс заново разбивает документы и считает эмбеддинги,
+        записывая базу в отдельный каталог; поиск все это время идет по
+        текущей версии. Собранная база проверяется и становится текущей,
+        после чего сверка каталога применяет изменения, пришедшие за время
+        сборки. Future получает True, если индекс переключен.
+        """
+        if self.embedder_factory is None:
+            raise ValueError("Для пересборки индекса нужен embedder_factory")
+        with self._rebuild_guard:
+            if self._rebuild is not None and not self._rebuild.done():
+                return self._rebuild
+            future = self._rebuild = Future()
+        threading.Thread(
+            target=self._run_rebuild, args=(future,), name="index-rebuild", daemon=True
+        ).start()
+        if wait:
+            future.result()
+        return future
+
+    def _run_rebuild(self, future: Future):
+        target = self.store.rebuild_dir()
         try:
-            faiss_index = self.index.storage_context.vector_store.client
+            process = multiprocessing.get_context("spawn").Process(
+                target=rebuild_worker,
+                args=(
+                    str(self.data_dir),
+                    str(target),
+                    self.embedder_factory,
+                    self.index_type,
+                    self.index_params,
+                    self.metric,
+                    self.embed_batch_size,
+                    self.ingest_workers,
+                    self.chunker,
+                ),
+                name="index-rebuild",
+            )
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                raise RuntimeError(
+                    f"процесс сборки завершился с кодом {process.exitcode}"
+                )
+            chunks = verify_base_dir(
+                target, self.embedder.embed(["проверка"]).shape[1], self.index_params
+            )
 
-            self.index.storage_context.persist(persist_dir=str(temp_dir))
+            with self.index_lock:
+                name = self.store.switch_base(target)
+                self._reload_published()
+            print(f"✅ Индекс пересобран: {chunks} чанков, база {name}")
+        except Exception as e:
+            print(f"⚠️ Ошибка пересборки индекса: {str(e)}")
+            shutil.rmtree(target, ignore_errors=True)
+            future.set_result(False)
+            return
+        self.resync_documents()
+        future.set_result(True)
 
-            faiss.write_index(faiss_index, str(temp_dir / "faiss.index"))
+    def rollback_index(self) -> bool:
+        """Возврат к версии индекса, действовавшей до последней пересборки"""
+        with self.index_lock:
+            try:
+                name = self.store.rollback()
+                self._reload_published()
+            except Exception as e:
+                print(f"⚠️ Ошибка отката индекса: {str(e)}")
+                return False
+        print(f"↩️ Индекс возвращен к базе {name}")
+        self.resync_documents()
+        return True
+
+    def _reload_published(self):
+        """Загрузка текущей базы хранилища и публикация ее как новой версии
+
+        Подписчики получают все файлы старой и новой версии: чанки
+        поменялись целиком.
+        """
+        old_files = set(self.manifest.files)
+        index, manifest = self.store.load(self.index_params, mmap=self.fast_start)
+        self._publish(index, manifest)
+        self.index_exists = True
+        for file_name in sorted(old_files | set(manifest.files)):
+            self._notify_update_listeners(self.data_dir / file_name)
+
+    def snapshot_stats(self) -> dict:
+        """Номер опубликованной версии и число еще не освобожденных старых"""
+        return {"version": self.version, "retired_alive": len(self._retired)}
+
+    def add_update_listener(self, callback):
+        """Подписка на изменения документов (callback получает путь к файлу)"""
+        self.update_listeners.append(callback)
+
+    def _notify_update_listeners(self, file_path: Path):
+        for callback in self.update_listeners:
+            try:
+                callback(file_path)
+            except Exception as e:
+                print(f"⚠️ Ошибка обработчика обновления: {str(e)}")
+
+    def _plan_file(self, file_path: Path, manifest: IndexManifest):
+        """Разница между чанками файла в индексе и его текущим содержимым
+
+        Возвращает None, если содержимое файла не изменилось.
+        """
+        file_hash = IndexManifest.hash_file(file_path)
+        if manifest.is_current(file_path.name, file_hash):
+            return None
+
+        chunks = self._load_and_process_file(file_path)
+        keys = IndexManifest.chunk_keys(file_path.name, chunks)
+        old_ids = manifest.chunk_ids(file_path.name)
+        current_keys = set(keys)
+        return {
+            "file_name": file_path.name,
+            "hash": file_hash,
+            "keys": keys,
+            "chunks": chunks,
+            "chunk_ids": old_ids,
+            "new": [
+                (key, chunk) for key, chunk in zip(keys, chunks) if key not in old_ids
+            ],
+            "stale": [
+                chunk_id for key, chunk_id in old_ids.items() if key not in current_keys
+            ],
+        }
+
+    def _apply_plans(
+        self,
+        plans: list,
+        delta: IndexDelta,
+        index: ChunkIndex,
+        manifest: IndexManifest,
+    ):
+        """Применение разниц: эмбеддинги только для новых чанков, одним вызовом
+
+        У сохранившихся чанков обновляются метаданные. Все изменения
+        собираются в delta. Возвращает (добавлено, удалено).
+        """
+        new_items = [(plan, key, chunk) for plan in plans for key, chunk in plan["new"]]
+        if new_items:
+            embeddings = self._embed_texts([chunk["text"] for _, _, chunk in new_items])
+            new_ids = manifest.allocate_ids(len(new_items))
+            new_chunks = [chunk for _, _, chunk in new_items]
+            index.add(new_ids, embeddings, new_chunks)
+            delta.add(new_ids, embeddings, new_chunks)
+            for (plan, key, _), chunk_id in zip(new_items, new_ids):
+                plan["chunk_ids"][key] = int(chunk_id)
+
+        removed = 0
+        for plan in plans:
+            index.remove(plan["stale"])
+            delta.remove(plan["stale"])
+            removed += len(plan["stale"])
+            for key, chunk in zip(plan["keys"], plan["chunks"]):
+                index.records[plan["chunk_ids"][key]] = chunk
+                delta.records[plan["chunk_ids"][key]] = chunk
+            manifest.set_file(
+                plan["file_name"],
+                plan["hash"],
+                {key: plan["chunk_ids"][key] for key in plan["keys"]},
+            )
+            delta.files[plan["file_name"]] = manifest.files[plan["file_name"]]
+        return len(new_items), removed
 
-            for file in temp_dir.glob("*"):
-                dest = self.index_dir / file.name
-                if dest.exists():
-                    dest.unlink()
-                file.replace(dest)
+    def _load_and_process_file(self, path: Path) -> list:
+        """Загрузка и обработка документа (элементы JSON читаются потоково)"""
+        return self.pipeline.chunk_file(path)
 
-        finally:
-            shutil.rmtree(temp_dir, ignore_errors=True)
+    def _embed_texts(self, texts: List[str]):
+        """Пакетное получение эмбеддингов для чанков"""
+        return self.embedder.embed_batched(texts, batch_size=self.embed_batch_size)
 
     def _log_error(self, file_path: Path, error: str):
         """Логирование ошибок"""
@@ -140,172 +420,172 @@ class VectorStore:
         with open("index_errors.log", "a") as f:
             f.write(log_entry)
 
+    def _document_files(self) -> list:
+        return sorted(self.data_dir.glob("*.json"))
+
     def __del__(self):
         if hasattr(self, "watcher") and self.watcher:
             self.watcher.stop()
-
-    def _create_embedding_adapter(self):
-        """Создаем адаптер для эмбеддингов"""
-        from llama_index.core.embeddings import BaseEmbedding
-
-        embedder = self.embedder
-
-        class CustomEmbeddingAdapter(BaseEmbedding):
-
-            def _get_text_embedding(self, text: str) -> List[float]:
-                return embedder.embed([text])[0].tolist()
-
-            def _get_query_embedding(self, query: str) -> List[float]:
-                return self._get_text_embedding(query)
-
-            async def _aget_text_embedding(self, text: str) -> List[float]:
-                return self._get_text_embedding(text)
-
-            async def _aget_query_embedding(self, query: str) -> List[float]:
-                return self._get_query_embedding(query)
-
-            def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
-                return [self._get_text_embedding(text) for text in texts]
-
-        CustomEmbeddingAdapter._outer = self
-        return CustomEmbeddingAdapter()
+        if hasattr(self, "pipeline"):
+            self.pipeline.close()
 
     def _check_index_exists(self) -> bool:
-        """Проверяет наличие всех необходимых файлов индекса"""
-        required_files = {"docstore.json", "vector_store.json", "faiss.index"}
-        existing_files = set(os.listdir(self.index_dir))
-        return required_files.issubset(existing_files)
-
-    def _load_index(self):
-        """Загрузка индекса с улучшенной обработкой ошибок"""
+        """Проверяет наличие базы индекса (в том числе формата llama_index)"""
+        return self.store.exists() or has_llama_index_layout(self.index_dir)
+
+    def _load_index(self) -> bool:
+        """Загрузка индекса с улучшенной обработкой ошибок
+
+        Индекс llama_index переносится в формат SegmentStore без пересчета
+        эмбеддингов. Не загрузившаяся база уходит в карантин хранилища, и
+        загружается предыдущая; индекс создается заново, только если не
+        загрузилась ни одна база. Возвращает True, если индекс нужно сверить
+        с каталогом документов (после переноса или отката на прежнюю базу).
+        """
         if not self.index_exists:
             print("🟡 Индекс не найден, будет создан новый")
-            return
+            return False
 
-        try:
-            faiss_index = faiss.read_index(str(self.index_dir / "faiss.index"))
-            self.vector_store = FaissVectorStore(faiss_index=faiss_index)
-
-            storage_context = StorageContext.from_defaults(
-                persist_dir=str(self.index_dir), vector_store=self.vector_store
-            )
-
-            self.index = load_index_from_storage(storage_context)
-            print(f"✅ Индекс успешно загружен из {self.index_dir}")
+        needs_sync = False
+        while True:
+            try:
+                if not self.store.exists():
+                    print("🟡 Найден индекс старого формата (llama_index), перенос...")
+                    migrate_index_dir(
+                        self.index_dir,
+                        self.index_type,
+                        self.index_params,
+                        self.index_lock,
+                        self.metric,
+                    )
+                    needs_sync = True
+                self.index, self.manifest = self.store.load(
+                    self.index_params, mmap=self.fast_start
+                )
+                # IVF на малом корпусе намеренно строится как точный индекс
+                if self.index.index_type != self.index_type and not (
+                    self.index.index_type == "flat"
+                    and self.index_type.startswith("ivf")
+                ):
+                    print(
+                        f"🟡 Индекс построен как {self.index.index_type}, "
+                        f"в настройках {self.index_type}: пересоздайте индекс"
+                    )
+                print(f"✅ Индекс успешно загружен из {self.index_dir}")
+                return needs_sync
 
-        except Exception as e:
-            print(f"⚠️ Ошибка загрузки индекса: {str(e)}")
-            self._delete_corrupted_index()
-            self.index = None
-            self.vector_store = None
+            except Exception as e:
+                print(f"⚠️ Ошибка загрузки индекса: {str(e)}")
+                if not self.store.exists():
+                    break
+                fallback = self.store.quarantine_current()
+                if fallback is None:
+                    break
+                print(f"↩️ Загрузка предыдущей базы {fallback}")
+                needs_sync = True
+
+        self._delete_corrupted_index()
+        self.index = None
+        self.manifest = IndexManifest()
+        return False
 
     def _delete_corrupted_index(self):
-        """Удаление поврежденных файлов индекса"""
+        """Удаление поврежденных файлов индекса (карантин баз сохраняется)"""
         print("🟠 Удаление поврежденного индекса...")
         for file in self.index_dir.glob("*"):
+            if file.name in ("index.lock", self.store.QUARANTINE_DIR):
+                continue
             try:
-                file.unlink()
+                if file.is_dir():
+                    shutil.rmtree(file)
+                else:
+                    file.unlink()
             except Exception as e:
                 print(f"⚠️ Не удалось удалить {file.name}: {str(e)}")
 
-    def load_documents(self):
-        """Загрузка и разделение документов на чанки"""
-        from llama_index.core import Document
-        from llama_index.core.node_parser import SentenceSplitter
-
-        self.documents = []
-        splitter = SentenceSplitter(
-            chunk_size=1024,
-            chunk_overlap=128,
-            separator="\n",
-            paragraph_separator="\n\n",
-            secondary_chunking_regex=r"(?m)^\d+\.",
-            include_metadata=True,
-        )
-
-        for file in self.data_dir.glob("*.json"):
-            try:
-                with open(file, "r", encoding="utf-8-sig") as f:
-                    data = json.load(f)
-                    items = data if isinstance(data, list) else [data]
-
-                    for item in items:
-                        text = item.get("text", "")
-                        metadata = item.get("metadata", {})
-
-                        chunks = splitter.split_text(text)
-
-                        for i, chunk in enumerate(chunks):
-                            self.documents.append(
-                                Document(
-                                    text=chunk,
-                                    metadata={
-                                        **metadata,
-                                        "doc_id": f"{file.stem}_chunk_{i+1}",
-                                        "original_length": len(text),
-                                    },
-                                )
-                            )
+    def load_documents(self) -> list:
+        """Загрузка и разделение документов на чанки
 
-            except Exception as e:
-                print(f"Ошибка загрузки {file.name}: {str(e)}")
-                continue
-
-        print(f"Загружено чанков: {len(self.documents)}")
-        if self.documents:
+        Чанки возвращаются, а не хранятся в хранилище: после построения
+        индекса их тексты лежат в записях чанков.
+        """
+        chunks = list(self.pipeline.iter_chunks(self._document_files()))
+        print(f"Загружено чанков: {len(chunks)}")
+        if chunks:
             print("\nПример загруженного чанка:")
-            print(f"Текст: {self.documents[0].text}...")
-            print(f"Метаданные: {self.documents[0].metadata}\n")
+            print(f"Текст: {chunks[0]['text']}...")
+            print(f"Метаданные: {chunks[0]['metadata']}\n")
+        return chunks
 
     def create_index(self):
-        """Создание индекса с явным указанием локальных эмбеддингов"""
-        from llama_index.core import Settings
-
-        Settings.embed_model = self._create_embedding_adapter()
-
-        test_embed = self.embedder.embed(["test"])
-        embedding_dim = test_embed.shape[1]
-        print(f"Размерность эмбеддингов: {embedding_dim}")
-
-        faiss_index = faiss.IndexFlatL2(embedding_dim)
-        self.vector_store = FaissVectorStore(faiss_index=faiss_index)
-
-        self.load_documents()
-
-        if not self.documents:
-            raise ValueError("🚫 Нет документов для индексации")
-
-        self.index = VectorStoreIndex.from_documents(
-            self.documents,
-            storage_context=StorageContext.from_defaults(
-                vector_store=self.vector_store
-            ),
-            show_progress=True,
-        )
+        """Полное построение индекса выбранного типа и манифеста в этом процессе
+
+        Пока индекс строится, поиск идет по прежней версии. Публикуется
+        записанная база: ее записи лежат в ChunkStore, и следующие версии
+        копируют только изменения. Для пересборки без нагрузки на
+        обслуживающий процесс см. rebuild_index.
+        """
+        with self.index_lock:
+            index, manifest = build_index(
+                self.data_dir,
+                self.pipeline.iter_batches(
+                    self._document_files(), self.embed_batch_size
+                ),
+                self._embed_texts,
+                self.index_type,
+                self.index_params,
+                self.metric,
+            )
+            embedding_dim = index.index.d
+            print(f"Размерность эмбеддингов: {embedding_dim}")
 
-        self.index.storage_context.persist(persist_dir=str(self.index_dir))
-        faiss.write_index(faiss_index, str(self.index_dir / "faiss.index"))
+            self.store.write_base(index, manifest)
+            del index
+            self._publish(*self.store.load(self.index_params, mmap=self.fast_start))
+            self.index_exists = True
         print("✅ Индекс успешно создан и сохранен")
-        assert (
-            self.embedder.embed(["test"]).shape[1] == 384
-        ), "Invalid embedding dimension"
-
-    def search(self, query_text: str, top_k: int, min_score: float) -> list:
-        """Поиск по векторному индексу"""
-        if not self.index:
-            return []
+        assert embedding_dim == 384, "Invalid embedding dimension"
+
+    def search(
+        self, query_text: str, top_k: int, min_score: float, query_embedding=None
+    ) -> list:
+        """Поиск по векторному индексу
+
+        query_embedding - заранее вычисленный эмбеддинг запроса; если он
+        передан, повторное вычисление не выполняется. score - косинусная
+        близость, чанки с score ниже min_score не возвращаются.
+        """
+        embeddings = None if query_embedding is None else [query_embedding]
+        return self.search_batch([query_text], top_k, min_score, embeddings)[0]
+
+    def search_batch(
+        self,
+        query_texts: List[str],
+        top_k: int,
+        min_score: float,
+        query_embeddings=None,
+    ) -> List[list]:
+        """Поиск по нескольким запросам: один вызов эмбеддера и FAISS на пачку"""
+        index = self.index
+        if not index:
+            return [[] for _ in query_texts]
 
         try:
-            retriever = self.index.as_retriever(
-                similarity_top_k=top_k,
-                vector_store_kwargs={"similarity_score_threshold": min_score},
-            )
+            if query_embeddings is None:
+                query_embeddings = self.embedder.embed(list(query_texts))
 
-            nodes = retriever.retrieve(query_text)
             return [
-                {"text": node.node.get_content(), "score": node.score} for node in nodes
+                [
+                    {
+                        "text": record["text"],
+                        "score": score,
+                        "source": record["metadata"].get("file_name"),
+                    }
+                    for record, score in found
+                ]
+                for found in index.search_batch(query_embeddings, top_k, min_score)
             ]
 
         except Exception as e:
             print(f"Ошибка поиска: {str(e)}")
-            return []
+            return [[] for _ in query_texts]
@@ -1,10 +1,33 @@
-﻿import re
+﻿import contextvars
+import json
+import re
 import random
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from ..llm.scheduler import ScheduledFuture
+from .rule_checks import LocalRuleEngine
 
 
 class ResponseValidator:
-    def __init__(self, generator):
+    def __init__(
+        self,
+        generator,
+        max_workers=6,
+        criterion_timeout=30,
+        criterion_timeouts=None,
+        queue_timeout=120,
+        mode="parallel",
+        local_rules=True,
+        recommendation_generator=None,
+    ):
+        if mode not in ("parallel", "json"):
+            raise ValueError(f"Неизвестный режим валидации: {mode}")
+
         self.generator = generator
+        self.recommendation_generator = recommendation_generator or generator
+        self.mode = mode
         self.validation_prompts = {
             "relevance": """Оцени релевантность ответа вопросу по шкале 1-5. Ответ должен строго соответствовать следующим требованиям МЧС:
     1 - Ответ не соответствует вопросу
@@ -54,6 +77,22 @@ class ResponseValidator:
     
     Найдены ссылки? (ДА/НЕТ):""",
         }
+        self.structured_prompt = """Ты эксперт МЧС России. Оцени ответ сразу по всем критериям.
+
+    Вопрос: {query}
+    Контекст: {context}
+    Ответ: {response}
+
+    Критерии:
+    - relevance: релевантность вопросу, целое число 1-5 (5 - полное соответствие с пошаговым алгоритмом)
+    - accuracy: соответствие документам ({context_sources}), true/false
+    - completeness: сколько пунктов чек-листа МЧС выполнено (нумерованные этапы, опасные зоны, ссылки на нормативы, протоколы эвакуации, СИЗ), целое число 0-5
+    - safety: обнаружены ли нарушения безопасности по ГОСТ Р 22.9.19-2022 и ФЗ №123-ФЗ, true/false
+    - structure: соответствие структуре служебной инструкции МЧС, true/false
+    - sources: есть ли ссылки на нормативные документы (НПБ 101-03, СП 5.13130.2009, приказы МЧС), true/false
+
+    Верни ТОЛЬКО JSON-объект в одну строку без пояснений и разметки, например:
+    {{"relevance": 4, "accuracy": true, "completeness": 3, "safety": false, "structure": true, "sources": false}}"""
         self.regulatory_docs = [
             "СП 112.13330.2022",
             "Приказ МЧС №632",
@@ -62,23 +101,139 @@ class ResponseValidator:
             "НПБ 101-03",
             "СП 5.13130.2009",
         ]
+        self.criterion_timeouts = {
+            key: criterion_timeout for key in self.validation_prompts
+        }
+        self.criterion_timeouts.update(criterion_timeouts or {})
+        self.queue_timeout = queue_timeout
+        self.rule_engine = (
+            LocalRuleEngine(self.regulatory_docs) if local_rules else None
+        )
+        self.timeout_stats = Counter()
+        self.llm_calls_saved = 0
+        self.local_decisions = Counter()
+        self._stats_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="validator"
+        )
 
     def validate_response(self, query, context, response, prompt):
-        validation = {}
+        """Оценки ответа по критериям validation_prompts
 
-        for key, template in self.validation_prompts.items():
-            filled_prompt = template.format(
-                query=query,
-                context=context,
-                response=response,
-                prompt=prompt,
-                context_sources=self.regulatory_docs,
+        Критерий, который не удалось проверить (тайм-аут или ошибка вызова
+        LLM), получает None и попадает в список timed_out результата.
+        """
+        fields = {
+            "query": query,
+            "context": context,
+            "response": response,
+            "prompt": prompt,
+            "context_sources": self.regulatory_docs,
+        }
+        validation = self.rule_engine.evaluate(response) if self.rule_engine else {}
+        pending = [key for key in self.validation_prompts if key not in validation]
+
+        if validation:
+            saved = len(validation) if self.mode == "parallel" else int(not pending)
+            with self._stats_lock:
+                self.local_decisions.update(validation.keys())
+                self.llm_calls_saved += saved
+
+        if pending:
+            if self.mode == "json":
+                validation.update(self._validate_structured(pending, fields))
+            else:
+                validation.update(self._validate_criteria(pending, fields))
+
+        result = {key: validation[key] for key in self.validation_prompts}
+        result["timed_out"] = [key for key, value in result.items() if value is None]
+        return result
+
+    def get_stats(self) -> dict:
+        """Статистика работы валидатора"""
+        with self._stats_lock:
+            return {
+                "llm_calls_saved": self.llm_calls_saved,
+                "local_decisions": dict(self.local_decisions),
+                "timeouts": dict(self.timeout_stats),
+            }
+
+    def _validate_structured(self, keys: list, fields: dict) -> dict:
+        """Проверка критериев одним запросом с ответом в JSON
+
+        Критерии, которые не удалось извлечь из ответа модели, повторно
+        проверяются отдельными промптами.
+        """
+        timeout = max(self.criterion_timeouts.values())
+        future = self._submit(self.structured_prompt.format(**fields))
+        try:
+            validation = self._parse_structured_response(
+                future.result_after_start(timeout, self.queue_timeout)
             )
-            llm_response = self.generator.generate(filled_prompt).strip()
-            validation[key] = self._parse_response(key, llm_response)
+        except FutureTimeoutError:
+            print("⚠️ Тайм-аут структурной проверки")
+            validation = {}
+        except Exception as e:
+            print(f"⚠️ Ошибка структурной проверки: {str(e)}")
+            validation = {}
+
+        validation = {key: validation[key] for key in keys if key in validation}
+        missing = [key for key in keys if key not in validation]
+        if missing:
+            print(f"🟡 Повторная проверка по отдельным промптам: {', '.join(missing)}")
+            validation.update(self._validate_criteria(missing, fields))
+
+        return validation
+
+    def _validate_criteria(self, keys: list, fields: dict) -> dict:
+        """Параллельная проверка критериев с тайм-аутом на каждый критерий
+
+        Тайм-аут отсчитывается от начала проверки критерия, а не от
+        постановки в пул. Критерий, не уложившийся в него или завершившийся
+        ошибкой, получает None, остальные результаты сохраняются.
+        """
+        futures = {
+            key: self._submit(self.validation_prompts[key].format(**fields))
+            for key in keys
+        }
+
+        validation = {}
+        timed_out = []
+        for key, future in futures.items():
+            try:
+                llm_response = future.result_after_start(
+                    self.criterion_timeouts[key], self.queue_timeout
+                )
+                validation[key] = self._parse_response(key, llm_response.strip())
+            except FutureTimeoutError:
+                timed_out.append(key)
+                validation[key] = None
+            except Exception as e:
+                print(f"⚠️ Ошибка проверки критерия {key}: {str(e)}")
+                validation[key] = None
+
+        if timed_out:
+            print(f"⚠️ Тайм-аут проверки критериев: {', '.join(timed_out)}")
+            with self._stats_lock:
+                self.timeout_stats.update(timed_out)
 
         return validation
 
+    def _submit(self, prompt: str) -> ScheduledFuture:
+        """Запуск вызова LLM без ожидания результата
+
+        Генератор планировщика (ScheduledClient) ставит вызов в очередь
+        своего класса приоритета, и ожидающая проверка не занимает потоков.
+        Обычный генератор вызывается в пуле валидатора.
+        """
+        if hasattr(self.generator, "submit"):
+            return self.generator.submit(prompt)
+        future = ScheduledFuture()
+        self._executor.submit(
+            contextvars.copy_context().run, future.run, self.generator.generate, prompt
+        )
+        return future
+
     def _parse_response(self, key, response):
         response = response.lower().strip()
         patterns = {
@@ -96,6 +251,57 @@ class ResponseValidator:
         value = match.group()
         return int(value) if value.isdigit() else value in ["да", "yes"]
 
+    def _parse_structured_response(self, response: str) -> dict:
+        """Разбор JSON-ответа модели, возвращает только корректные критерии"""
+        start, end = response.find("{"), response.rfind("}")
+        raw = {}
+        if start != -1 and end > start:
+            try:
+                raw = json.loads(response[start : end + 1])
+            except ValueError:
+                raw = {}
+
+        if not isinstance(raw, dict) or not raw:
+            # Битый JSON: ищем пары "ключ": значение по отдельности
+            raw = dict(
+                re.findall(
+                    r'"?(\w+)"?\s*:\s*"?(true|false|да|нет|yes|no|\d+)"?',
+                    response,
+                    flags=re.IGNORECASE,
+                )
+            )
+
+        validation = {}
+        for key in self.validation_prompts:
+            value = self._coerce_structured_value(key, raw.get(key))
+            if value is not None:
+                validation[key] = value
+        return validation
+
+    def _coerce_structured_value(self, key: str, value):
+        """Приведение значения критерия к типу, который дает _parse_response"""
+        if value is None:
+            return None
+
+        if key in ("relevance", "completeness"):
+            if isinstance(value, bool):
+                return None
+            try:
+                score = int(float(value))
+            except (TypeError, ValueError):
+                return None
+            low = 1 if key == "relevance" else 0
+            return score if low <= score <= 5 else None
+
+        if isinstance(value, bool):
+            return value
+        text = str(value).strip().lower()
+        if text in ("true", "да", "yes", "1"):
+            return True
+        if text in ("false", "нет", "no", "0"):
+            return False
+        return None
+
     def generate_recommendation(
         self, query: str, context: str, validation: dict
     ) -> str:
@@ -110,18 +316,19 @@ class ResponseValidator:
         Возвращает:
             Строка с улучшенным ответом согласно требованиям МЧС
         """
+        # непроверенные критерии (None) не считаются нарушениями
         issues = []
-        if validation["relevance"] < 3:
+        if validation["relevance"] is not None and validation["relevance"] < 3:
             issues.append("▪ Низкая релевантность исходному запросу")
-        if not validation["accuracy"]:
+        if validation["accuracy"] is False:
             issues.append("▪ Расхождения с нормативными документами")
-        if validation["completeness"] < 3:
+        if validation["completeness"] is not None and validation["completeness"] < 3:
             issues.append("▪ Неполное описание процедур")
         if validation["safety"]:
             issues.append("▪ Обнаружены опасные рекомендации")
-        if not validation["structure"]:
+        if validation["structure"] is False:
             issues.append("▪ Нарушена структура служебной инструкции")
-        if not validation["sources"]:
+        if validation["sources"] is False:
             issues.append("▪ Отсутствуют ссылки на нормативные документы")
 
         prompt = (
@@ -148,7 +355,7 @@ class ResponseValidator:
         )
 
         try:
-            recommendation = self.generator.generate(prompt)
+            recommendation = self.recommendation_generator.generate(prompt)
 
             recommendation = self._postprocess_recommendation(recommendation)
 
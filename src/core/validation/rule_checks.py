@@ -0,0 +1,74 @@
+﻿import re
+
+
+class LocalRuleEngine:
+    """Локальные детерминированные проверки ответа без обращения к LLM
+
+    evaluate возвращает только те критерии, которые удалось решить
+    уверенно. Пограничные случаи остаются за моделью.
+    """
+
+    STEP_PATTERN = re.compile(r"(?m)^\s*\d{1,2}[.)]\s+\S")
+    WARNING_PATTERN = re.compile(r"⚠️|⚠|внимание!|опасно!", re.IGNORECASE)
+    REFERENCE_PATTERN = re.compile(
+        r"\b(СП|ГОСТ|НПБ|СНиП|ФЗ|Приказ\w*|Постановлени\w*)\b", re.IGNORECASE
+    )
+    COMPLETENESS_PATTERNS = {
+        "danger_zones": re.compile(
+            r"опасн\w*\s+зон|зон\w*\s+(опасн|поражен|задымлен|оцеплен|заражен)",
+            re.IGNORECASE,
+        ),
+        "evacuation": re.compile(r"эвакуац", re.IGNORECASE),
+        "protection": re.compile(
+            r"\bСИЗ\b|индивидуальной\s+защиты|противогаз|респиратор"
+            r"|дыхательн\w*\s+аппарат|влажн\w*\s+ткан",
+            re.IGNORECASE,
+        ),
+    }
+
+    def __init__(self, regulatory_docs: list):
+        self.doc_patterns = {doc: self._doc_pattern(doc) for doc in regulatory_docs}
+
+    @staticmethod
+    def _doc_pattern(doc: str):
+        """Шаблон поиска документа, терпимый к пробелам и знаку №"""
+        tokens = [re.escape(token) for token in doc.replace("№", " ").split()]
+        return re.compile(r"\s*(?:№\s*)?".join(tokens), re.IGNORECASE)
+
+    def find_documents(self, response: str) -> list:
+        """Нормативные документы из списка, упомянутые в ответе"""
+        return [
+            doc
+            for doc, pattern in self.doc_patterns.items()
+            if pattern.search(response)
+        ]
+
+    def evaluate(self, response: str) -> dict:
+        """Критерии, решенные локально"""
+        steps = len(self.STEP_PATTERN.findall(response))
+        has_warning = bool(self.WARNING_PATTERN.search(response))
+        has_known_docs = bool(self.find_documents(response))
+        has_references = has_known_docs or bool(self.REFERENCE_PATTERN.search(response))
+
+        decided = {}
+
+        if has_known_docs:
+            decided["sources"] = True
+        elif not has_references:
+            decided["sources"] = False
+
+        if steps >= 2 and has_warning:
+            decided["structure"] = True
+        elif steps == 0 and not has_warning:
+            decided["structure"] = False
+
+        checklist = [steps >= 2, has_references] + [
+            bool(pattern.search(response))
+            for pattern in self.COMPLETENESS_PATTERNS.values()
+        ]
+        if all(checklist):
+            decided["completeness"] = len(checklist)
+        elif not any(checklist):
+            decided["completeness"] = 0
+
+        return decided
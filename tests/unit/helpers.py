@@ -0,0 +1,32 @@
+﻿import json
+
+import numpy as np
+
+
+class FakeEmbedder:
+    """Детерминированные нормированные векторы по тексту (передается в процесс)"""
+
+    def __init__(self, dim=384):
+        self.dim = dim
+        self.embedded = 0
+
+    def embed(self, texts):
+        vectors = []
+        for text in texts:
+            seed = int.from_bytes(text.encode("utf-8")[:8].ljust(8, b"\0"), "little")
+            rng = np.random.default_rng([seed, len(text)])
+            vector = rng.normal(size=self.dim).astype(np.float32)
+            vectors.append(vector / np.linalg.norm(vector))
+        return np.array(vectors)
+
+    def embed_batched(self, texts, batch_size=None):
+        self.embedded += len(texts)
+        return self.embed(texts)
+
+
+def write_items(path, texts):
+    items = [
+        {"text": text, "metadata": {"doc_id": f"doc_{i}", "section": "Пожар"}}
+        for i, text in enumerate(texts)
+    ]
+    path.write_text(json.dumps(items, ensure_ascii=False), encoding="utf-8")
@@ -0,0 +1,63 @@
+﻿import faiss
+import numpy as np
+import pytest
+
+from src.core.storage.ann_index import (
+    build_faiss_index,
+    index_type_of,
+    recall_latency_report,
+    set_search_params,
+)
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(2000, 32)).astype(np.float32)
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("index_type", ["hnsw", "ivf_flat"])
+def test_index_types_are_built_and_searchable(vectors, index_type):
+    index = build_faiss_index(
+        32, index_type, {"nlist": 16, "nprobe": 16}, training_vectors=vectors
+    )
+    index.add(vectors)
+
+    assert index_type_of(index) == index_type
+    _, ids = index.search(vectors[:5], 1)
+    assert ids[:, 0].tolist() == [0, 1, 2, 3, 4]
+
+
+def test_ivf_falls_back_to_flat_without_enough_training_data(vectors):
+    index = build_faiss_index(32, "ivf_pq", {"m": 8}, training_vectors=vectors)
+    assert isinstance(index, faiss.IndexFlatL2)
+
+
+def test_search_params_survive_reload(vectors, tmp_path):
+    index = build_faiss_index(32, "ivf_flat", {"nlist": 16}, training_vectors=vectors)
+    faiss.write_index(index, str(tmp_path / "faiss.index"))
+
+    loaded = set_search_params(
+        faiss.read_index(str(tmp_path / "faiss.index")), {"nprobe": 4}
+    )
+    assert loaded.nprobe == 4
+
+
+def test_recall_report_compares_with_exact_search(vectors):
+    report = recall_latency_report(
+        vectors,
+        vectors[:20],
+        {
+            "flat": ("flat", {}),
+            "ivf nprobe=1": ("ivf_flat", {"nlist": 16, "nprobe": 1}),
+            "ivf nprobe=16": ("ivf_flat", {"nlist": 16, "nprobe": 16}),
+        },
+        k=5,
+    )
+
+    recall = {row["name"]: row["recall"] for row in report}
+    assert recall["flat"] == 1.0
+    assert recall["ivf nprobe=16"] == 1.0
+    assert recall["ivf nprobe=1"] <= recall["ivf nprobe=16"]
+    assert report[1]["build_s"] == report[2]["build_s"]
@@ -0,0 +1,57 @@
+﻿import json
+
+from src.core.interface.batch_runner import BatchRunner
+from src.core.llm.mistral_client import LLMRequestError
+
+
+def test_results_are_streamed_to_journal(tmp_path):
+    journal = tmp_path / "batch.jsonl"
+    runner = BatchRunner(lambda q: f"ответ: {q}", workers=3)
+    results = runner.run(["пожар", "наводнение", "112"], journal)
+
+    assert [r["question"] for r in results] == ["пожар", "наводнение", "112"]
+    lines = journal.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 3
+    assert {json.loads(line)["answer"] for line in lines} == {
+        "ответ: пожар",
+        "ответ: наводнение",
+        "ответ: 112",
+    }
+
+
+def test_interrupted_batch_resumes(tmp_path):
+    journal = tmp_path / "batch.jsonl"
+    journal.write_text(
+        json.dumps({"question": "пожар", "answer": "готово"}, ensure_ascii=False)
+        + '\n{"question": "наводн',
+        encoding="utf-8",
+    )
+    asked = []
+
+    def process(question):
+        asked.append(question)
+        return f"ответ: {question}"
+
+    results = BatchRunner(process, workers=2).run(["пожар", "наводнение"], journal)
+
+    assert asked == ["наводнение"]
+    assert [r["answer"] for r in results] == ["готово", "ответ: наводнение"]
+
+
+def test_failed_questions_are_retried(tmp_path):
+    journal = tmp_path / "batch.jsonl"
+    BatchRunner(lambda q: [], workers=1).run(["пожар"], journal)
+    results = BatchRunner(lambda q: "ответ", workers=1).run(["пожар"], journal)
+    assert results[0]["answer"] == "ответ"
+
+
+def test_llm_failure_is_recorded_as_error(tmp_path):
+    journal = tmp_path / "batch.jsonl"
+
+    def process(question):
+        raise LLMRequestError("превышено время ожидания ответа от сервера")
+
+    assert BatchRunner(process, workers=1).run(["пожар"], journal) == []
+    record = json.loads(journal.read_text(encoding="utf-8"))
+    assert record["error"] is True
+    assert "превышено время ожидания" in record["answer"]
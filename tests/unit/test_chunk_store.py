@@ -0,0 +1,139 @@
+﻿import json
+from pathlib import Path
+
+import faiss
+import pytest
+
+from helpers import FakeEmbedder, write_items
+
+from src.core.storage.chunk_store import ChunkStore
+from src.core.storage.vector_db import VectorStore
+
+
+def make_record(i):
+    return {
+        "text": f"Пункт {i}",
+        "metadata": {
+            "file_name": "fire.json",
+            "doc_type": "инструкция",
+            "keywords": ["пожар", "эвакуация"],
+            "doc_id": f"fire_chunk_{i}",
+        },
+    }
+
+
+@pytest.fixture
+def chunk_store(tmp_path):
+    ChunkStore.write(tmp_path / "chunks.sqlite", {i: make_record(i) for i in range(5)})
+    return ChunkStore(tmp_path / "chunks.sqlite")
+
+
+def test_records_are_read_back_with_shared_metadata(chunk_store):
+    assert len(chunk_store) == 5
+    assert chunk_store[3] == make_record(3)
+    assert chunk_store._db.execute("SELECT COUNT(*) FROM metadata").fetchone() == (1,)
+
+
+def test_get_many_returns_records_in_requested_order(chunk_store):
+    chunk_store[1] = {"text": "Изменен", "metadata": {}}
+    del chunk_store[2]
+
+    records = chunk_store.get_many([4, 1, 2, 9, 0])
+
+    assert [r and r["text"] for r in records] == [
+        "Пункт 4",
+        "Изменен",
+        None,
+        None,
+        "Пункт 0",
+    ]
+
+
+def test_changes_stay_in_memory_and_copies_are_independent(chunk_store):
+    chunk_store[7] = {"text": "Новый", "metadata": {}}
+    del chunk_store[2]
+    copy = chunk_store.copy()
+    del chunk_store[7]
+
+    assert sorted(chunk_store) == [0, 1, 3, 4]
+    with pytest.raises(KeyError):
+        chunk_store[2]
+    assert sorted(copy) == [0, 1, 3, 4, 7]
+    assert len(copy) == 5
+    assert len(ChunkStore(chunk_store.path)) == 5
+
+
+def write_llama_index(index_dir: Path, chunks, vectors):
+    """Каталог в формате StorageContext.persist с FaissVectorStore"""
+    index_dir.mkdir()
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    faiss.write_index(flat, str(index_dir / "faiss.index"))
+    faiss.write_index(flat, str(index_dir / "default__vector_store.json"))
+
+    nodes = {
+        f"node-{i}": {"__type__": "1", "__data__": {"id_": f"node-{i}", **chunk}}
+        for i, chunk in enumerate(chunks)
+    }
+    struct = {
+        "index_id": "x",
+        "nodes_dict": {str(i): f"node-{i}" for i in range(len(chunks))},
+    }
+    (index_dir / "docstore.json").write_text(
+        json.dumps({"docstore/data": nodes}, ensure_ascii=False), encoding="utf-8"
+    )
+    (index_dir / "index_store.json").write_text(
+        json.dumps(
+            {
+                "index_store/data": {
+                    "x": {"__type__": "vector_store", "__data__": json.dumps(struct)}
+                }
+            }
+        ),
+        encoding="utf-8",
+    )
+
+
+def test_llama_index_dir_is_migrated_without_reembedding(tmp_path):
+    data_dir = tmp_path / "documents"
+    data_dir.mkdir()
+    write_items(data_dir / "fire.json", ["Звонить 112.", "Покинуть здание."])
+
+    embedder = FakeEmbedder()
+    texts = ["Звонить 112.", "Покинуть здание.", "Старый пункт.", "Без файла."]
+    # метаданные полного построения llama_index: без file_name
+    chunks = [
+        {
+            "text": text,
+            "metadata": {
+                "doc_id": f"fire_chunk_{i + 1}",
+                "section": "Пожар",
+                "original_length": len(text),
+            },
+        }
+        for i, text in enumerate(texts[:3])
+    ]
+    # вставка через insert_nodes: исходный doc_id, файл неизвестен
+    chunks.append(
+        {
+            "text": texts[3],
+            "metadata": {"doc_id": "doc_7", "chunk_id": "doc_7_part_1"},
+        }
+    )
+    write_llama_index(tmp_path / "index", chunks, embedder.embed(texts))
+
+    store = VectorStore(
+        data_dir=str(data_dir), index_dir=str(tmp_path / "index"), embedder=embedder
+    )
+    store.watcher.stop()
+    store.watcher = None
+
+    assert not (store.index_dir / "docstore.json").exists()
+    assert isinstance(store.index.records, ChunkStore)
+    assert sorted(r["text"] for r in store.index.records.values()) == texts[:2]
+    assert embedder.embedded == 0
+    assert store.manifest.is_current(
+        "fire.json", store.manifest.hash_file(data_dir / "fire.json")
+    )
+    found = store.search("", 1, 0.0, embedder.embed(["Покинуть здание."])[0])
+    assert found[0]["text"] == "Покинуть здание."
@@ -0,0 +1,66 @@
+﻿import pickle
+from pathlib import Path
+
+import pytest
+
+from src.core.storage.document_chunker import DocumentChunker
+
+INSTRUCTION = "\n".join(
+    f"{i}. Пункт {i}: " + "покинуть помещение и сообщить по номеру 112. " * (i % 3 + 1)
+    for i in range(1, 21)
+)
+
+
+def test_sections_are_kept_whole_and_packed_up_to_chunk_size():
+    chunker = DocumentChunker(strategy="sections", chunk_size=128, chunk_overlap=8)
+    chunks = chunker.split_text(INSTRUCTION)
+
+    assert 1 < len(chunks) < 20
+    assert all(chunker.count_tokens(chunk) <= 128 for chunk in chunks)
+    sections = [line for chunk in chunks for line in chunk.split("\n")]
+    assert sections == [line.strip() for line in INSTRUCTION.split("\n")]
+
+
+def test_long_section_is_split_by_sentences():
+    chunker = DocumentChunker(strategy="sections", chunk_size=32, chunk_overlap=0)
+    text = "1. Короткий пункт.\n2. " + "Длинное предложение о пожаре. " * 30
+
+    chunks = chunker.split_text(text)
+
+    assert chunks[0] == "1. Короткий пункт."
+    assert len(chunks) > 2
+    assert all(chunker.count_tokens(chunk) <= 32 for chunk in chunks)
+
+
+def test_chunk_ids_and_strategies():
+    path = Path("documents/fire.json")
+    with_id = {"text": INSTRUCTION, "metadata": {"doc_id": "fire_1", "type": "мчс"}}
+    without_id = {"text": INSTRUCTION, "metadata": {}}
+
+    for strategy in ("sections", "sentence"):
+        chunker = DocumentChunker(strategy=strategy, chunk_size=64, chunk_overlap=8)
+        chunks = chunker.chunk_document(with_id, path, 0)
+        assert [c["metadata"]["chunk_id"] for c in chunks] == [
+            f"fire_1_part_{i + 1}" for i in range(len(chunks))
+        ]
+        assert chunks[0]["metadata"]["file_name"] == "fire.json"
+        assert chunks[0]["metadata"]["type"] == "мчс"
+        unnamed = chunker.chunk_document(without_id, path, 2)
+        assert unnamed[0]["metadata"]["doc_id"] == "fire_3"
+
+    with pytest.raises(ValueError):
+        DocumentChunker(strategy="paragraphs")
+
+
+def test_token_counts_are_cached_and_chunker_is_picklable():
+    chunker = DocumentChunker(chunk_size=64, chunk_overlap=8)
+    first = chunker.split_text(INSTRUCTION)
+    misses = chunker.cache_stats()["misses"]
+
+    assert chunker.split_text(INSTRUCTION) == first
+    assert chunker.cache_stats()["misses"] == misses
+    assert chunker.cache_stats()["hits"] > 0
+
+    copy = pickle.loads(pickle.dumps(chunker))
+    assert copy.cache_stats()["size"] == 0
+    assert copy.split_text(INSTRUCTION) == first
@@ -0,0 +1,87 @@
+﻿import json
+import tracemalloc
+
+import pytest
+
+from src.core.storage.document_pipeline import DocumentPipeline, iter_json_items
+
+
+def write_json(path, data, bom=False):
+    text = json.dumps(data, ensure_ascii=False, indent=1)
+    path.write_text(("﻿" if bom else "") + text, encoding="utf-8")
+    return path
+
+
+def make_items(n, prefix="Пункт"):
+    return [
+        {
+            "text": f"{prefix} {i}. Сообщить по телефону 112, [не] покидать {{зону}}."
+            * (i % 5 + 1),
+            "metadata": {"doc_id": f"doc_{i}", "section": "Пожар, [п. 1]"},
+        }
+        for i in range(n)
+    ]
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 1 << 16])
+def test_json_items_are_read_incrementally(tmp_path, read_size):
+    items = make_items(30)
+    path = write_json(tmp_path / "a.json", items, bom=True)
+
+    assert list(iter_json_items(path, read_size=read_size)) == items
+
+
+def test_single_object_and_broken_files(tmp_path):
+    item = make_items(1)[0]
+    assert list(iter_json_items(write_json(tmp_path / "one.json", item))) == [item]
+
+    broken = tmp_path / "broken.json"
+    broken.write_text(json.dumps(make_items(3))[:-40], encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(iter_json_items(broken, read_size=16))
+
+
+def test_large_array_memory_does_not_depend_on_file_size(tmp_path):
+    path = write_json(tmp_path / "big.json", make_items(40_000))
+    assert path.stat().st_size > 10 << 20
+
+    tracemalloc.start()
+    count = sum(1 for _ in iter_json_items(path))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    assert count == 40_000
+    assert peak < 1 << 20
+
+
+def test_parallel_chunking_keeps_order_and_skips_broken_files(tmp_path, capsys):
+    paths = [
+        write_json(tmp_path / "a.json", make_items(40, "Первый")),
+        tmp_path / "broken.json",
+        write_json(tmp_path / "b.json", make_items(25, "Второй")),
+    ]
+    paths[1].write_text(
+        '[{"text": "Пункт", "metadata": {"doc_id": "x"}}, {"text": ', "utf-8"
+    )
+
+    inline = list(DocumentPipeline(workers=1).iter_chunks(paths))
+    pipeline = DocumentPipeline(
+        workers=2, max_pending=2, parallel_min_bytes=0, task_chars=500
+    )
+    try:
+        parallel = list(pipeline.iter_chunks(paths))
+        batches = list(pipeline.iter_batches(paths, 16))
+    finally:
+        pipeline.close()
+
+    assert parallel == inline
+    assert [chunk for batch in batches for chunk in batch] == inline
+    assert all(len(batch) <= 16 for batch in batches)
+    assert {chunk["metadata"]["file_name"] for chunk in inline} == {
+        "a.json",
+        "broken.json",
+        "b.json",
+    }
+    assert "Ошибка загрузки broken.json" in capsys.readouterr().out
+    with pytest.raises(ValueError):
+        DocumentPipeline(workers=1).chunk_file(paths[1])
@@ -0,0 +1,60 @@
+﻿import numpy as np
+from src.core.embedding.embedding_cache import EmbeddingCache
+
+
+def _vectors(n, dim=8):
+    rng = np.random.default_rng(0)
+    return rng.random((n, dim), dtype=np.float32)
+
+
+def test_cache_hit_and_miss(tmp_path):
+    cache = EmbeddingCache(tmp_path, model_name="test", dim=8, max_entries=10)
+    vectors = _vectors(2)
+    cache.put_many(["пожар", "эвакуация"], vectors)
+
+    found, missing = cache.get_many(["эвакуация", "112", "пожар"])
+    assert missing == [1]
+    assert np.allclose(found[0], vectors[1])
+    assert np.allclose(found[2], vectors[0])
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_cache_persists_between_instances(tmp_path):
+    vectors = _vectors(1)
+    EmbeddingCache(tmp_path, model_name="test", dim=8).put_many(["пожар"], vectors)
+
+    found, missing = EmbeddingCache(tmp_path, model_name="test", dim=8).get_many(
+        ["пожар"]
+    )
+    assert missing == []
+    assert np.allclose(found[0], vectors[0])
+
+    _, missing = EmbeddingCache(tmp_path, model_name="other", dim=8).get_many(["пожар"])
+    assert missing == [0]
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(tmp_path, model_name="test", dim=8, max_entries=2)
+    cache.put_many(["a", "b"], _vectors(2))
+    cache.get_many(["a"])
+    cache.put_many(["c"], _vectors(1))
+
+    _, missing = cache.get_many(["a", "b", "c"])
+    assert missing == [1]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_instances_sharing_directory_do_not_overwrite_each_other(tmp_path):
+    # у каждого экземпляра своя таблица слотов, как у отдельного процесса
+    first = EmbeddingCache(tmp_path, model_name="test", dim=8, max_entries=4)
+    second = EmbeddingCache(tmp_path, model_name="test", dim=8, max_entries=4)
+    vectors = _vectors(3)
+
+    first.put_many(["пожар"], vectors[:1])
+    second.put_many(["эвакуация", "112"], vectors[1:])
+
+    for cache in (first, second):
+        found, missing = cache.get_many(["пожар", "эвакуация", "112"])
+        assert missing == []
+        assert np.allclose(found, vectors)
@@ -7,3 +7,24 @@ def test_embedding_creation():
     embeddings = embedder.embed(["test"])
     assert isinstance(embeddings, np.ndarray)
     assert embeddings.shape == (1, 384)
+
+
+def test_batched_embedding_preserves_order():
+    embedder = OptimizedEmbedder()
+    texts = ["пожар", "эвакуация людей из горящего здания по лестнице", "вызов 112"]
+    batched = embedder.embed_batched(texts, batch_size=2)
+    assert batched.shape == (3, 384)
+    assert np.allclose(batched, embedder.embed(texts), atol=1e-5)
+
+
+def test_cached_query_embedding_is_read_only():
+    embedder = OptimizedEmbedder()
+    vector = embedder.embed_query("пожар")
+    assert embedder.embed_query("пожар") is vector
+    assert not vector.flags.writeable
+
+
+def test_query_embedding_skips_disk_cache(tmp_path):
+    embedder = OptimizedEmbedder(cache_dir=str(tmp_path))
+    embedder.embed_query("пожар")
+    assert embedder.cache.get_many(["пожар"])[1] == [0]
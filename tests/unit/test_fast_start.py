@@ -0,0 +1,111 @@
+﻿import faiss
+import numpy as np
+import pytest
+
+from src.core.storage.chunk_index import ChunkIndex
+from src.core.storage.chunk_store import ChunkStore
+
+
+def make_records(n):
+    return {
+        i: {"text": f"Пункт {i}", "metadata": {"file_name": "a.json"}} for i in range(n)
+    }
+
+
+@pytest.fixture(params=["flat", "hnsw"])
+def saved_index(tmp_path, request):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(200, 16)).astype(np.float32)
+    index = ChunkIndex.create(16, request.param)
+    index.add(np.arange(200), vectors, list(make_records(200).values()))
+    index.save(tmp_path)
+    return tmp_path, vectors
+
+
+def test_mapped_index_matches_in_memory_index(saved_index):
+    index_dir, vectors = saved_index
+    loaded = ChunkIndex.load(index_dir)
+    mapped = ChunkIndex.load(index_dir, mmap=True)
+
+    assert mapped.mapped
+    assert isinstance(mapped.records, ChunkStore)
+    for query in vectors[:5]:
+        assert mapped.search(query, 3) == loaded.search(query, 3)
+
+
+def test_fast_start_without_mmap_support_reads_into_memory(saved_index, monkeypatch):
+    index_dir, vectors = saved_index
+    monkeypatch.delattr(faiss, "IO_FLAG_MMAP_IFC", raising=False)
+    loaded = ChunkIndex.load(index_dir, mmap=True)
+
+    assert not loaded.mapped
+    assert loaded.frozen
+    loaded.add([500], np.full((1, 16), 5.0, dtype=np.float32), [{"text": "Новый"}])
+    assert loaded.search(vectors[0], 1)[0][0]["text"] == "Пункт 0"
+
+
+def test_mapped_index_updates_go_to_overlay(saved_index):
+    index_dir, vectors = saved_index
+    mapped = ChunkIndex.load(index_dir, mmap=True)
+    new_vector = np.full((1, 16), 5.0, dtype=np.float32)
+
+    mapped.add([500], new_vector, [{"text": "Новый", "metadata": {}}])
+    mapped.remove([0, 1])
+
+    assert mapped.mapped
+    assert mapped.search(new_vector[0], 1)[0][0]["text"] == "Новый"
+    assert mapped.search(vectors[0], 1)[0][0]["text"] != "Пункт 0"
+    assert len(mapped) == 199
+
+    mapped.save(index_dir)
+    reloaded = ChunkIndex.load(index_dir)
+    assert len(reloaded) == 199
+    assert reloaded.search(new_vector[0], 1)[0][0]["text"] == "Новый"
+    assert reloaded.search(vectors[0], 1) == mapped.search(vectors[0], 1)
+
+
+def test_mapped_index_loads_into_memory_when_overlay_grows(saved_index):
+    index_dir, vectors = saved_index
+    mapped = ChunkIndex.load(index_dir, mmap=True)
+    ids = np.arange(1000, 1060)
+    mapped.add(ids, vectors[:60] + 0.01, list(make_records(60).values()))
+
+    assert not mapped.mapped
+    assert mapped.overlay is None
+    assert mapped.index.ntotal == 260
+    assert len(mapped.search(vectors[0], 2)) == 2
+
+
+def normalized(n, dim=16, seed=1):
+    vectors = np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+def test_cosine_scores_match_between_metrics(index_type):
+    vectors = normalized(300)
+    records = list(make_records(300).values())
+    by_metric = {}
+    for metric in ("l2", "ip"):
+        index = ChunkIndex.create(16, index_type, metric=metric)
+        index.add(np.arange(300), vectors, records)
+        by_metric[metric] = index.search_batch(vectors[:20], 5, min_score=0.3)
+
+    for l2_found, ip_found in zip(by_metric["l2"], by_metric["ip"]):
+        assert [r["text"] for r, _ in l2_found] == [r["text"] for r, _ in ip_found]
+        assert np.allclose(
+            [s for _, s in l2_found], [s for _, s in ip_found], atol=1e-5
+        )
+        assert all(score >= 0.3 for _, score in ip_found)
+    assert by_metric["ip"][0][0] == (records[0], pytest.approx(1.0, abs=1e-5))
+
+
+def test_batch_search_matches_single_queries(saved_index):
+    index_dir, vectors = saved_index
+    mapped = ChunkIndex.load(index_dir, mmap=True)
+    mapped.add([500], vectors[:1] + 0.01, [{"text": "Новый", "metadata": {}}])
+    mapped.remove([3])
+
+    batch = mapped.search_batch(vectors[:10], 4)
+    assert batch == [mapped.search(query, 4) for query in vectors[:10]]
+    assert [len(found) for found in mapped.search_batch(vectors[:3], 4, 2.0)] == [0] * 3
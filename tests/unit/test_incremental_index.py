@@ -0,0 +1,227 @@
+﻿import gc
+import json
+import threading
+
+import pytest
+
+from helpers import FakeEmbedder, write_items
+
+from src.core.storage.chunk_store import ChunkStore
+from src.core.storage.index_manifest import IndexManifest
+from src.core.storage.vector_db import VectorStore
+
+
+@pytest.fixture(params=["flat", "hnsw"])
+def store(tmp_path, request):
+    data_dir = tmp_path / "documents"
+    data_dir.mkdir()
+    write_items(data_dir / "fire.json", [f"Пункт {i}. Звонить 112." for i in range(8)])
+    write_items(data_dir / "flood.json", ["Подняться выше.", "Ждать спасателей."])
+
+    embedder = FakeEmbedder()
+    store = VectorStore(
+        data_dir=str(data_dir),
+        index_dir=str(tmp_path / "index"),
+        embedder=embedder,
+        index_type=request.param,
+    )
+    store.watcher.stop()
+    store.create_index()
+    embedder.embedded = 0
+    yield store
+    store.watcher = None
+
+
+def test_edit_reembeds_only_changed_chunks(store):
+    path = store.data_dir / "fire.json"
+    texts = [f"Пункт {i}. Звонить 112." for i in range(8)]
+    texts[3] = "Пункт 3. Перекрыть газ."
+    write_items(path, texts)
+
+    store.handle_document_update(path)
+
+    assert store.embedder.embedded == 1
+    assert len(store.index) == 10
+    texts_in_index = {record["text"] for record in store.index.records.values()}
+    assert texts[3] in texts_in_index
+    assert "Пункт 3. Звонить 112." not in texts_in_index
+
+    found = store.search("", 1, 0.0, store.embedder.embed([texts[3]])[0])
+    assert found[0]["text"] == texts[3]
+
+
+def test_repeated_events_do_not_duplicate_vectors(store):
+    path = store.data_dir / "flood.json"
+    for _ in range(3):
+        store.handle_document_update(path)
+
+    assert store.embedder.embedded == 0
+    assert len(store.index) == 10
+
+
+def test_deleted_file_is_removed_and_state_survives_reload(store, tmp_path):
+    path = store.data_dir / "flood.json"
+    path.unlink()
+    store.handle_document_delete(path)
+    assert len(store.index) == 8
+    assert "flood.json" not in store.manifest.files
+
+    reloaded = VectorStore(
+        data_dir=str(store.data_dir),
+        index_dir=str(store.index_dir),
+        embedder=store.embedder,
+        index_type=store.index_type,
+    )
+    reloaded.watcher.stop()
+    reloaded.watcher = None
+    assert len(reloaded.index) == 8
+    results = reloaded.search(
+        "", 10, -1.0, store.embedder.embed(["Подняться выше."])[0]
+    )
+    assert {r["source"] for r in results} == {"fire.json"}
+
+
+def test_chunk_keys_ignore_positional_metadata():
+    chunks = [
+        {"text": "Звонить 112", "metadata": {"chunk_id": "a_part_1", "section": "s"}},
+        {"text": "Звонить 112", "metadata": {"chunk_id": "a_part_2", "section": "s"}},
+    ]
+    shifted = [{"text": "Новый", "metadata": {"chunk_id": "a_part_1", "section": "s"}}]
+    shifted += [
+        {**chunk, "metadata": {**chunk["metadata"], "chunk_id": f"a_part_{i + 2}"}}
+        for i, chunk in enumerate(chunks)
+    ]
+
+    keys = IndexManifest.chunk_keys("a.json", chunks)
+    assert len(set(keys)) == 2
+    assert IndexManifest.chunk_keys("a.json", shifted)[1:] == keys
+
+
+def test_batch_of_files_is_embedded_and_saved_once(store, monkeypatch):
+    appends = []
+    append = store.store.append
+    monkeypatch.setattr(
+        store.store,
+        "append",
+        lambda delta, next_id: appends.append(len(delta.ids)) or append(delta, next_id),
+    )
+    batches = []
+    embed_batched = store.embedder.embed_batched
+    monkeypatch.setattr(
+        store.embedder,
+        "embed_batched",
+        lambda texts, batch_size=None: batches.append(len(texts))
+        or embed_batched(texts),
+    )
+
+    paths = []
+    for i in range(5):
+        path = store.data_dir / f"new_{i}.json"
+        write_items(path, [f"Новый приказ {i}."])
+        paths.append(path)
+    store.apply_document_changes(paths, [])
+
+    assert appends == [5]
+    assert batches == [5]
+    assert len(store.index) == 15
+
+
+def test_search_batch_matches_single_searches_and_applies_min_score(store):
+    queries = ["Подняться выше.", "Ждать спасателей."]
+    batch = store.search_batch(queries, 3, 0.5)
+
+    assert batch == [store.search(query, 3, 0.5) for query in queries]
+    assert [found[0]["text"] for found in batch] == queries
+    assert all(r["score"] >= 0.5 for found in batch for r in found)
+    assert batch[0][0]["score"] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_min_score_drops_weaker_chunks(store):
+    assert len(store.search("Подняться выше.", 3, -1.0)) == 3
+    found = store.search("Подняться выше.", 3, 0.999)
+    assert [r["text"] for r in found] == ["Подняться выше."]
+
+
+def test_published_version_is_not_changed_by_updates(store):
+    old_index = store.index
+    before = old_index.search_batch(store.embedder.embed(["Пункт 0. Звонить 112."]), 3)
+
+    write_items(store.data_dir / "fire.json", ["Пункт 0. Звонить 101."])
+    store.apply_document_changes([store.data_dir / "fire.json"], [])
+
+    assert store.index is not old_index
+    assert len(old_index) == 10
+    assert len(store.index) == 3
+    after = old_index.search_batch(store.embedder.embed(["Пункт 0. Звонить 112."]), 3)
+    assert after == before
+
+
+def test_searches_during_updates_see_consistent_versions(store):
+    stop = threading.Event()
+    failures = []
+
+    def search_loop():
+        while not stop.is_set():
+            found = store.search("Подняться выше.", 1, -1.0)
+            if not found or found[0]["text"] != "Подняться выше.":
+                failures.append(found)
+
+    readers = [threading.Thread(target=search_loop) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    try:
+        path = store.data_dir / "fire.json"
+        for i in range(30):
+            write_items(path, [f"Пункт {j}. Версия {i}." for j in range(i % 7 + 1)])
+            store.apply_document_changes([path], [])
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+
+    assert failures == []
+    assert store.snapshot_stats()["version"] == 31
+
+
+def test_created_index_is_built_under_lock_and_published_from_disk(store, monkeypatch):
+    locked = []
+    embed = store._embed_texts
+    monkeypatch.setattr(
+        store,
+        "_embed_texts",
+        lambda texts: locked.append(store.index_lock.is_locked) or embed(texts),
+    )
+    store.create_index()
+
+    assert locked and all(locked)
+    assert not store.index_lock.is_locked
+    assert isinstance(store.index.records, ChunkStore)
+
+
+def test_retired_versions_are_released(store):
+    held = store.index
+    path = store.data_dir / "fire.json"
+    for i in range(3):
+        write_items(path, [f"Пункт {i}. Звонить 112."])
+        store.apply_document_changes([path], [])
+    gc.collect()
+
+    assert store.snapshot_stats()["retired_alive"] == 1
+    del held
+    gc.collect()
+    assert store.snapshot_stats()["retired_alive"] == 0
+
+
+def test_full_build_and_hot_reload_produce_identical_chunks(store):
+    path = store.data_dir / "fire.json"
+    indexed = store.manifest.chunk_ids("fire.json")
+
+    # тот же документ в другом форматировании: хэш файла изменился
+    items = json.loads(path.read_text(encoding="utf-8"))
+    path.write_text(json.dumps(items, ensure_ascii=False, indent=2), encoding="utf-8")
+    chunks = store._load_and_process_file(path)
+    store.apply_document_changes([path], [])
+
+    assert IndexManifest.chunk_keys("fire.json", chunks) == list(indexed)
+    assert store.embedder.embedded == 0
+    assert store.manifest.chunk_ids("fire.json") == indexed
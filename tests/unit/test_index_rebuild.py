@@ -0,0 +1,110 @@
+﻿from functools import partial
+
+import pytest
+
+from helpers import FakeEmbedder, write_items
+
+from src.core.storage.vector_db import VectorStore
+
+
+def open_store(tmp_path, embedder_factory=FakeEmbedder):
+    store = VectorStore(
+        data_dir=str(tmp_path / "documents"),
+        index_dir=str(tmp_path / "index"),
+        embedder=FakeEmbedder(),
+        embedder_factory=embedder_factory,
+    )
+    store.watcher.stop()
+    return store
+
+
+@pytest.fixture
+def store(tmp_path):
+    data_dir = tmp_path / "documents"
+    data_dir.mkdir()
+    write_items(data_dir / "fire.json", ["Звонить 112.", "Покинуть здание."])
+    write_items(data_dir / "flood.json", ["Подняться выше."])
+
+    store = open_store(tmp_path)
+    store.create_index()
+    store.embedder.embedded = 0
+    yield store
+    store.watcher = None
+
+
+def texts(store, query):
+    return [r["text"] for r in store.search(query, 3, -1.0)]
+
+
+def test_rebuild_switches_version_and_rollback_restores_it(store, tmp_path):
+    old_index, old_base = store.index, store.store.base_name
+    write_items(store.data_dir / "fire.json", ["Звонить 101.", "Покинуть здание."])
+
+    assert store.rebuild_index(wait=True).result() is True
+
+    assert store.index is not old_index
+    assert store.store.previous_base == old_base
+    assert store.embedder.embedded == 0
+    assert "Звонить 101." in texts(store, "Звонить 101.")
+    assert "Звонить 112." in [
+        r["text"]
+        for r, _ in old_index.search_batch(store.embedder.embed(["Звонить 112."]), 3)[0]
+    ]
+    assert not (store.index_dir / store.store.REBUILD_DIR).exists()
+
+    new_base = store.store.base_name
+    assert store.rollback_index()
+    assert store.store.base_name == old_base
+    assert store.store.previous_base == new_base
+    # сверка после отката применила изменение файла к прежней базе
+    assert "Звонить 101." in texts(store, "Звонить 101.")
+
+    reopened = open_store(tmp_path)
+    assert reopened.store.base_name == old_base
+    assert reopened.store.previous_base == new_base
+    assert texts(reopened, "Звонить 101.") == texts(store, "Звонить 101.")
+    reopened.watcher = None
+
+
+def test_failed_verification_keeps_current_version(store):
+    store.embedder_factory = partial(FakeEmbedder, dim=16)
+    old_index, old_base = store.index, store.store.base_name
+
+    assert store.rebuild_index(wait=True).result() is False
+
+    assert store.index is old_index
+    assert store.store.base_name == old_base
+    assert store.store.previous_base is None
+    assert not (store.index_dir / store.store.REBUILD_DIR).exists()
+    assert texts(store, "Звонить 112.")[0] == "Звонить 112."
+
+
+def test_broken_base_is_quarantined_and_previous_base_loaded(store, tmp_path):
+    old_base = store.store.base_name
+    write_items(store.data_dir / "fire.json", ["Звонить 101.", "Покинуть здание."])
+    assert store.rebuild_index(wait=True).result() is True
+    new_base = store.store.base_name
+    (store.index_dir / new_base / "faiss.index").write_bytes(b"broken")
+
+    reopened = open_store(tmp_path)
+
+    assert reopened.store.base_name == old_base
+    assert reopened.store.previous_base is None
+    quarantined = store.index_dir / store.store.QUARANTINE_DIR / new_base
+    assert (quarantined / "base" / "faiss.index").read_bytes() == b"broken"
+    # сверка после отката догнала изменение файла
+    assert texts(reopened, "Звонить 101.")[0] == "Звонить 101."
+    reopened.watcher = None
+
+
+def test_index_is_recreated_only_when_no_base_loads(store, tmp_path):
+    base = store.store.base_name
+    (store.index_dir / base / "faiss.index").write_bytes(b"broken")
+
+    reopened = open_store(tmp_path)
+
+    assert reopened.index is None
+    assert not (store.index_dir / "CURRENT").exists()
+    quarantined = store.index_dir / store.store.QUARANTINE_DIR / base
+    assert (quarantined / "base" / "faiss.index").exists()
+    reopened.watcher = None
@@ -0,0 +1,102 @@
+﻿import threading
+import time
+from pathlib import Path
+
+from src.core.storage.ingestion_queue import IngestionQueue
+
+
+class Recorder:
+    def __init__(self):
+        self.batches = []
+        self.rescans = 0
+
+    def apply(self, updated, deleted):
+        self.batches.append((sorted(updated), sorted(deleted)))
+
+    def rescan(self):
+        self.rescans += 1
+
+
+def test_events_are_coalesced_into_one_batch():
+    recorder = Recorder()
+    queue = IngestionQueue(recorder.apply, debounce=0.05)
+    paths = [Path(f"doc_{i}.json") for i in range(3)]
+    for _ in range(4):
+        for path in paths:
+            queue.submit(path, "update")
+
+    assert queue.drain(timeout=5)
+    queue.stop()
+    assert recorder.batches == [(paths, [])]
+    stats = queue.stats()
+    assert stats["events"] == 12
+    assert stats["coalesced"] == 9
+    assert stats["batches"] == 1
+
+
+def test_latest_event_for_path_wins():
+    recorder = Recorder()
+    queue = IngestionQueue(recorder.apply, debounce=0.05)
+    queue.submit(Path("a.json"), "update")
+    queue.submit(Path("a.json"), "delete")
+    queue.submit(Path("b.json"), "delete")
+    queue.submit(Path("b.json"), "update")
+
+    queue.drain(timeout=5)
+    queue.stop()
+    assert recorder.batches == [([Path("b.json")], [Path("a.json")])]
+
+
+def test_changes_wait_for_quiet_window():
+    recorder = Recorder()
+    queue = IngestionQueue(recorder.apply, debounce=0.3)
+    for _ in range(5):
+        queue.submit(Path("a.json"), "update")
+        time.sleep(0.1)
+    assert recorder.batches == []
+
+    time.sleep(0.5)
+    queue.stop()
+    assert len(recorder.batches) == 1
+
+
+def test_overflow_falls_back_to_full_rescan():
+    recorder = Recorder()
+    queue = IngestionQueue(
+        recorder.apply, rescan_fn=recorder.rescan, debounce=10, max_pending=2
+    )
+    for i in range(5):
+        queue.submit(Path(f"doc_{i}.json"), "update")
+
+    queue.drain(timeout=5)
+    queue.stop()
+    assert recorder.rescans == 1
+    assert recorder.batches == []
+    assert queue.stats()["overflows"] == 1
+
+
+def test_stop_applies_pending_changes():
+    recorder = Recorder()
+    queue = IngestionQueue(recorder.apply, debounce=60)
+    queue.submit(Path("a.json"), "update")
+
+    stopper = threading.Thread(target=queue.stop)
+    stopper.start()
+    stopper.join(5)
+    assert recorder.batches == [([Path("a.json")], [])]
+
+
+def test_drain_does_not_disable_debounce_for_later_events():
+    recorder = Recorder()
+    queue = IngestionQueue(recorder.apply, debounce=0.3)
+    assert queue.drain(timeout=5)
+
+    queue.submit(Path("a.json"), "update")
+    time.sleep(0.1)
+    assert recorder.batches == []
+
+    assert queue.drain(timeout=5)
+    queue.submit(Path("b.json"), "update")
+    time.sleep(0.1)
+    queue.stop()
+    assert recorder.batches == [([Path("a.json")], []), ([Path("b.json")], [])]
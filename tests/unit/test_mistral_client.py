@@ -0,0 +1,268 @@
+﻿import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.core.llm.endpoint_router import EndpointRouter
+from src.core.llm.mistral_client import LLMRequestError, MistralAPIClient
+from src.core.llm.response_cache import ResponseCache
+
+
+class ChatHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(body)
+        self.server.auth.append(self.headers.get("Authorization"))
+        time.sleep(self.server.delay)
+        prompt = body["messages"][0]["content"]
+
+        if self.server.failures:
+            status = self.server.failures.pop(0)
+            payload = b'{"message": "rate limited"}'
+            self.send_response(status)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for token in ["Ответ", " на", " вопрос"]:
+                event = {"choices": [{"delta": {"content": token}}]}
+                self._write_chunk(f"data: {json.dumps(event)}\n\n")
+                time.sleep(self.server.stall)
+            self._write_chunk("data: [DONE]\n\n")
+            self._write_chunk("")
+            return
+
+        payload = json.dumps(
+            {"choices": [{"message": {"content": f" эхо: {prompt} "}}]}
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _write_chunk(self, text: str):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ChatHandler)
+    server.requests = []
+    server.auth = []
+    server.failures = []
+    server.delay = 0
+    server.stall = 0
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stop_server(server):
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def chat_server():
+    server = start_server()
+    yield server
+    stop_server(server)
+
+
+@pytest.fixture
+def backup_server():
+    server = start_server()
+    yield server
+    stop_server(server)
+
+
+@pytest.fixture
+def client(chat_server):
+    client = MistralAPIClient("test-key", max_retries=1)
+    client.base_url = chat_server.url
+    client.max_backoff = 0.01
+    yield client
+    client.close()
+
+
+def test_generate_reuses_session(client, chat_server):
+    assert client.generate("пожар") == "эхо: пожар"
+    assert client.generate("112") == "эхо: 112"
+    assert len(chat_server.requests) == 2
+
+
+def test_agenerate(client):
+    assert asyncio.run(client.agenerate("пожар")) == "эхо: пожар"
+
+
+def test_generate_stream_yields_tokens(client, chat_server):
+    tokens = list(client.generate_stream("пожар"))
+    assert tokens == ["Ответ", " на", " вопрос"]
+    assert chat_server.requests[0]["stream"] is True
+
+
+def test_broken_stream_raises_instead_of_yielding_text(client, chat_server):
+    client.cache = ResponseCache()
+    client.timeout = 0.3
+    chat_server.stall = 1.0
+    tokens = []
+    with pytest.raises(LLMRequestError):
+        for token in client.generate_stream("пожар"):
+            tokens.append(token)
+    assert tokens == ["Ответ"]
+    assert client.cache.get(client._cache_key(client._build_payload("пожар"))) is None
+
+    chat_server.stall = 0
+    chat_server.failures = [400]
+    with pytest.raises(LLMRequestError):
+        list(client.generate_stream("пожар"))
+
+
+def test_cached_response_skips_request(client, chat_server):
+    client.cache = ResponseCache()
+    assert client.generate("пожар") == "эхо: пожар"
+    assert client.generate("пожар") == "эхо: пожар"
+    assert len(chat_server.requests) == 1
+
+
+def test_throttled_request_is_retried(client, chat_server):
+    client.max_retries = 3
+    chat_server.failures = [429, 503]
+    assert client.generate("пожар") == "эхо: пожар"
+    assert len(chat_server.requests) == 3
+    assert client.rate_limiter.stats()["throttled"] == 1
+
+
+def test_client_error_is_not_retried(client, chat_server):
+    client.max_retries = 3
+    chat_server.failures = [400]
+    with pytest.raises(LLMRequestError):
+        client.generate("пожар")
+    assert len(chat_server.requests) == 1
+
+
+def test_slow_request_is_hedged_to_backup_endpoint(chat_server, backup_server):
+    chat_server.delay = 1.5
+    client = MistralAPIClient(
+        "test-key",
+        max_retries=1,
+        endpoints=[{"base_url": chat_server.url}, {"base_url": backup_server.url}],
+    )
+    client.router.latencies.extend([0.05] * 20)
+
+    started = time.monotonic()
+    assert client.generate("Срочно") == "эхо: Срочно"
+    assert time.monotonic() - started < 1.0
+    assert len(chat_server.requests) == 1
+    assert len(backup_server.requests) == 1
+    assert client.stats()["hedge_wins"] == 1
+    client.close()
+
+
+def test_hedge_delay_starts_after_rate_limiter(chat_server, backup_server):
+    client = MistralAPIClient(
+        "test-key",
+        max_retries=1,
+        endpoints=[{"base_url": chat_server.url}, {"base_url": backup_server.url}],
+    )
+    client.router.latencies.extend([0.2] * 20)
+    client.rate_limiter.paused_until = time.monotonic() + 0.6
+
+    assert client.generate("Срочно") == "эхо: Срочно"
+    assert len(chat_server.requests) == 1
+    assert backup_server.requests == []
+    assert client.stats()["hedged"] == 0
+    client.close()
+
+
+def test_response_is_cached_under_serving_endpoint_model(chat_server):
+    client = MistralAPIClient(
+        "test-key",
+        max_retries=1,
+        cache=ResponseCache(),
+        endpoints=[{"base_url": chat_server.url, "model": "primary-model"}],
+    )
+    assert client.generate("пожар") == "эхо: пожар"
+    assert client.generate("пожар") == "эхо: пожар"
+    assert len(chat_server.requests) == 1
+
+    client.router.endpoints[0].model = "other-model"
+    assert client.generate("пожар") == "эхо: пожар"
+    assert len(chat_server.requests) == 2
+    client.close()
+
+
+def test_failing_endpoint_is_avoided_on_retry(chat_server, backup_server):
+    chat_server.failures = [503]
+    client = MistralAPIClient(
+        "test-key",
+        max_retries=2,
+        endpoints=[
+            {"base_url": chat_server.url, "model": "primary-model"},
+            {"base_url": backup_server.url, "api_key": "backup-key"},
+        ],
+    )
+    client.max_backoff = 0.01
+
+    assert client.generate("Вопрос") == "эхо: Вопрос"
+    assert chat_server.requests[0]["model"] == "primary-model"
+    assert backup_server.requests[0]["model"] == "mistral-medium"
+    client.close()
+
+
+def test_authorization_is_sent_only_with_endpoint_key(chat_server, backup_server):
+    client = MistralAPIClient(
+        "mistral-key",
+        max_retries=1,
+        endpoints=[
+            {"base_url": chat_server.url},
+            {"base_url": backup_server.url, "api_key": "backup-key"},
+        ],
+    )
+    client.router.endpoints[1].consecutive_failures = 1
+    assert client.generate("Вопрос") == "эхо: Вопрос"
+    client.router.endpoints[0].consecutive_failures = 1
+    assert client.generate("Вопрос") == "эхо: Вопрос"
+
+    assert chat_server.auth == [None]
+    assert backup_server.auth == ["Bearer backup-key"]
+    assert "Authorization" not in client.session.headers
+    client.close()
+
+    mistral = MistralAPIClient(
+        "mistral-key", endpoints=[{"base_url": "https://api.mistral.ai/v1"}]
+    )
+    assert mistral.router.endpoints[0].api_key == "mistral-key"
+    mistral.close()
+
+
+def test_router_cools_down_after_repeated_failures():
+    router = EndpointRouter(
+        [{"base_url": "http://a"}, {"base_url": "http://b"}],
+        failure_threshold=2,
+        cooldown=60,
+    )
+    a, b = router.endpoints
+    for _ in range(2):
+        router.record_failure(router.choose(exclude=(b,)))
+
+    assert not router.stats()["http://a"]["healthy"]
+    assert router.choose() is b
+    assert router.choose(exclude=(b,)) is b
@@ -0,0 +1,28 @@
+﻿import numpy as np
+import pytest
+
+from src.core.embedding.query_context import QueryContext
+
+
+class CachingEmbedder:
+    """Эмбеддер, который отдает один и тот же массив из своего кэша"""
+
+    def __init__(self):
+        self.calls = 0
+        self.cached = np.ones(4, dtype=np.float32)
+
+    def embed_query(self, query):
+        self.calls += 1
+        return self.cached
+
+
+def test_embedding_is_computed_once_and_read_only():
+    embedder = CachingEmbedder()
+    ctx = QueryContext("пожар", embedder)
+
+    assert ctx.embedding is ctx.embedding
+    assert embedder.calls == 1
+    with pytest.raises(ValueError):
+        ctx.embedding *= 2
+    assert np.array_equal(embedder.cached, np.ones(4))
+    assert np.array_equal(QueryContext("пожар", embedder).embedding, np.ones(4))
@@ -0,0 +1,53 @@
+﻿import threading
+import time
+
+from src.core.llm.rate_limiter import RateLimiter
+
+
+def test_request_bucket_spaces_out_requests():
+    limiter = RateLimiter(requests_per_minute=600, max_concurrency=4)
+    limiter.request_bucket.tokens = 1
+
+    started = time.monotonic()
+    for _ in range(3):
+        with limiter.acquire():
+            pass
+    assert time.monotonic() - started >= 0.15
+
+
+def test_throttle_halves_concurrency_and_success_recovers():
+    limiter = RateLimiter(max_concurrency=8)
+    limiter.record_throttle()
+    assert limiter.concurrency_limit == 4
+    for _ in range(20):
+        limiter.record_success()
+    assert 4 < limiter.concurrency_limit <= 8
+
+
+def test_retry_after_pauses_all_callers():
+    limiter = RateLimiter()
+    limiter.record_throttle(retry_after=0.2)
+
+    started = time.monotonic()
+    with limiter.acquire():
+        pass
+    assert time.monotonic() - started >= 0.15
+
+
+def test_concurrency_limit_is_respected():
+    limiter = RateLimiter(requests_per_minute=10_000, max_concurrency=2)
+    peak = []
+    lock = threading.Lock()
+
+    def worker():
+        with limiter.acquire():
+            with lock:
+                peak.append(limiter.in_flight)
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=worker) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) <= 2
@@ -0,0 +1,45 @@
+﻿import time
+
+from src.core.llm.response_cache import ResponseCache
+
+
+def test_memory_lru_eviction():
+    cache = ResponseCache(max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+
+
+def test_entry_ttl():
+    cache = ResponseCache(ttl=60)
+    cache.set("short", "ответ", ttl=0.05)
+    cache.set("long", "ответ")
+    time.sleep(0.1)
+
+    assert cache.get("short") is None
+    assert cache.get("long") == "ответ"
+    assert cache.stats()["expired"] == 1
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    db_path = tmp_path / "llm_cache.sqlite"
+    key = ResponseCache.make_key("mistral-medium", {"temperature": 0.4}, "пожар")
+    ResponseCache(db_path=db_path).set(key, "ответ")
+
+    cache = ResponseCache(db_path=db_path)
+    assert cache.get(key) == "ответ"
+    assert cache.get(key) == "ответ"
+    stats = cache.stats()
+    assert stats["disk_hits"] == 1
+    assert stats["memory_hits"] == 1
+
+
+def test_key_depends_on_params():
+    first = ResponseCache.make_key("m", {"temperature": 0.4}, "пожар")
+    second = ResponseCache.make_key("m", {"temperature": 0.7}, "пожар")
+    assert first != second
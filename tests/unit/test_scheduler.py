@@ -0,0 +1,134 @@
+﻿import threading
+import time
+
+import pytest
+
+from src.core.llm.scheduler import (
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_VALIDATION,
+    LLMScheduler,
+)
+from src.core.validation.response_validator import ResponseValidator
+
+
+class GatedClient:
+    """Клиент, который отвечает только после открытия шлюза"""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.started = threading.Event()
+        self.calls = []
+
+    def generate(self, prompt):
+        self.started.set()
+        self.gate.wait(5)
+        self.calls.append(prompt)
+        return f"ответ: {prompt}"
+
+
+@pytest.fixture
+def busy_scheduler():
+    """Планировщик с одним воркером, занятым первым запросом"""
+    client = GatedClient()
+    scheduler = LLMScheduler(client, workers=1)
+    first = scheduler.submit("занят", priority=PRIORITY_BATCH)
+    client.started.wait(5)
+    yield scheduler, client, first
+    client.gate.set()
+    scheduler.shutdown()
+
+
+def test_interactive_served_before_queued_batch(busy_scheduler):
+    scheduler, client, first = busy_scheduler
+    batch = [scheduler.submit(f"b{i}", priority=PRIORITY_BATCH) for i in range(3)]
+    validation = scheduler.submit("v", priority=PRIORITY_VALIDATION)
+    interactive = scheduler.submit("i", priority=PRIORITY_INTERACTIVE)
+
+    assert scheduler.queue_depths()["batch"] == 3
+    client.gate.set()
+    for future in [first, interactive, validation, *batch]:
+        future.result(5)
+    assert client.calls == ["занят", "i", "v", "b0", "b1", "b2"]
+
+
+def test_owners_are_served_round_robin(busy_scheduler):
+    scheduler, client, first = busy_scheduler
+    futures = [
+        scheduler.submit(f"a{i}", priority=PRIORITY_BATCH, owner="a") for i in range(3)
+    ]
+    futures.append(scheduler.submit("b0", priority=PRIORITY_BATCH, owner="b"))
+
+    client.gate.set()
+    for future in futures:
+        future.result(5)
+    assert client.calls == ["занят", "a0", "b0", "a1", "a2"]
+
+
+def test_cancelled_and_expired_requests_are_not_sent(busy_scheduler):
+    scheduler, client, first = busy_scheduler
+    dropped = [
+        scheduler.submit(f"x{i}", priority=PRIORITY_BATCH, owner="x") for i in range(2)
+    ]
+    gone = scheduler.submit("gone")
+    expired = scheduler.submit("late", deadline=0)
+    kept = scheduler.submit("kept")
+
+    assert scheduler.cancel_owner("x") == 2
+    assert gone.cancel()
+    client.gate.set()
+    kept.result(5)
+
+    assert all(future.cancelled() for future in dropped + [expired])
+    assert client.calls == ["занят", "kept"]
+    stats = scheduler.stats()
+    assert stats["batch"]["cancelled"] == 2
+    assert stats["interactive"]["expired"] == 1
+
+
+def test_priority_context_lowers_scheduled_client():
+    client = GatedClient()
+    client.gate.set()
+    scheduler = LLMScheduler(client, workers=1)
+    interactive = scheduler.client_for(PRIORITY_INTERACTIVE)
+
+    with scheduler.priority(PRIORITY_BATCH, owner="пакет"):
+        assert scheduler.effective(PRIORITY_INTERACTIVE) == (PRIORITY_BATCH, "пакет")
+        assert interactive.generate("q") == "ответ: q"
+    assert scheduler.effective(PRIORITY_INTERACTIVE) == (PRIORITY_INTERACTIVE, None)
+    assert scheduler.stats()["batch"]["completed"] == 1
+    scheduler.shutdown()
+
+
+def test_waiting_batch_is_aged_ahead_of_new_interactive():
+    client = GatedClient()
+    scheduler = LLMScheduler(client, workers=1, aging=0.1)
+    first = scheduler.submit("занят", priority=PRIORITY_BATCH)
+    client.started.wait(5)
+    batch = scheduler.submit("b", priority=PRIORITY_BATCH)
+    time.sleep(0.2)
+    interactive = scheduler.submit("i", priority=PRIORITY_INTERACTIVE)
+
+    client.gate.set()
+    for future in [first, batch, interactive]:
+        future.result(5)
+    assert client.calls == ["занят", "b", "i"]
+    scheduler.shutdown()
+
+
+def test_validation_uses_scheduler_queues_and_cancels_on_timeout(busy_scheduler):
+    scheduler, client, first = busy_scheduler
+    validator = ResponseValidator(
+        scheduler.client_for(PRIORITY_VALIDATION), queue_timeout=0.1, local_rules=False
+    )
+
+    with scheduler.priority(PRIORITY_BATCH, owner="пакет"):
+        validation = validator.validate_response("вопрос", "контекст", "ответ", "п")
+
+    assert len(validation["timed_out"]) == 6
+    assert scheduler.stats()["batch"]["submitted"] == 1 + 6
+    assert scheduler.stats()["validation"]["submitted"] == 0
+    assert scheduler.queue_depths()["batch"] == 0
+    client.gate.set()
+    first.result(5)
+    assert client.calls == ["занят"]
@@ -0,0 +1,165 @@
+﻿import pytest
+
+from helpers import FakeEmbedder, write_items
+
+from src.core.storage.vector_db import VectorStore
+
+
+def open_store(tmp_path, index_type="flat", fast_start=False):
+    store = VectorStore(
+        data_dir=str(tmp_path / "documents"),
+        index_dir=str(tmp_path / "index"),
+        embedder=FakeEmbedder(),
+        index_type=index_type,
+        fast_start=fast_start,
+    )
+    store.watcher.stop()
+    store.watcher = None
+    return store
+
+
+@pytest.fixture(params=["flat", "hnsw"])
+def store(tmp_path, request):
+    data_dir = tmp_path / "documents"
+    data_dir.mkdir()
+    write_items(data_dir / "fire.json", [f"Пункт {i}. Звонить 112." for i in range(8)])
+    write_items(data_dir / "flood.json", ["Подняться выше.", "Ждать спасателей."])
+
+    store = open_store(tmp_path, request.param)
+    store.create_index()
+    return store
+
+
+def index_state(store):
+    return (
+        sorted(record["text"] for record in store.index.records.values()),
+        store.manifest.files,
+        store.manifest.next_id,
+    )
+
+
+def test_update_appends_segment_instead_of_rewriting_base(store, tmp_path):
+    base = store.index_dir / store.store.base_name
+    base_mtime = (base / "faiss.index").stat().st_mtime_ns
+
+    write_items(store.data_dir / "new.json", ["Новый приказ."])
+    store.handle_document_update(store.data_dir / "new.json")
+    store.handle_document_delete(store.data_dir / "flood.json")
+
+    assert (base / "faiss.index").stat().st_mtime_ns == base_mtime
+    assert len(list(store.store.segments_dir.glob("seg-*.npz"))) == 1
+    assert store.store.stats()["wal_entries"] == 2
+
+    reloaded = open_store(tmp_path, store.index_type)
+    assert index_state(reloaded) == index_state(store)
+    found = reloaded.search("", 1, 0.0, reloaded.embedder.embed(["Новый приказ."])[0])
+    assert found[0]["text"] == "Новый приказ."
+
+
+def test_torn_wal_tail_is_ignored(store, tmp_path):
+    write_items(store.data_dir / "new.json", ["Новый приказ."])
+    store.handle_document_update(store.data_dir / "new.json")
+    expected = index_state(store)
+
+    with open(store.store.wal_path, "a", encoding="utf-8") as f:
+        f.write('{"seq": 2, "segment": null, "add')
+
+    reloaded = open_store(tmp_path, store.index_type)
+    assert index_state(reloaded) == expected
+
+    write_items(reloaded.data_dir / "other.json", ["Еще приказ."])
+    reloaded.handle_document_update(reloaded.data_dir / "other.json")
+    assert [entry["seq"] for entry in reloaded.store._read_wal()] == [1, 2]
+
+
+def test_compaction_publishes_new_base(store, tmp_path):
+    old_base = store.store.base_name
+    for i in range(3):
+        write_items(store.data_dir / f"new_{i}.json", [f"Новый приказ {i}."])
+        store.handle_document_update(store.data_dir / f"new_{i}.json")
+
+    store.store.compact(lambda: (store.index, store.manifest))
+
+    assert store.store.base_name != old_base
+    assert not (store.index_dir / old_base).exists()
+    assert (store.index_dir / "CURRENT").read_text() == store.store.base_name
+    assert store.store.wal_path.read_text() == ""
+    assert not list(store.store.segments_dir.glob("seg-*"))
+
+    reloaded = open_store(tmp_path, store.index_type)
+    assert index_state(reloaded) == index_state(store)
+
+
+def test_interrupted_compaction_keeps_current_base(store, tmp_path):
+    write_items(store.data_dir / "new.json", ["Новый приказ."])
+    store.handle_document_update(store.data_dir / "new.json")
+    expected = index_state(store)
+
+    # снимок записан, но CURRENT не переключен
+    (store.index_dir / "base-000099").mkdir()
+    (store.index_dir / "base-000099" / "faiss.index").write_bytes(b"partial")
+
+    reloaded = open_store(tmp_path, store.index_type)
+    assert index_state(reloaded) == expected
+    assert not (store.index_dir / "base-000099").exists()
+
+
+def test_legacy_root_index_is_loaded_and_migrated(store, tmp_path):
+    expected = index_state(store)
+    base = store.index_dir / store.store.base_name
+    for file in base.iterdir():
+        if file.name == "meta.json":
+            file.unlink()
+        else:
+            file.rename(store.index_dir / file.name)
+    base.rmdir()
+    (store.index_dir / "CURRENT").unlink()
+
+    reloaded = open_store(tmp_path, store.index_type)
+    assert index_state(reloaded) == expected
+
+    reloaded.store.compact(lambda: (reloaded.index, reloaded.manifest))
+    assert not (store.index_dir / "faiss.index").exists()
+    assert index_state(open_store(tmp_path, store.index_type)) == expected
+
+
+def test_fast_start_replays_and_compacts_mapped_index(store, tmp_path):
+    write_items(store.data_dir / "new.json", ["Новый приказ."])
+    store.handle_document_update(store.data_dir / "new.json")
+    expected = index_state(store)
+
+    mapped = open_store(tmp_path, store.index_type, fast_start=True)
+    assert mapped.index.mapped
+    assert index_state(mapped) == expected
+
+    mapped.handle_document_delete(store.data_dir / "flood.json")
+    mapped.store.compact(lambda: (mapped.index, mapped.manifest))
+    assert mapped.index.mapped
+
+    reloaded = open_store(tmp_path, store.index_type)
+    assert index_state(reloaded) == index_state(mapped)
+    found = reloaded.search("", 1, 0.0, reloaded.embedder.embed(["Новый приказ."])[0])
+    assert found[0]["text"] == "Новый приказ."
+
+
+def test_second_writer_catches_up_before_appending(store, tmp_path):
+    other = open_store(tmp_path, store.index_type)
+
+    write_items(store.data_dir / "new.json", ["Новый приказ."])
+    store.handle_document_update(store.data_dir / "new.json")
+    write_items(store.data_dir / "other.json", ["Еще приказ."])
+    other.handle_document_update(other.data_dir / "other.json")
+
+    assert [entry["seq"] for entry in other.store._read_wal()] == [1, 2]
+    added = [entry["added"] for entry in other.store._read_wal()]
+    assert not set(added[0]) & set(added[1])
+    assert "new.json" in other.manifest.files
+
+    reloaded = open_store(tmp_path, store.index_type)
+    assert index_state(reloaded) == index_state(other)
+
+    # после уплотнения в другом процессе база загружается заново
+    other.store.compact(lambda: (other.index, other.manifest))
+    store.handle_document_delete(store.data_dir / "flood.json")
+    assert store.store.base_name == other.store.base_name
+    assert index_state(open_store(tmp_path, store.index_type)) == index_state(store)
@@ -0,0 +1,46 @@
+﻿import numpy as np
+
+from src.core.storage.semantic_cache import SemanticCache
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_similar_query_hits_cache():
+    cache = SemanticCache(threshold=0.9)
+    cache.add("пожар в квартире", _unit([1, 0, 0]), "ответ", {}, ["fire.json"])
+
+    assert cache.lookup(_unit([1, 0.1, 0]))["response"] == "ответ"
+    assert cache.lookup(_unit([0, 1, 0])) is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_document_change_invalidates_entries():
+    cache = SemanticCache(threshold=0.9)
+    cache.add("пожар", _unit([1, 0, 0]), "ответ 1", {}, ["fire.json"])
+    cache.add("наводнение", _unit([0, 1, 0]), "ответ 2", {}, ["flood.json"])
+
+    assert cache.invalidate_source("fire.json") == 1
+    assert cache.lookup(_unit([1, 0, 0])) is None
+    assert cache.lookup(_unit([0, 1, 0]))["response"] == "ответ 2"
+
+
+def test_entries_are_scoped_by_prompt():
+    cache = SemanticCache(threshold=0.9)
+    cache.add("пожар", _unit([1, 0, 0]), "ответ", {}, ["fire.json"], prompt="МЧС")
+    cache.add(
+        "пожар?", _unit([1, 0.05, 0]), "кратко", {}, ["fire.json"], prompt="Кратко"
+    )
+
+    assert cache.lookup(_unit([1, 0, 0]), "МЧС")["response"] == "ответ"
+    assert cache.lookup(_unit([1, 0, 0]), "Кратко")["response"] == "кратко"
+    assert cache.lookup(_unit([1, 0, 0]), "Другой") is None
+
+
+def test_answers_without_sources_are_not_cached():
+    cache = SemanticCache(threshold=0.9)
+    assert not cache.add("пожар", _unit([1, 0, 0]), "ответ", {}, [])
+    assert cache.lookup(_unit([1, 0, 0])) is None
+    assert cache.stats()["entries"] == 0
@@ -19,7 +19,7 @@ def test_vector_store(tmp_path):
 def test_index_creation(test_vector_store):
     test_vector_store.create_index()
     assert test_vector_store.index is not None
-    assert len(test_vector_store.documents) > 0
+    assert len(test_vector_store.index) > 0
 
 
 def test_search(test_vector_store):
@@ -0,0 +1,136 @@
+﻿import time
+
+from src.core.validation.response_validator import ResponseValidator
+
+
+class FakeGenerator:
+    def __init__(self, slow_marker=None, delay=0.0):
+        self.slow_marker = slow_marker
+        self.delay = delay
+        self.prompts = []
+
+    def generate(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        if self.slow_marker and self.slow_marker in prompt:
+            time.sleep(self.delay)
+        if "шкале 1-5" in prompt:
+            return "5"
+        if "чек-листу" in prompt:
+            return "4"
+        if "Выяви нарушения" in prompt:
+            return "НЕТ"
+        return "ДА"
+
+
+def test_validation_result_shape():
+    validator = ResponseValidator(FakeGenerator(), local_rules=False)
+    validation = validator.validate_response("вопрос", "контекст", "ответ", "промпт")
+    assert validation == {
+        "relevance": 5,
+        "accuracy": True,
+        "completeness": 4,
+        "safety": False,
+        "structure": True,
+        "sources": True,
+        "timed_out": [],
+    }
+
+
+def test_slow_criterion_times_out():
+    generator = FakeGenerator(slow_marker="Выяви нарушения", delay=1.0)
+    validator = ResponseValidator(
+        generator, criterion_timeouts={"safety": 0.1}, local_rules=False
+    )
+    validation = validator.validate_response("вопрос", "контекст", "ответ", "промпт")
+    assert validation["safety"] is None
+    assert validation["timed_out"] == ["safety"]
+    assert validation["relevance"] == 5
+    assert validator.timeout_stats["safety"] == 1
+
+
+def test_criterion_timeout_starts_when_check_runs():
+    generator = FakeGenerator(slow_marker="Ответ", delay=0.3)
+    validator = ResponseValidator(
+        generator, max_workers=1, criterion_timeout=0.5, local_rules=False
+    )
+    validation = validator.validate_response("вопрос", "контекст", "ответ", "промпт")
+    assert validation["timed_out"] == []
+    assert validation["relevance"] == 5
+
+
+class FailingGenerator(FakeGenerator):
+    def generate(self, prompt: str) -> str:
+        if "чек-листу" in prompt:
+            raise ConnectionError("нет соединения")
+        return super().generate(prompt)
+
+
+def test_failed_criterion_is_not_validated():
+    validator = ResponseValidator(FailingGenerator(), local_rules=False)
+    validation = validator.validate_response("вопрос", "контекст", "ответ", "промпт")
+    assert validation["completeness"] is None
+    assert validation["timed_out"] == ["completeness"]
+    assert validation["accuracy"] is True
+
+
+class StructuredGenerator(FakeGenerator):
+    def __init__(self, answer: str):
+        super().__init__()
+        self.answer = answer
+
+    def generate(self, prompt: str) -> str:
+        if "сразу по всем критериям" in prompt:
+            self.prompts.append(prompt)
+            return self.answer
+        return super().generate(prompt)
+
+
+def test_json_mode_single_call():
+    generator = StructuredGenerator(
+        '{"relevance": 3, "accuracy": false, "completeness": 2, '
+        '"safety": false, "structure": true, "sources": false}'
+    )
+    validator = ResponseValidator(generator, mode="json", local_rules=False)
+    validation = validator.validate_response("вопрос", "контекст", "ответ", "промпт")
+    assert len(generator.prompts) == 1
+    assert validation["relevance"] == 3
+    assert validation["accuracy"] is False
+    assert validation["sources"] is False
+
+
+def test_json_mode_falls_back_for_missing_criteria():
+    generator = StructuredGenerator('{"relevance": 3, "accuracy": "да", "safety": ')
+    validator = ResponseValidator(generator, mode="json", local_rules=False)
+    validation = validator.validate_response("вопрос", "контекст", "ответ", "промпт")
+    assert validation["relevance"] == 3
+    assert validation["accuracy"] is True
+    assert validation["completeness"] == 4
+    assert len(generator.prompts) == 1 + 4
+
+
+def test_local_rules_skip_llm_calls():
+    generator = FakeGenerator()
+    validator = ResponseValidator(generator)
+    response = (
+        "1. Вызвать пожарных по 112.\n"
+        "2. Покинуть опасную зону и начать эвакуацию.\n"
+        "3. Защитить органы дыхания влажной тканью.\n"
+        "⚠️ Не пользуйтесь лифтом [СП 5.13130.2009]"
+    )
+    validation = validator.validate_response("вопрос", "контекст", response, "промпт")
+    assert validation["sources"] is True
+    assert validation["structure"] is True
+    assert validation["completeness"] == 5
+    assert len(generator.prompts) == 3
+    assert validator.get_stats()["llm_calls_saved"] == 3
+
+
+def test_local_rules_leave_ambiguous_cases_to_llm():
+    generator = FakeGenerator()
+    validator = ResponseValidator(generator)
+    validation = validator.validate_response(
+        "вопрос", "контекст", "1. Выйти на улицу. См. ГОСТ 12.1.004", "промпт"
+    )
+    assert validation["sources"] is True
+    assert "sources" not in validator.get_stats()["local_decisions"]
+    assert len(generator.prompts) == 6